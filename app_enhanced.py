@@ -1,13 +1,17 @@
 import os
 import logging
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
 from werkzeug.utils import secure_filename
-import tempfile
 import uuid
 from utils.pdf_processor import PDFProcessor
 from utils.image_processor import ImageProcessor
+from utils.image_encoder import FORMAT_EXTENSIONS, normalize_format, target_size_bytes
 from utils.video_processor import VideoProcessor
 from utils.audio_processor import AudioProcessor
+from utils.overlay_cache import PDFStampSet, watermark_opacity
+from utils.media_probe import FFMPEG_AVAILABLE, probe_media, detect_format, validate_range
+from utils.artifact_store import get_store
+from utils.download import send_download
 from PIL import Image
 import io
 
@@ -19,7 +23,9 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-suntyn-ai")
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+# Outputs are written into the artifact store, which expires them
+artifacts = get_store()
+app.config['UPLOAD_FOLDER'] = artifacts.staging_dir
 
 # Tool categories with enhanced functionality
 TOOL_CATEGORIES = {
@@ -151,7 +157,7 @@ def process_pdf_tool(tool_id, request):
         if tool_id == 'pdf-merger':
             merged_pdf = PDFProcessor.merge_pdfs(files)
             output_filename = f"merged_pdf_{uuid.uuid4()}.pdf"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(merged_pdf.read())
@@ -170,7 +176,7 @@ def process_pdf_tool(tool_id, request):
             output_files = []
             for i, pdf in enumerate(split_pdfs):
                 output_filename = f"split_part_{i+1}_{uuid.uuid4()}.pdf"
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
                 
                 with open(output_path, 'wb') as f:
                     f.write(pdf.read())
@@ -191,7 +197,7 @@ def process_pdf_tool(tool_id, request):
             compressed_pdf = PDFProcessor.compress_pdf(files[0], compression_level)
             
             output_filename = f"compressed_pdf_{uuid.uuid4()}.pdf"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(compressed_pdf.read())
@@ -207,7 +213,7 @@ def process_pdf_tool(tool_id, request):
             text = PDFProcessor.extract_text(files[0])
             
             output_filename = f"extracted_text_{uuid.uuid4()}.txt"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write(text)
@@ -227,7 +233,7 @@ def process_pdf_tool(tool_id, request):
             output_files = []
             for i, img_buffer in enumerate(images):
                 output_filename = f"page_{i+1}_{uuid.uuid4()}.png"
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
                 
                 with open(output_path, 'wb') as f:
                     f.write(img_buffer.read())
@@ -250,7 +256,7 @@ def process_pdf_tool(tool_id, request):
             watermarked_pdf = PDFProcessor.add_watermark(files[0], watermark_text, position)
             
             output_filename = f"watermarked_pdf_{uuid.uuid4()}.pdf"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(watermarked_pdf.read())
@@ -283,7 +289,7 @@ def process_image_tool(tool_id, request):
             resized_image = ImageProcessor.resize_image(image, width, height, maintain_aspect)
             
             output_filename = f"resized_image_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             resized_image.save(output_path)
             
             return jsonify({
@@ -296,20 +302,32 @@ def process_image_tool(tool_id, request):
         elif tool_id == 'image-compress':
             quality = int(request.form.get('quality', 85))
             format_type = request.form.get('format', 'JPEG')
+            try:
+                target_size = target_size_bytes(request.form.get('target_size_kb'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
-            compressed_image = ImageProcessor.compress_image(image, quality, format_type)
+            compressed_buffer = ImageProcessor.compress_image(image, quality, format_type, target_size=target_size)
             
-            extension = 'jpg' if format_type == 'JPEG' else 'png'
+            # Named after the format actually encoded (jpeg, webp, ...)
+            extension = FORMAT_EXTENSIONS[normalize_format(format_type)]
             output_filename = f"compressed_image_{uuid.uuid4()}.{extension}"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            compressed_image.save(output_path)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
-            return jsonify({
+            with open(output_path, 'wb') as f:
+                f.write(compressed_buffer.getbuffer())
+            
+            result = {
                 'success': True,
                 'output_file': output_filename,
                 'filename': f'compressed_image.{extension}',
                 'message': 'Image compressed successfully!'
-            })
+            }
+            size = compressed_buffer.getbuffer().nbytes
+            if target_size and size > target_size:
+                result['warning'] = (f'Could not reach {target_size / 1024:.0f} KB; '
+                                     f'the result is {size / 1024:.0f} KB')
+            return jsonify(result)
         
         elif tool_id == 'format-converter':
             target_format = request.form.get('target_format', 'PNG')
@@ -318,7 +336,7 @@ def process_image_tool(tool_id, request):
             
             extension = target_format.lower()
             output_filename = f"converted_image_{uuid.uuid4()}.{extension}"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(converted_buffer.read())
@@ -331,10 +349,11 @@ def process_image_tool(tool_id, request):
             })
         
         elif tool_id == 'bg-remover':
-            bg_removed_image = ImageProcessor.remove_background(image)
+            quality = request.form.get('quality', 'balanced')
+            bg_removed_image = ImageProcessor.remove_background(image, quality)
             
             output_filename = f"bg_removed_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             bg_removed_image.save(output_path)
             
             return jsonify({
@@ -350,7 +369,7 @@ def process_image_tool(tool_id, request):
             filtered_image = ImageProcessor.apply_filter(image, filter_type)
             
             output_filename = f"filtered_image_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             filtered_image.save(output_path)
             
             return jsonify({
@@ -363,12 +382,15 @@ def process_image_tool(tool_id, request):
         elif tool_id == 'image-watermark':
             watermark_text = request.form.get('watermark_text', 'SUNTYN AI')
             position = request.form.get('position', 'bottom-right')
-            opacity = float(request.form.get('opacity', 0.5))
+            try:
+                opacity = watermark_opacity(request.form.get('opacity'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
             watermarked_image = ImageProcessor.add_watermark(image, watermark_text, position, opacity)
             
             output_filename = f"watermarked_image_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             watermarked_image.save(output_path)
             
             return jsonify({
@@ -389,11 +411,17 @@ def process_video_tool(tool_id, request):
         return jsonify({'success': False, 'error': 'No files uploaded'})
     
     try:
+        # Header-only probe (cached by content hash) rejects non-video uploads
+        # before any decoding starts
+        media_info = probe_media(files[0]) if FFMPEG_AVAILABLE else None
+        if media_info is not None and not media_info['has_video']:
+            return jsonify({'success': False, 'error': 'The uploaded file has no video stream'})
+        
         if tool_id == 'audio-extractor':
             audio_data = VideoProcessor.extract_audio(files[0])
             
             output_filename = f"extracted_audio_{uuid.uuid4()}.mp3"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(audio_data.read())
@@ -412,7 +440,7 @@ def process_video_tool(tool_id, request):
             converted_video = VideoProcessor.convert_format(files[0], output_format, quality)
             
             output_filename = f"converted_video_{uuid.uuid4()}.{output_format}"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(converted_video.read())
@@ -428,11 +456,12 @@ def process_video_tool(tool_id, request):
             fps = int(request.form.get('fps', 10))
             duration = request.form.get('duration')
             duration = float(duration) if duration else None
+            output_format = 'webp' if request.form.get('format') == 'webp' else 'gif'
             
-            gif_data = VideoProcessor.create_gif(files[0], fps, duration)
+            gif_data = VideoProcessor.create_gif(files[0], fps, duration, output_format)
             
-            output_filename = f"created_gif_{uuid.uuid4()}.gif"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_filename = f"created_gif_{uuid.uuid4()}.{output_format}"
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(gif_data.read())
@@ -440,8 +469,30 @@ def process_video_tool(tool_id, request):
             return jsonify({
                 'success': True,
                 'output_file': output_filename,
-                'filename': 'created_animation.gif',
-                'message': 'GIF created successfully!'
+                'filename': f'created_animation.{output_format}',
+                'message': 'GIF created successfully!' if output_format == 'gif' else 'Animated WebP created successfully!'
+            })
+        
+        elif tool_id == 'video-trimmer':
+            start_time = float(request.form.get('start_time', 0))
+            end_time = float(request.form.get('end_time', start_time + 10))
+            exact = request.form.get('mode', 'fast') == 'exact'
+            if media_info is not None:
+                start_time, end_time = validate_range(media_info, start_time, end_time)
+            
+            trimmed_video = VideoProcessor.trim_video(files[0], start_time, end_time, exact)
+            
+            output_filename = f"trimmed_video_{uuid.uuid4()}.mp4"
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
+            
+            with open(output_path, 'wb') as f:
+                f.write(trimmed_video.read())
+            
+            return jsonify({
+                'success': True,
+                'output_file': output_filename,
+                'filename': 'trimmed_video.mp4',
+                'message': 'Video trimmed successfully!'
             })
         
     except Exception as e:
@@ -455,14 +506,18 @@ def process_audio_tool(tool_id, request):
         return jsonify({'success': False, 'error': 'No files uploaded'})
     
     try:
+        media_info = probe_media(files[0]) if FFMPEG_AVAILABLE else None
+        if media_info is not None and not media_info['has_audio']:
+            return jsonify({'success': False, 'error': 'The uploaded file has no audio stream'})
+        
         if tool_id == 'audio-converter':
-            input_format = files[0].filename.split('.')[-1]
+            input_format = detect_format(files[0])
             output_format = request.form.get('output_format', 'mp3')
             
             converted_audio = AudioProcessor.convert_format(files[0], input_format, output_format)
             
             output_filename = f"converted_audio_{uuid.uuid4()}.{output_format}"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(converted_audio.read())
@@ -476,12 +531,12 @@ def process_audio_tool(tool_id, request):
         
         elif tool_id == 'audio-speed':
             speed_factor = float(request.form.get('speed_factor', 1.0))
-            input_format = files[0].filename.split('.')[-1]
+            input_format = detect_format(files[0])
             
             speed_changed_audio = AudioProcessor.change_speed(files[0], speed_factor, input_format)
             
             output_filename = f"speed_changed_audio_{uuid.uuid4()}.mp3"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(speed_changed_audio.read())
@@ -493,22 +548,131 @@ def process_audio_tool(tool_id, request):
                 'message': f'Audio speed changed by {speed_factor}x!'
             })
         
+        elif tool_id == 'audio-merger':
+            merged_audio = AudioProcessor.merge_audio(files)
+            
+            output_filename = f"merged_audio_{uuid.uuid4()}.mp3"
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
+            
+            with open(output_path, 'wb') as f:
+                f.write(merged_audio.read())
+            
+            return jsonify({
+                'success': True,
+                'output_file': output_filename,
+                'filename': 'merged_audio.mp3',
+                'message': f'{len(files)} audio files merged successfully!'
+            })
+        
+        elif tool_id == 'audio-trimmer':
+            start_time = float(request.form.get('start_time', 0))
+            end_time = float(request.form.get('end_time', start_time + 30))
+            input_format = detect_format(files[0])
+            if media_info is not None:
+                start_time, end_time = validate_range(media_info, start_time, end_time)
+            
+            trimmed_audio = AudioProcessor.trim_audio(files[0], start_time, end_time, input_format)
+            
+            output_filename = f"trimmed_audio_{uuid.uuid4()}.mp3"
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
+            
+            with open(output_path, 'wb') as f:
+                f.write(trimmed_audio.read())
+            
+            return jsonify({
+                'success': True,
+                'output_file': output_filename,
+                'filename': 'trimmed_audio.mp3',
+                'message': 'Audio trimmed successfully!'
+            })
+        
     except Exception as e:
         logger.error(f"Audio processing error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/batch/watermark', methods=['POST'])
+def batch_watermark():
+    """Watermark a whole set of images and PDFs with one shared overlay"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'success': False, 'error': 'No files uploaded'})
+    
+    watermark_text = request.form.get('watermark_text', 'SUNTYN AI')
+    image_position = request.form.get('position', 'bottom-right')
+    pdf_position = request.form.get('pdf_position', 'center')
+    try:
+        opacity = watermark_opacity(request.form.get('opacity'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        # One stamp set serves every PDF in the batch; image stamps come
+        # from the process-wide overlay cache
+        pdf_stamps = PDFStampSet(watermark_text, pdf_position)
+        
+        output_files = []
+        for i, file in enumerate(files):
+            name = secure_filename(file.filename or f'file_{i+1}')
+            stem = name.rsplit('.', 1)[0] or f'file_{i+1}'
+            
+            if name.lower().endswith('.pdf'):
+                watermarked_pdf = PDFProcessor.add_watermark(file, watermark_text, pdf_position, stamps=pdf_stamps)
+                output_filename = f"watermarked_pdf_{uuid.uuid4()}.pdf"
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
+                
+                with open(output_path, 'wb') as f:
+                    f.write(watermarked_pdf.read())
+                download_name = f'{stem}_watermarked.pdf'
+            else:
+                image = Image.open(file)
+                watermarked_image = ImageProcessor.add_watermark(image, watermark_text, image_position, opacity)
+                output_filename = f"watermarked_image_{uuid.uuid4()}.png"
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
+                watermarked_image.save(output_path)
+                download_name = f'{stem}_watermarked.png'
+            
+            output_files.append({
+                'filename': download_name,
+                'output_file': output_filename
+            })
+        
+        return jsonify({
+            'success': True,
+            'output_files': output_files,
+            'message': f'Watermark added to {len(output_files)} files!'
+        })
+    
+    except Exception as e:
+        logger.error(f"Batch watermark error: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Secure file download"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        file_path = artifacts.resolve(filename)
+        if file_path:
+            return send_download(file_path)
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/probe', methods=['POST'])
+def api_probe():
+    """Duration, codecs and streams of an uploaded media file"""
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+    if not FFMPEG_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Media probing is not available'}), 503
+    
+    try:
+        return jsonify({'success': True, 'media': probe_media(file)})
+    except Exception as e:
+        logger.error(f"Media probe error: {e}")
+        return jsonify({'success': False, 'error': 'Unrecognised media file'}), 400
+
 @app.route('/api/status')
 def api_status():
     """API status endpoint"""
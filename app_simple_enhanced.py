@@ -1,13 +1,16 @@
 import os
 import logging
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
 from werkzeug.utils import secure_filename
-import tempfile
 import uuid
 from PIL import Image
 import io
 import PyPDF2
 import fitz
+from utils.image_encoder import encode, encode_to_target_size, normalize_format, target_size_bytes
+from utils.artifact_store import get_store
+from utils.download import send_cached, send_download
+from utils.output_cache import get_cache
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -17,7 +20,11 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-suntyn-ai")
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+# Outputs are written into the artifact store, which expires them
+artifacts = get_store()
+app.config['UPLOAD_FOLDER'] = artifacts.staging_dir
+# Small outputs such as QR codes stay in memory and are inlined in the response
+outputs = get_cache()
 
 # Simple tool categories with working PDF and Image tools
 TOOL_CATEGORIES = {
@@ -147,32 +154,16 @@ def resize_image(image, width, height, maintain_aspect=True):
     else:
         return image.resize((width, height), Image.Resampling.LANCZOS)
 
-def compress_image(image, quality=85):
-    output = io.BytesIO()
-    if image.mode in ('RGBA', 'LA', 'P'):
-        rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-        rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = rgb_image
-    image.save(output, format='JPEG', quality=quality, optimize=True)
-    output.seek(0)
-    return Image.open(output)
+def compress_image(image, quality=85, target_size=None):
+    # Return the encoded bytes so callers write them out as-is instead of
+    # decoding and re-encoding a second lossy generation
+    if target_size:
+        return encode_to_target_size(image, 'JPEG', target_size)
+    return encode(image, 'JPEG', preset='small', quality=quality), quality, True
 
 def convert_image_format(image, target_format):
-    output = io.BytesIO()
-    
-    if target_format.upper() == 'PNG':
-        image.save(output, format='PNG', optimize=True)
-    elif target_format.upper() in ['JPG', 'JPEG']:
-        if image.mode in ('RGBA', 'LA', 'P'):
-            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-            rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = rgb_image
-        image.save(output, format='JPEG', quality=95)
-    elif target_format.upper() == 'WEBP':
-        image.save(output, format='WEBP', quality=90)
-    
-    output.seek(0)
-    return output
+    quality = 95 if normalize_format(target_format) == 'JPEG' else None
+    return encode(image, target_format, quality=quality)
 
 @app.route('/')
 def index():
@@ -243,7 +234,7 @@ def process_pdf_tool(tool_id, files, request):
         if tool_id == 'pdf-merger':
             merged_pdf = merge_pdfs(files)
             output_filename = f"merged_pdf_{uuid.uuid4()}.pdf"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(merged_pdf.read())
@@ -262,7 +253,7 @@ def process_pdf_tool(tool_id, files, request):
             output_files = []
             for i, pdf in enumerate(split_pdfs):
                 output_filename = f"split_part_{i+1}_{uuid.uuid4()}.pdf"
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
                 
                 with open(output_path, 'wb') as f:
                     f.write(pdf.read())
@@ -282,7 +273,7 @@ def process_pdf_tool(tool_id, files, request):
             compressed_pdf = compress_pdf(files[0])
             
             output_filename = f"compressed_pdf_{uuid.uuid4()}.pdf"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(compressed_pdf.read())
@@ -298,7 +289,7 @@ def process_pdf_tool(tool_id, files, request):
             text = extract_text_from_pdf(files[0])
             
             output_filename = f"extracted_text_{uuid.uuid4()}.txt"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write(text)
@@ -318,7 +309,7 @@ def process_pdf_tool(tool_id, files, request):
             output_files = []
             for i, img_buffer in enumerate(images):
                 output_filename = f"page_{i+1}_{uuid.uuid4()}.png"
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+                output_path = artifacts.allocate(output_filename, request.remote_addr)
                 
                 with open(output_path, 'wb') as f:
                     f.write(img_buffer.read())
@@ -351,7 +342,7 @@ def process_image_tool(tool_id, files, request):
             resized_image = resize_image(image, width, height, maintain_aspect)
             
             output_filename = f"resized_image_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             resized_image.save(output_path)
             
             return jsonify({
@@ -363,19 +354,31 @@ def process_image_tool(tool_id, files, request):
         
         elif tool_id == 'image-compress':
             quality = int(request.form.get('quality', 85))
+            try:
+                target_size = target_size_bytes(request.form.get('target_size_kb'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
-            compressed_image = compress_image(image, quality)
+            compressed_buffer, quality, fits = compress_image(image, quality, target_size)
             
             output_filename = f"compressed_image_{uuid.uuid4()}.jpg"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            compressed_image.save(output_path)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
-            return jsonify({
+            with open(output_path, 'wb') as f:
+                f.write(compressed_buffer.getbuffer())
+            
+            size_kb = compressed_buffer.getbuffer().nbytes / 1024
+            result = {
                 'success': True,
                 'output_file': output_filename,
                 'filename': 'compressed_image.jpg',
-                'message': 'Image compressed successfully!'
-            })
+                'quality': quality,
+                'message': f'Image compressed to {size_kb:.0f} KB (quality {quality})!'
+            }
+            if not fits:
+                result['warning'] = (f'Could not reach {target_size / 1024:.0f} KB; '
+                                     f'even the lowest quality gives {size_kb:.0f} KB')
+            return jsonify(result)
         
         elif tool_id == 'format-converter':
             target_format = request.form.get('target_format', 'PNG')
@@ -384,7 +387,7 @@ def process_image_tool(tool_id, files, request):
             
             extension = target_format.lower()
             output_filename = f"converted_image_{uuid.uuid4()}.{extension}"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+            output_path = artifacts.allocate(output_filename, request.remote_addr)
             
             with open(output_path, 'wb') as f:
                 f.write(converted_buffer.read())
@@ -466,14 +469,15 @@ def process_utility_tool(tool_id, files, request):
             
             qr_image = qr.make_image(fill_color="black", back_color="white")
             
-            output_filename = f"qr_code_{uuid.uuid4()}.png"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            qr_image.save(output_path)
+            buffer = io.BytesIO()
+            qr_image.save(buffer)
+            output_name, entry = outputs.put(buffer.getvalue(), 'qr_code.png')
             
             return jsonify({
                 'success': True,
-                'output_file': output_filename,
+                'output_file': output_name,
                 'filename': 'qr_code.png',
+                'inline': entry.inline(),
                 'message': 'QR code generated successfully!'
             })
         
@@ -504,9 +508,12 @@ def process_utility_tool(tool_id, files, request):
 def download_file(filename):
     """Secure file download"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        cached = outputs.get(filename)
+        if cached:
+            return send_cached(cached)
+        file_path = artifacts.resolve(filename)
+        if file_path:
+            return send_download(file_path)
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -524,4 +531,6 @@ def api_status():
     })
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Debugger and reloader only when asked for; production runs under gunicorn (see run.py)
+    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=debug_mode, threaded=True)
\ No newline at end of file
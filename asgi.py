@@ -0,0 +1,305 @@
+"""
+ASGI front end for the I/O-bound endpoints
+
+Uploads, downloads, upload status, job progress (SSE), cancellation,
+health and the tool registry pages are served on an event loop, so a
+slow client costs a socket and a little memory rather than a thread. A
+request only takes a thread once its body has fully arrived: the job
+itself runs through main.execute_job, unchanged, and with it the
+process-pool supervisor. Every other route (auth, probing, metrics)
+falls through to the Flask app.
+
+Production runs it under gunicorn with a uvicorn worker (gunicorn.conf.py,
+python run.py). On its own:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+One process only: job events and cancel flags live in its memory (see
+gunicorn.conf.py); jobs scale through ASGI_JOB_THREADS and JOB_WORKERS.
+"""
+import logging
+import mimetypes
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders, UploadFile
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import ImmutableMultiDict
+from werkzeug.http import parse_etags
+from werkzeug.utils import secure_filename
+
+import main
+from main import artifacts, outputs
+from utils import job_events
+from utils.artifact_store import UPLOAD_CHUNK_SIZE, UploadError, UploadNotFound, valid_digest
+from utils.download import DOWNLOAD_MAX_AGE, file_etag, offload_header
+from utils.worker_pool import JOB_WORKERS, shutdown_supervisor
+
+logger = logging.getLogger(__name__)
+
+# Threads running jobs (upload hashing, the job itself, storing the
+# output); further requests wait on the event loop, not in a thread
+JOB_THREADS = int(os.environ.get('ASGI_JOB_THREADS') or max(JOB_WORKERS, 1) * 4)
+
+# Threads for the routes that fall through to Flask (pages, auth, probing,
+# metrics); separate from the job threads, so running jobs cannot starve them
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS') or 10)
+
+# Request bodies up to this size are spooled in memory, larger ones to disk
+SPOOL_BYTES = 1024 * 1024
+
+_job_threads = anyio.CapacityLimiter(JOB_THREADS)
+
+# Registry pages only depend on TOOL_CATEGORIES; path -> (body, content type)
+_pages = {}
+
+
+def client_of(request):
+    return request.client.host if request.client else None
+
+
+def too_large(request, limit):
+    """Bodies must declare their length so oversize uploads are refused before reading"""
+    length = request.headers.get('content-length')
+    return not length or not length.isdigit() or int(length) > limit
+
+
+async def process_tool(request):
+    """Async counterpart of main.process_tool"""
+    tool_id = request.path_params['tool_id']
+    client = client_of(request)
+    if not main.rate_limit_check(client):
+        return JSONResponse({'error': 'Rate limit exceeded. Please try again in a minute.'}, 429)
+    if too_large(request, main.app.config['MAX_CONTENT_LENGTH']):
+        return JSONResponse({'error': 'File too large. Maximum size is 100MB.'}, 413)
+
+    # The body is parsed on the event loop as it arrives, so a slow upload holds no thread
+    async with request.form() as form:
+        job_id = form.get('job_id')
+        try:
+            upload = None
+            file = form.get('file')
+            if isinstance(file, UploadFile):
+                if not file.filename:
+                    return JSONResponse({'error': 'No file selected'}, 400)
+                upload = (file.filename, file.file)
+            extra_uploads = [(extra.filename, extra.file) for extra in form.getlist('extraFiles')
+                             if isinstance(extra, UploadFile) and extra.filename]
+            fields = ImmutableMultiDict([(key, value) for key, value in form.multi_items() if isinstance(value, str)])
+
+            payload, status = await anyio.to_thread.run_sync(main.execute_job, tool_id, fields, upload,
+                                                             extra_uploads, client, limiter=_job_threads)
+            return JSONResponse(payload, status)
+        except Exception as e:
+            logger.error(f"Error processing {tool_id}: {str(e)}")
+            job_events.publish(job_id, 'error', error='Internal server error')
+            return JSONResponse({'error': 'Internal server error'}, 500)
+
+
+async def begin_upload(request):
+    """Async counterpart of main.begin_upload"""
+    client = client_of(request)
+    if not main.rate_limit_check(client):
+        return JSONResponse({'error': 'Rate limit exceeded. Please try again in a minute.'}, 429)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    filename = secure_filename(str(data.get('filename', '')))
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    if not filename or size <= 0:
+        return JSONResponse({'error': 'filename and size are required'}, 400)
+    limit = main.app.config['MAX_RESUMABLE_UPLOAD']
+    if size > limit:
+        return JSONResponse({'error': f"File too large. Maximum size is {limit // (1024 * 1024)}MB."}, 413)
+
+    upload_id = await run_in_threadpool(artifacts.begin_upload, filename, size, client)
+    status = await run_in_threadpool(artifacts.upload_status, upload_id, client)
+    return JSONResponse({**status, 'chunk_size': UPLOAD_CHUNK_SIZE}, 201)
+
+
+async def upload_chunk(request):
+    """Async counterpart of main.upload_chunk: the chunk is received before a thread writes it"""
+    upload_id = request.path_params['upload_id']
+    client = client_of(request)
+    try:
+        if request.method == 'GET':
+            return JSONResponse(await run_in_threadpool(artifacts.upload_status, upload_id, client))
+        try:
+            start = int(request.query_params.get('offset', ''))
+        except ValueError:
+            return JSONResponse({'error': 'offset is required'}, 400)
+        if too_large(request, main.app.config['MAX_CONTENT_LENGTH']):
+            return JSONResponse({'error': 'Chunk too large'}, 413)
+
+        with tempfile.SpooledTemporaryFile(SPOOL_BYTES, dir=main.app.config['UPLOAD_FOLDER']) as body:
+            length = 0
+            async for data in request.stream():
+                body.write(data)
+                length += len(data)
+            body.seek(0)
+            status = await run_in_threadpool(artifacts.write_chunk, upload_id, start, length, body,
+                                             request.headers.get('x-chunk-sha256'), client)
+        return JSONResponse(status)
+    except UploadNotFound:
+        return JSONResponse({'error': 'Upload not found or expired'}, 404)
+    except UploadError as e:
+        return JSONResponse({'error': str(e)}, 400)
+
+
+async def check_blob(request):
+    digest = request.path_params['digest']
+    if not valid_digest(digest):
+        return JSONResponse({'error': 'Invalid SHA-256 digest'}, 400)
+    if await run_in_threadpool(artifacts.has_blob, digest, client_of(request)):
+        return JSONResponse({'exists': True})
+    return JSONResponse({'exists': False}, 404)
+
+
+async def job_event_stream(request):
+    """Server-Sent Events; a waiting subscriber holds no thread"""
+    job_id = request.path_params['job_id']
+    if not job_events.valid_job_id(job_id):
+        return JSONResponse({'error': 'Invalid job id'}, 400)
+
+    async def stream():
+        yield "retry: 2000\n\n"
+        async for event in job_events.watch(job_id):
+            yield job_events.format_sse(event)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+async def cancel_job(request):
+    job_id = request.path_params['job_id']
+    if not job_events.valid_job_id(job_id):
+        return JSONResponse({'error': 'Invalid job id'}, 400)
+    try:
+        if not job_events.request_cancel(job_id):
+            return JSONResponse({'error': 'Job has already finished'}, 409)
+    except job_events.JobNotFound:
+        return JSONResponse({'error': 'Job not found'}, 404)
+    return JSONResponse({'success': True}, 202)
+
+
+async def download_file(request):
+    """Same contract as utils.download.send_download: ETag, 304, Range, proxy offload"""
+    name = request.path_params['filename']
+    cached = outputs.get(name)
+    if cached:
+        headers = download_headers(cached.etag, cached.filename)
+        if parse_etags(request.headers.get('if-none-match')).contains(cached.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(cached.data, media_type=cached.mimetype, headers=headers)
+
+    path = await run_in_threadpool(artifacts.resolve, name)
+    if not path:
+        return Response("File not found", 404)
+    # The content hash is cached after the first download, or primed when the output was stored
+    etag = await run_in_threadpool(file_etag, path)
+    headers = download_headers(etag, name)
+    if parse_etags(request.headers.get('if-none-match')).contains(etag):
+        return Response(status_code=304, headers=headers)
+
+    header = offload_header(path)
+    if header:
+        headers[header[0]] = header[1]
+        headers['Accept-Ranges'] = 'bytes'
+        return Response(headers=headers, media_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    # FileResponse answers Range and If-Range against the ETag given here
+    return FileResponse(path, filename=name, headers=headers)
+
+
+def download_headers(etag, filename):
+    return {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'private, max-age={DOWNLOAD_MAX_AGE}',
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    }
+
+
+async def registry_page(request):
+    """Home, dashboard, category and tool pages, rendered by Flask once per path"""
+    path = request.url.path
+    page = _pages.get(path)
+    if page is None:
+        status, headers, body = await run_in_threadpool(render_page, path)
+        if status != 200:
+            # Redirects for unknown categories and tools are not cached
+            return Response(body, status, headers=headers)
+        page = _pages[path] = (body, headers.get('Content-Type'))
+    return Response(page[0], headers={'Content-Type': page[1]})
+
+
+def render_page(path):
+    response = main.app.test_client().get(path)
+    return response.status_code, dict(response.headers), response.get_data()
+
+
+async def health_check(request):
+    from performance_monitor import get_system_stats
+    try:
+        stats = await run_in_threadpool(get_system_stats)
+    except Exception as e:
+        return JSONResponse({'status': 'unhealthy', 'error': str(e)}, 500)
+    return JSONResponse({
+        'status': 'healthy',
+        'system': stats,
+        'tools_available': len([tool for category in main.TOOL_CATEGORIES.values() for tool in category['tools']])
+    })
+
+
+class SecurityHeaders:
+    """Adds main.SECURITY_HEADERS to every response, as the Flask app does"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).update(main.SECURITY_HEADERS)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    shutdown_supervisor()
+
+
+app = SecurityHeaders(Starlette(
+    routes=[
+        Route('/process/{tool_id}', process_tool, methods=['POST']),
+        Route('/api/uploads', begin_upload, methods=['POST']),
+        Route('/api/uploads/{upload_id}', upload_chunk, methods=['GET', 'PUT']),
+        Route('/api/blobs/{digest}', check_blob, methods=['GET', 'HEAD']),
+        Route('/jobs/{job_id}/events', job_event_stream),
+        Route('/jobs/{job_id}/cancel', cancel_job, methods=['POST']),
+        Route('/download/{filename}', download_file),
+        Route('/health', health_check),
+        Route('/', registry_page),
+        Route('/tools', registry_page),
+        Route('/tools/{category}', registry_page),
+        Route('/tool/{tool_id}', registry_page),
+        # Pages, auth, probing and metrics stay on the Flask app, run in threads
+        Mount('/', app=WSGIMiddleware(main.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+))
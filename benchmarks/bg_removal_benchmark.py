@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Background removal benchmark: mask IoU against wall-clock time per quality level
+
+Usage:
+    python benchmarks/bg_removal_benchmark.py [--size 4000x3000] [--runs 3]
+    python benchmarks/bg_removal_benchmark.py --image photo.jpg --mask truth.png
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.background_remover import BackgroundRemover, QUALITY_PRESETS
+
+
+def synthetic_scene(width, height, seed=0):
+    """Textured background with a textured foreground blob and its true mask"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 200, width, dtype=np.float32)
+    background = np.dstack([gradient, gradient[::-1], np.full(width, 120, np.float32)])
+    background = np.repeat(background, height, axis=0)
+    background += rng.normal(0, 12, background.shape)
+
+    truth = np.zeros((height, width), np.uint8)
+    center = (width // 2, height // 2)
+    axes = (int(width * 0.25), int(height * 0.32))
+    cv2.ellipse(truth, center, axes, 15, 0, 360, 255, -1)
+    cv2.circle(truth, (center[0] + axes[0] // 2, center[1] - axes[1]), axes[1] // 3, 255, -1)
+
+    foreground = np.full(background.shape, (200, 40, 60), np.float32)
+    foreground += rng.normal(0, 18, foreground.shape)
+    scene = np.where(truth[..., None] > 0, foreground, background)
+    return Image.fromarray(np.clip(scene, 0, 255).astype(np.uint8), 'RGB'), truth
+
+
+def legacy_canny_mask(image):
+    """The previous Canny + largest contour approach, for comparison"""
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros(gray.shape, np.uint8)
+    if contours:
+        cv2.fillPoly(mask, [max(contours, key=cv2.contourArea)], 255)
+    return mask
+
+
+def time_it(func, runs):
+    best = None
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='4000x3000', help='Synthetic image size WxH')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--image', help='Real image to segment')
+    parser.add_argument('--mask', help='Ground-truth mask for --image (white = foreground)')
+    args = parser.parse_args()
+
+    if args.image:
+        image = Image.open(args.image).convert('RGB')
+        truth = np.asarray(Image.open(args.mask).convert('L')) if args.mask else None
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        image, truth = synthetic_scene(width, height)
+
+    print(f"Image {image.width}x{image.height}, best of {args.runs} runs")
+    print(f"{'method':<12}{'time (s)':>10}{'IoU':>8}")
+
+    elapsed, mask = time_it(lambda: legacy_canny_mask(image), args.runs)
+    iou = BackgroundRemover.mask_iou(mask, truth) if truth is not None else float('nan')
+    print(f"{'legacy':<12}{elapsed:>10.3f}{iou:>8.3f}")
+
+    for quality, preset in QUALITY_PRESETS.items():
+        def run():
+            working = BackgroundRemover.compute_mask(image, quality, use_cache=False)
+            return BackgroundRemover.upsample_mask(working, image.size, preset['feather'])
+        elapsed, alpha = time_it(run, args.runs)
+        iou = BackgroundRemover.mask_iou(alpha, truth) if truth is not None else float('nan')
+        print(f"{quality:<12}{elapsed:>10.3f}{iou:>8.3f}")
+
+    BackgroundRemover.compute_mask(image, 'balanced')
+    elapsed, _ = time_it(lambda: BackgroundRemover.compute_mask(image, 'balanced'), args.runs)
+    print(f"{'cached':<12}{elapsed:>10.3f}{'':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Download benchmark: plain send_file against the ETag/Range download layer
+
+Serves one large file through both paths on a local server and measures
+a full download, a resume from the middle after a dropped connection,
+and a revalidation of a copy the client already has.
+
+Usage:
+    python benchmarks/download_benchmark.py [--size-gb 2] [--runs 3]
+    python benchmarks/download_benchmark.py --file output.mp4
+"""
+import argparse
+import http.client
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, send_file
+from werkzeug.serving import make_server
+
+from utils import download
+
+CHUNK = 1024 * 1024
+
+
+def make_app(path):
+    app = Flask(__name__)
+
+    @app.route('/baseline')
+    def baseline():
+        # What the download routes did before
+        if os.path.exists(path):
+            return send_file(path, as_attachment=True)
+        return "File not found", 404
+
+    @app.route('/layer')
+    def layer():
+        return download.send_download(path)
+
+    return app
+
+
+def fetch(port, route, headers=None):
+    """GET a route and return (status, bytes received, seconds, ETag)"""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    start = time.perf_counter()
+    connection.request('GET', route, headers=headers or {})
+    response = connection.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(CHUNK)
+        if not chunk:
+            break
+        received += len(chunk)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return response.status, received, elapsed, response.getheader('ETag')
+
+
+def best(port, route, runs, headers=None):
+    results = [fetch(port, route, headers) for _ in range(runs)]
+    return min(results, key=lambda result: result[2])
+
+
+def write_file(path, size):
+    block = os.urandom(4 * CHUNK)
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', help='Serve this file instead of a generated one')
+    parser.add_argument('--size-gb', type=float, default=2.0, help='Size of the generated file')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp_dir, 'output.bin')
+            write_file(path, int(args.size_gb * 1024 ** 3))
+        size = os.path.getsize(path)
+
+        server = make_server('127.0.0.1', 0, make_app(path), threaded=True)
+        port = server.server_port
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            # The first request through the layer hashes the file for its ETag
+            _, _, cold, layer_etag = fetch(port, '/layer')
+            _, _, _, baseline_etag = fetch(port, '/baseline')
+            print(f"File: {size / 1e9:.2f} GB, best of {args.runs}")
+            print(f"First download incl. content hash: {cold:.2f}s ({size / cold / 1e6:.0f} MB/s)\n")
+
+            etags = {'/baseline': baseline_etag, '/layer': layer_etag}
+            scenarios = [
+                ('full download', lambda etag: {}),
+                ('resume at 50%', lambda etag: {'Range': f'bytes={size // 2}-', 'If-Range': etag}),
+                ('revalidate', lambda etag: {'If-None-Match': etag}),
+            ]
+
+            print(f"{'scenario':<16} {'send_file':>22} {'download layer':>22}")
+            for name, headers in scenarios:
+                cells = []
+                for route in ('/baseline', '/layer'):
+                    status, received, elapsed, _ = best(port, route, args.runs, headers(etags[route]))
+                    cells.append(f"{status} {received / 1e6:>7.0f} MB {elapsed:>6.2f}s")
+                print(f"{name:<16} {cells[0]:>22} {cells[1]:>22}")
+
+            status, received, elapsed, _ = best(port, '/layer', args.runs)
+            print(f"\nSteady-state throughput: {received / elapsed / 1e6:.0f} MB/s "
+                  f"(offload: {download.DOWNLOAD_OFFLOAD or 'none'})")
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
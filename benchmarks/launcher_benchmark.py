@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Launcher benchmark: Flask's own server against gunicorn
+
+Starts the app the way each launcher does, on a free local port, and
+measures requests per second and latency from concurrent keep-alive
+clients, for a tool page and for a small job (PAN validation).
+
+    werkzeug        python main.py, what run.py used to start
+    werkzeug-debug  the same with FLASK_DEBUG=true, as app_simple_enhanced.py ran
+    gunicorn        python run.py, with gunicorn.conf.py
+
+Usage:
+    python benchmarks/launcher_benchmark.py [--clients 32] [--seconds 10]
+    python benchmarks/launcher_benchmark.py --launchers werkzeug gunicorn
+"""
+import argparse
+import http.client
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAUNCHERS = {
+    'werkzeug': ([sys.executable, 'main.py'], {'FLASK_DEBUG': 'false'}),
+    'werkzeug-debug': ([sys.executable, 'main.py'], {'FLASK_DEBUG': 'true'}),
+    'gunicorn': ([sys.executable, 'run.py'], {}),
+}
+
+
+def page_request():
+    return 'GET', '/tool/pdf-merger', None, {}
+
+
+def job_request():
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="pan.txt"\r\n'
+            f'Content-Type: text/plain\r\n\r\nABCDE1234F\r\n--{boundary}--\r\n').encode()
+    return 'POST', '/process/pan-validator', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+SCENARIOS = [('tool page', page_request), ('small job', job_request)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start(name, port):
+    command, env = LAUNCHERS[name]
+    # A session of its own, so the reloader's child and the workers go with it
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **env, 'PORT': str(port)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process
+        except OSError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode}")
+        time.sleep(0.5)
+    stop(process)
+    raise RuntimeError(f"{name} did not start")
+
+
+def stop(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def client(port, make_request, until, latencies, errors):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while time.monotonic() < until:
+        method, path, body, headers = make_request()
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(response.status)
+        if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.close()
+
+
+def load(port, make_request, clients, seconds):
+    """Requests per second, p50 and p99 latency in ms, and failures"""
+    latencies, errors = [], []
+    until = time.monotonic() + seconds
+    threads = [threading.Thread(target=client, args=(port, make_request, until, latencies, errors))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if not latencies:
+        return 0, 0, 0, len(errors)
+    latencies.sort()
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    return len(latencies) / seconds, statistics.median(latencies) * 1000, p99 * 1000, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--launchers', nargs='+', choices=list(LAUNCHERS), default=list(LAUNCHERS))
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent keep-alive clients')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each measurement')
+    args = parser.parse_args()
+
+    # Every job counts against the per-client rate limit, which would dominate the numbers
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '1000000000')
+
+    print(f"{args.clients} clients, {args.seconds:g}s per scenario, {os.cpu_count()} CPUs\n")
+    print(f"{'launcher':<16} {'scenario':<12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for name in args.launchers:
+        port = free_port()
+        started = time.perf_counter()
+        process = start(name, port)
+        ready = time.perf_counter() - started
+        try:
+            # Warm up: templates, the job pool
+            load(port, page_request, 2, 1)
+            load(port, job_request, 2, 1)
+            for scenario, make_request in SCENARIOS:
+                rps, p50, p99, failed = load(port, make_request, args.clients, args.seconds)
+                print(f"{name:<16} {scenario:<12} {rps:>8.0f} {p50:>8.1f} {p99:>8.1f} {failed:>7}")
+        finally:
+            stop(process)
+        print(f"{'':<16} (ready in {ready:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
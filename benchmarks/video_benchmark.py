@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Video engine benchmark: direct ffmpeg pipelines against the moviepy path
+
+Before timing anything it checks that exact trims keep exactly the source
+frames in range: the same count, the first at time zero and the rest at
+their source spacing. It exits with status 1 if one does not.
+
+Usage:
+    python benchmarks/video_benchmark.py [--duration 30] [--size 1920x1080] [--runs 3]
+    python benchmarks/video_benchmark.py --video clip.mp4 --workers 8
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import ffmpeg_engine, video_processor
+from utils.video_processor import VideoProcessor, MOVIEPY_AVAILABLE
+
+
+def synthetic_clip(path, duration, size):
+    """Encode an H.264/AAC test clip with a 2 second GOP"""
+    subprocess.run([
+        ffmpeg_engine.FFMPEG_BIN, '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60',
+        '-c:a', 'aac', path,
+    ], check=True)
+
+
+def frame_times(path):
+    """Presentation time of every decoded video frame"""
+    result = subprocess.run([ffmpeg_engine.FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', path],
+                            capture_output=True, text=True, check=True)
+    return [float(line.strip(',')) for line in result.stdout.split() if line.strip(',')]
+
+
+def check_exact_trims(path, duration):
+    """Trim ranges starting and ending inside GOPs, on keyframes and at the
+    end of the file; returns the number that do not match the source"""
+    source = frame_times(path)
+    ranges = [(duration / 2 - 4.9, duration / 2 + 5.1), (2.0, 4.5), (0.5, 4.0), (duration / 2, duration)]
+    failures = 0
+    print(f"{'exact trim':<20} {'frames':>10} {'expected':>10} {'max drift':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, 'trim.mp4')
+        for start, end in ranges:
+            ffmpeg_engine.trim_video(path, start, end, 'mp4', output=output, exact=True)
+            expected = [t - source[0] for t in source if start - 0.0005 <= t - source[0] < end - 0.0005]
+            frames = frame_times(output)
+            drift = max((abs((t - frames[0]) - (e - expected[0])) for t, e in zip(frames, expected)), default=0)
+            ok = len(frames) == len(expected) and frames and abs(frames[0]) < 0.002 and drift < 0.002
+            failures += not ok
+            print(f"{f'{start:.1f}-{end:.1f}s':<20} {len(frames):>10} {len(expected):>10} "
+                  f"{drift * 1000:>8.1f}ms {'ok' if ok else 'MISMATCH'}")
+    print()
+    return failures
+
+
+def time_call(func, data, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = func(io.BytesIO(data))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(output.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Benchmark this file instead of a synthetic clip')
+    parser.add_argument('--duration', type=int, default=30, help='Synthetic clip length in seconds')
+    parser.add_argument('--size', default='1920x1080', help='Synthetic clip size')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker count for the segmented transcode rows')
+    parser.add_argument('--skip-moviepy', action='store_true')
+    args = parser.parse_args()
+
+    ffmpeg_engine.require_ffmpeg()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.video
+        if not path:
+            path = os.path.join(tmp_dir, 'clip.mp4')
+            synthetic_clip(path, args.duration, args.size)
+        with open(path, 'rb') as f:
+            data = f.read()
+        duration = float(ffmpeg_engine.probe(io.BytesIO(data))['format']['duration'])
+        trim_failures = check_exact_trims(path, duration)
+
+    half = duration / 2
+    operations = [
+        ('extract_audio', lambda f: VideoProcessor.extract_audio(f)),
+        ('trim (middle 10s)', lambda f: VideoProcessor.trim_video(f, half - 5, half + 5)),
+        ('convert mp4->mkv', lambda f: VideoProcessor.convert_format(f, 'mkv', 'high')),
+        ('compress 0.5x', lambda f: VideoProcessor.compress_video(f, 0.5)),
+    ]
+
+    print(f"Input: {len(data) / 1e6:.1f} MB, best of {args.runs}")
+    print(f"{'operation':<20} {'1 worker':>10} {f'{args.workers} workers':>10} {'speedup':>8}")
+    for name, func in [
+        ('convert (low)', lambda f, w: ffmpeg_engine.convert_format(f, 'mp4', 'low', workers=w)),
+        ('compress 0.5x', lambda f, w: ffmpeg_engine.compress_video(f, 0.5, workers=w)),
+    ]:
+        single, _ = time_call(lambda f: func(f, 1), data, args.runs)
+        parallel, _ = time_call(lambda f: func(f, args.workers), data, args.runs)
+        print(f"{name:<20} {single:>9.2f}s {parallel:>9.2f}s {single / parallel:>7.1f}x")
+    print()
+
+    print(f"{'operation':<20} {'ffmpeg':>10} {'moviepy':>10} {'speedup':>8}")
+
+    run_moviepy = MOVIEPY_AVAILABLE and not args.skip_moviepy
+    for name, func in operations:
+        engine_time, _ = time_call(func, data, args.runs)
+
+        moviepy_cell, speedup_cell = 'n/a', ''
+        if run_moviepy:
+            video_processor.FFMPEG_AVAILABLE = False
+            try:
+                moviepy_time, _ = time_call(func, data, args.runs)
+            finally:
+                video_processor.FFMPEG_AVAILABLE = True
+            moviepy_cell = f"{moviepy_time:.2f}s"
+            speedup_cell = f"{moviepy_time / engine_time:.1f}x"
+
+        print(f"{name:<20} {engine_time:>9.2f}s {moviepy_cell:>10} {speedup_cell:>8}")
+
+    if trim_failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Gunicorn configuration for production
+
+The master imports the app and the heavy processing libraries, then forks
+a single web worker. Job progress events and cancel flags
+(utils.job_events) live in the memory of that process, so /jobs/<id>/events
+and /jobs/<id>/cancel must reach the process that runs /process. Capacity
+therefore comes from the job process pool (utils.worker_pool), which does
+the CPU work, not from more web workers.
+
+The worker serves the ASGI front end (asgi.py) on an event loop. A
+progress stream or a slow upload holds no thread; jobs run on
+ASGI_JOB_THREADS threads and the routes that fall through to Flask on
+ASGI_WSGI_THREADS of their own, so long jobs and their watchers cannot
+take the threads pages need.
+
+Run with:
+    python run.py                     (or: gunicorn -c gunicorn.conf.py)
+
+Graceful reload, e.g. after a deploy:
+    kill -HUP $(cat gunicorn.pid)     a new worker with the same code; the old one finishes its jobs
+    kill -USR2 $(cat gunicorn.pid)    new master with the new code; then QUIT the old master
+
+Until the old worker exits, its jobs' events and cancels no longer reach it.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+
+import psutil
+
+logger = logging.getLogger('gunicorn.error')
+
+# Memory the web worker needs besides its job processes
+WEB_WORKER_MEMORY = int(os.environ.get('WEB_WORKER_MEMORY_MB') or 256) * 1024 * 1024
+
+
+def job_worker_count():
+    """Job processes to run: one per core, as many as fit in available
+    memory at their recycling ceiling (WORKER_MAX_RSS_MB)
+    """
+    max_rss = int(os.environ.get('WORKER_MAX_RSS_MB') or 1024) * 1024 * 1024
+    by_memory = (psutil.virtual_memory().available - WEB_WORKER_MEMORY) // max_rss
+    return max(min(multiprocessing.cpu_count(), by_memory), 1)
+
+
+# Read by utils.worker_pool on import, so it is set before anything imports it
+os.environ.setdefault('JOB_WORKERS', str(job_worker_count()))
+
+from utils.worker_pool import CANCEL_GRACE, HEAVY_MODULES, JOB_WORKERS, shutdown_supervisor
+
+
+def longest_job():
+    """Wall-clock limit of the slowest tool category"""
+    from main import DEFAULT_JOB_LIMITS, JOB_LIMITS
+    return max(limit for limit, _ in (DEFAULT_JOB_LIMITS, *JOB_LIMITS.values()))
+
+
+wsgi_app = 'asgi:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+pidfile = os.environ.get('GUNICORN_PIDFILE') or 'gunicorn.pid'
+
+preload_app = True
+# One worker: job state is per process (see above)
+workers = 1
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# The worker heartbeats from its event loop, so long jobs do not hit this
+timeout = 60
+# A worker told to stop finishes its jobs first, up to the longest job limit
+graceful_timeout = max(int(os.environ.get('GRACEFUL_TIMEOUT') or 0), longest_job() + CANCEL_GRACE)
+keepalive = 5
+
+# No max_requests: restarting the only worker would stop accepting requests
+# until its longest job finished. Job processes are recycled on their own
+
+accesslog = '-'
+
+
+def on_starting(server):
+    # Loaded in the master, so the worker and those started by reloads share them
+    for module in HEAVY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    from asgi import JOB_THREADS, WSGI_THREADS
+    logger.info(f"Starting {workers} worker: {JOB_THREADS} job threads, {WSGI_THREADS} Flask threads, "
+                f"{JOB_WORKERS} job processes")
+
+
+def worker_exit(server, worker):
+    # Stop this worker's job processes with it
+    shutdown_supervisor()
@@ -1,14 +1,24 @@
 import os
 import logging
 import sys
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
-import tempfile
 import uuid
 import re
+import hashlib
+import shutil
+import time
 from datetime import datetime
 
+from utils import job_events
+from utils.artifact_store import (UPLOAD_CHUNK_SIZE, BlobNotFound, QuotaExceeded, UploadError, UploadNotFound,
+                                  get_store, valid_digest)
+from utils.download import prime_etag, send_cached, send_download
+from utils.output_cache import fits, get_cache
+from utils.worker_pool import (JOB_WORKERS, JobCancelled, JobFailed, JobMemoryExceeded, JobTimeout, cancellable,
+                               check_cancelled, get_supervisor)
+
 # Enhanced logging configuration
 logging.basicConfig(
     level=logging.INFO,
@@ -24,15 +34,26 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "prod-secret-key-" + str(uuid.uuid4()))
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+# Uploads and in-flight outputs are staged in the artifact store's private
+# directory; finished outputs are adopted into the store and expire from there
+artifacts = get_store()
+app.config['UPLOAD_FOLDER'] = artifacts.staging_dir
+# Small outputs (validation reports, QR codes) are kept in memory and inlined
+outputs = get_cache()
+# Largest file accepted through the resumable upload API, which sends it in chunks
+app.config['MAX_RESUMABLE_UPLOAD'] = int(os.environ.get('MAX_RESUMABLE_UPLOAD_MB') or 200) * 1024 * 1024
 
 # Security headers
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+}
+
 @app.after_request
 def security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 # Error handlers
@@ -192,11 +213,11 @@ def tool_page(tool_id):
 # Tool Processing Routes
 # Rate limiting storage (in production, use Redis)
 request_counts = {}
-RATE_LIMIT = 10  # requests per minute per IP
+RATE_LIMIT = int(os.environ.get('RATE_LIMIT_PER_MINUTE') or 10)  # requests per minute per IP, per server process
 
-def rate_limit_check():
+def rate_limit_check(client_ip=None):
     """Simple rate limiting"""
-    client_ip = request.environ.get('REMOTE_ADDR')
+    client_ip = client_ip or request.environ.get('REMOTE_ADDR')
     now = datetime.now()
     minute_key = f"{client_ip}:{now.strftime('%Y-%m-%d-%H-%M')}"
     
@@ -214,6 +235,67 @@ def rate_limit_check():
     
     return True
 
+def store_upload(stream, client):
+    """Stream an upload into the blob store, hashing it on the way, and return its SHA-256"""
+    sha256 = hashlib.sha256()
+    staged = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}.part")
+    with open(staged, 'wb') as f:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            sha256.update(chunk)
+            f.write(chunk)
+    return artifacts.put_blob(staged, sha256.hexdigest(), client=client)
+
+@app.route('/api/blobs/<digest>', methods=['GET', 'HEAD'])
+def check_blob(digest):
+    """Whether the file with this SHA-256 is already held, so the upload can be skipped"""
+    if not valid_digest(digest):
+        return jsonify({'error': 'Invalid SHA-256 digest'}), 400
+    if artifacts.has_blob(digest, client=request.remote_addr):
+        return jsonify({'exists': True})
+    return jsonify({'exists': False}), 404
+
+@app.route('/api/uploads', methods=['POST'])
+def begin_upload():
+    """Start a resumable upload; the file is then sent in chunks with PUT"""
+    if not rate_limit_check():
+        return jsonify({'error': 'Rate limit exceeded. Please try again in a minute.'}), 429
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    if not filename or size <= 0:
+        return jsonify({'error': 'filename and size are required'}), 400
+    if size > app.config['MAX_RESUMABLE_UPLOAD']:
+        return jsonify({'error': f"File too large. Maximum size is {app.config['MAX_RESUMABLE_UPLOAD'] // (1024 * 1024)}MB."}), 413
+
+    upload_id = artifacts.begin_upload(filename, size, client=request.remote_addr)
+    status = artifacts.upload_status(upload_id, client=request.remote_addr)
+    return jsonify({**status, 'chunk_size': UPLOAD_CHUNK_SIZE}), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """GET reports what has arrived; PUT writes the body at ?offset=N
+
+    Each chunk carries its SHA-256 in X-Chunk-SHA256 and is only counted
+    once it matches, so a client resumes by sending the missing ranges.
+    """
+    try:
+        if request.method == 'GET':
+            return jsonify(artifacts.upload_status(upload_id, client=request.remote_addr))
+        try:
+            start = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({'error': 'offset is required'}), 400
+        status = artifacts.write_chunk(upload_id, start, request.content_length or 0, request.stream,
+                                       request.headers.get('X-Chunk-SHA256'), client=request.remote_addr)
+        return jsonify(status)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found or expired'}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/process/<tool_id>', methods=['POST'])
 def process_tool(tool_id):
     """Process files with the specified tool"""
@@ -221,38 +303,84 @@ def process_tool(tool_id):
         # Rate limiting
         if not rate_limit_check():
             return jsonify({'error': 'Rate limit exceeded. Please try again in a minute.'}), 429
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-
-        # Save uploaded file temporarily
-        filename = secure_filename(file.filename)
-        temp_input = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
-        file.save(temp_input)
-
-        # Process based on tool type
-        result = process_file_by_tool(tool_id, temp_input, request.form)
-
-        # Clean up input file
-        if os.path.exists(temp_input):
-            os.remove(temp_input)
-
-        if result.get('success'):
-            return jsonify({
-                'success': True,
-                'download_url': f"/download/{result['output_file']}",
-                'filename': result['filename']
-            })
-        else:
-            return jsonify({'error': result.get('error', 'Processing failed')}), 500
+
+        upload = None
+        if 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+            upload = (file.filename, file.stream)
+        extra_uploads = [(extra.filename, extra.stream) for extra in request.files.getlist('extraFiles')
+                         if extra.filename]
+
+        payload, status = execute_job(tool_id, request.form, upload, extra_uploads, request.remote_addr)
+        return jsonify(payload), status
 
     except Exception as e:
         logging.error(f"Error processing {tool_id}: {str(e)}")
+        job_events.publish(request.form.get('job_id'), 'error', error='Internal server error')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/jobs/<job_id>/events')
+def job_event_stream(job_id):
+    """Server-Sent Events stream of a job's progress, ending with done or error"""
+    if not job_events.valid_job_id(job_id):
+        return jsonify({'error': 'Invalid job id'}), 400
+    
+    def stream():
+        # Reconnect quickly if the connection drops mid-job
+        yield "retry: 2000\n\n"
+        for event in job_events.subscribe(job_id):
+            yield job_events.format_sse(event)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job; its worker and temporary files are freed"""
+    if not job_events.valid_job_id(job_id):
+        return jsonify({'error': 'Invalid job id'}), 400
+    try:
+        if not job_events.request_cancel(job_id):
+            return jsonify({'error': 'Job has already finished'}), 409
+    except job_events.JobNotFound:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True}), 202
+
+@app.route('/api/probe')
+def probe_media_file():
+    """Media metadata (duration, codecs, streams) of a stored file, by its SHA-256
+
+    The tool page asks once the file is known to be held (see
+    /api/blobs), so probing never uploads the file a second time.
+    """
+    from utils.media_probe import FFMPEG_AVAILABLE, probe_media
+    
+    digest = request.args.get('blob', '')
+    if not valid_digest(digest):
+        return jsonify({'error': 'Invalid SHA-256 digest'}), 400
+    if not FFMPEG_AVAILABLE:
+        return jsonify({'error': 'Media probing is not available'}), 503
+    if not artifacts.has_blob(digest, client=request.remote_addr):
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        # Held by reference so the reaper cannot remove it mid-probe
+        link = artifacts.checkout_blob(digest, f"{uuid.uuid4()}.probe")
+    except BlobNotFound:
+        return jsonify({'error': 'File not found'}), 404
+    try:
+        return jsonify({'success': True, 'media': probe_media(link)})
+    except Exception as e:
+        logging.error(f"Error probing media: {str(e)}")
+        return jsonify({'error': 'Unrecognised media file'}), 400
+    finally:
+        artifacts.release_blob(digest, link)
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for monitoring"""
@@ -279,16 +407,21 @@ def metrics():
         'uptime': time.time(),
         'system_stats': stats,
         'total_tools': len([tool for category in TOOL_CATEGORIES.values() for tool in category['tools']]),
-        'categories': len(TOOL_CATEGORIES)
+        'categories': len(TOOL_CATEGORIES),
+        # Job counts, recycles and kills per reason, and each worker's RSS
+        'job_workers': get_supervisor().stats() if JOB_WORKERS else None
     })
 
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download processed file"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        cached = outputs.get(filename)
+        if cached:
+            return send_cached(cached)
+        file_path = artifacts.resolve(filename)
+        if file_path:
+            return send_download(file_path)
         else:
             return "File not found", 404
     except Exception as e:
@@ -327,17 +460,167 @@ def inject_user():
     
     return dict(current_user=MockUser())
 
-def process_file_by_tool(tool_id, input_file, form_data):
+def execute_job(tool_id, form_data, upload, extra_uploads, client):
+    """Resolve a job's input, run it and store its output; returns (payload, status)
+
+    The main input is either upload, a (filename, stream) pair, its
+    SHA-256 in 'blob' (with the original name in 'filename') when the page
+    found it already held via /api/blobs, or 'upload_id' to finalize a
+    resumable upload and run the job on the assembled file. Shared by the
+    Flask route and the ASGI front end (asgi.py), so it touches no request
+    object.
+    """
+    if upload is not None:
+        filename = secure_filename(upload[0])
+        digest = store_upload(upload[1], client)
+    elif form_data.get('upload_id'):
+        try:
+            digest, filename = artifacts.finish_upload(form_data['upload_id'], client=client)
+        except UploadNotFound:
+            return {'error': 'Upload not found or expired'}, 404
+        except UploadError as e:
+            return {'error': str(e)}, 409
+    elif form_data.get('blob'):
+        filename = secure_filename(form_data.get('filename', ''))
+        digest = form_data['blob']
+        if not filename or not artifacts.has_blob(digest, client=client):
+            return {'error': 'File is no longer available, please upload it again', 'blob_missing': True}, 404
+    else:
+        return {'error': 'No file provided'}, 400
+
+    # Joiners and add-audio take further files alongside the main one
+    extra_inputs = []
+    for extra_name, extra_stream in extra_uploads:
+        extra_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{secure_filename(extra_name)}")
+        with open(extra_path, 'wb') as f:
+            shutil.copyfileobj(extra_stream, f, 1024 * 1024)
+        extra_inputs.append(extra_path)
+
+    # The job works on a link to the blob under the upload's own name
+    try:
+        temp_input = artifacts.checkout_blob(digest, f"{uuid.uuid4()}_{filename}")
+    except BlobNotFound:
+        for path in extra_inputs:
+            os.remove(path)
+        return {'error': 'File is no longer available, please upload it again', 'blob_missing': True}, 404
+
+    # Progress is published to /jobs/<job_id>/events when the page sent a job id
+    job_id = form_data.get('job_id')
+    job_events.publish(job_id, 'started', tool=tool_id)
+
+    # Process based on tool type
+    try:
+        result = run_job(tool_id, temp_input, form_data, extra_inputs, job_events.reporter(job_id),
+                         job_events.cancel_event(job_id))
+    finally:
+        # Clean up input files; the blob itself stays for later jobs
+        artifacts.release_blob(digest, temp_input)
+        for path in extra_inputs:
+            if os.path.exists(path):
+                os.remove(path)
+
+    if result.get('success'):
+        # Processors return either an output_file in staging or output_data bytes
+        output_data = result.get('output_data')
+        inline = None
+        if fits(output_data):
+            # Small results skip the disk, and the inline copy saves the download request
+            output_name, entry = outputs.put(output_data, result['filename'])
+            inline = entry.inline()
+            size = len(output_data)
+        else:
+            if output_data is not None:
+                output_name = f"{uuid.uuid4()}{os.path.splitext(result['filename'])[1]}"
+                with open(os.path.join(app.config['UPLOAD_FOLDER'], output_name), 'wb') as f:
+                    f.write(output_data)
+                result['output_file'] = output_name
+            output_path = os.path.join(app.config['UPLOAD_FOLDER'], result['output_file'])
+            size = os.path.getsize(output_path)
+            try:
+                output_name = artifacts.adopt(output_path, client=client)
+            except QuotaExceeded as e:
+                job_events.publish(job_id, 'error', error=str(e))
+                return {'error': str(e)}, 413
+            prime_etag(artifacts.resolve(output_name))
+        job_events.publish(job_id, 'done', progress=1.0, download_url=f"/download/{output_name}",
+                           filename=result['filename'], size=size)
+        payload = {
+            'success': True,
+            'download_url': f"/download/{output_name}",
+            'filename': result['filename']
+        }
+        if inline:
+            payload['inline'] = inline
+        if result.get('warning'):
+            payload['warning'] = result['warning']
+        return payload, 200
+    elif result.get('cancelled'):
+        job_events.publish(job_id, 'cancelled')
+        return {'error': result['error'], 'cancelled': True}, 409
+    else:
+        job_events.publish(job_id, 'error', error=result.get('error', 'Processing failed'))
+        return {'error': result.get('error', 'Processing failed')}, 500
+
+# Wall-clock and CPU seconds a job may take, by tool category; media
+# encodes are long, documents and images should finish quickly
+JOB_LIMITS = {
+    'pdf': (300, 240),
+    'image': (120, 90),
+    'audio': (1800, 1800),
+    'govt': (120, 90),
+}
+DEFAULT_JOB_LIMITS = (300, 240)
+
+def job_limits(tool_id):
+    """(wall-clock seconds, CPU seconds) allowed for one run of a tool"""
+    for category_id, category in TOOL_CATEGORIES.items():
+        if any(tool['id'] == tool_id for tool in category['tools']):
+            return JOB_LIMITS.get(category_id, DEFAULT_JOB_LIMITS)
+    return DEFAULT_JOB_LIMITS
+
+def run_job(tool_id, input_file, form_data, extra_files=(), progress=None, cancel=None):
+    """Run process_file_by_tool in a supervised worker process
+
+    Workers are recycled as native libraries bloat them, and a job that
+    runs past its tool's time limits or its memory limit is killed
+    instead of taking the web process down with it. Setting cancel stops
+    the job at its next checkpoint, or kills it. JOB_WORKERS=0 runs jobs
+    in-process, where limits are not enforced and cancellation is only
+    cooperative.
+    """
+    try:
+        if not JOB_WORKERS:
+            with cancellable(cancel):
+                result = process_file_by_tool(tool_id, input_file, form_data, extra_files, progress)
+        else:
+            timeout, cpu_limit = job_limits(tool_id)
+            result = get_supervisor().run('main:process_file_by_tool', tool_id, input_file, form_data.to_dict(),
+                                          list(extra_files), progress=progress, timeout=timeout,
+                                          cpu_limit=cpu_limit, cancel=cancel)
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled()
+        return result
+    except JobCancelled:
+        return {'success': False, 'error': 'Job was cancelled', 'cancelled': True}
+    except JobTimeout:
+        return {'success': False, 'error': 'Processing took too long and was stopped'}
+    except JobMemoryExceeded:
+        return {'success': False, 'error': 'This file needs more memory than a job is allowed'}
+    except JobFailed as e:
+        logging.error(f"Job {tool_id} failed in worker: {e}")
+        return {'success': False, 'error': 'Processing failed'}
+
+def process_file_by_tool(tool_id, input_file, form_data, extra_files=(), progress=None):
     """Process file based on tool type"""
     
     # Import processing libraries as needed
     try:
         if tool_id.startswith('pdf-'):
-            return process_pdf_tool(tool_id, input_file, form_data)
+            return process_pdf_tool(tool_id, input_file, form_data, progress)
         elif tool_id.startswith('image-') or tool_id.startswith('convert-') or tool_id.startswith('bg-') or tool_id.startswith('meme-') or tool_id.startswith('face-'):
             return process_image_tool(tool_id, input_file, form_data)
         elif tool_id.startswith('audio-') or tool_id.startswith('video-') or tool_id.startswith('voice-') or tool_id.startswith('noise-') or tool_id.startswith('vocal-'):
-            return process_audio_video_tool(tool_id, input_file, form_data)
+            return process_audio_video_tool(tool_id, input_file, form_data, extra_files, progress)
         elif tool_id.startswith('pan-') or tool_id.startswith('aadhaar-') or tool_id.startswith('voter-') or tool_id in ['income-cert', 'caste-cert', 'ration-status', 'rent-agreement', 'birth-cert', 'death-cert', 'form16-extract', 'passport-photo', 'affidavit-creator', 'police-verify', 'gazette-cleaner', 'signature-extract']:
             return process_govt_tool(tool_id, input_file, form_data)
         else:
@@ -346,7 +629,7 @@ def process_file_by_tool(tool_id, input_file, form_data):
         logging.error(f"Missing library for {tool_id}: {str(e)}")
         return {'success': False, 'error': f'Tool temporarily unavailable. Missing dependency: {str(e)}'}
 
-def process_pdf_tool(tool_id, input_file, form_data):
+def process_pdf_tool(tool_id, input_file, form_data, progress=None):
     """Process PDF tools"""
     try:
         from PyPDF2 import PdfReader, PdfWriter
@@ -368,8 +651,11 @@ def process_pdf_tool(tool_id, input_file, form_data):
             # Basic compression simulation
             reader = PdfReader(input_file)
             writer = PdfWriter()
-            for page in reader.pages:
+            for number, page in enumerate(reader.pages, 1):
                 writer.add_page(page)
+                check_cancelled()
+                if progress:
+                    progress(number / len(reader.pages), pages=number)
             with open(output_path, 'wb') as output_file:
                 writer.write(output_file)
             return {'success': True, 'output_file': output_filename, 'filename': 'compressed.pdf'}
@@ -381,20 +667,27 @@ def process_pdf_tool(tool_id, input_file, form_data):
             page_range = form_data.get('pageRange', '1-1')
             try:
                 start, end = map(int, page_range.split('-'))
-                for i in range(start-1, min(end, len(reader.pages))):
+                selected = range(start-1, min(end, len(reader.pages)))
+                for number, i in enumerate(selected, 1):
                     writer.add_page(reader.pages[i])
+                    check_cancelled()
+                    if progress:
+                        progress(number / len(selected), pages=number)
                 with open(output_path, 'wb') as output_file:
                     writer.write(output_file)
                 return {'success': True, 'output_file': output_filename, 'filename': f'split_{page_range}.pdf'}
-            except:
+            except Exception:
                 return {'success': False, 'error': 'Invalid page range'}
                 
         elif tool_id == 'pdf-to-text':
             # Extract text from PDF
             reader = PdfReader(input_file)
             text_content = ""
-            for page in reader.pages:
+            for number, page in enumerate(reader.pages, 1):
                 text_content += page.extract_text() + "\n"
+                check_cancelled()
+                if progress:
+                    progress(number / len(reader.pages), pages=number)
             
             # Save as text file
             txt_filename = f"extracted_text_{uuid.uuid4()}.txt"
@@ -513,19 +806,10 @@ def process_image_tool(tool_id, input_file, form_data):
             pass
             
         elif tool_id == 'bg-remove' or tool_id == 'background-remover':
-            # Simple background removal using transparency
-            if processed_img.mode != 'RGBA':
-                processed_img = processed_img.convert('RGBA')
-            
-            # Convert to array for processing
-            import numpy as np
-            data = np.array(processed_img)
+            from utils.background_remover import BackgroundRemover
             
-            # Simple white background removal
-            white_bg = (data[:, :, 0] > 240) & (data[:, :, 1] > 240) & (data[:, :, 2] > 240)
-            data[white_bg] = [255, 255, 255, 0]  # Make white areas transparent
-            
-            processed_img = Image.fromarray(data, 'RGBA')
+            removal_quality = form_data.get('removalQuality', 'balanced')
+            processed_img = BackgroundRemover.remove_background(processed_img, removal_quality)
         
         # Determine output format and extension
         if tool_id == 'convert-jpg' or tool_id == 'convert-jpeg':
@@ -552,28 +836,21 @@ def process_image_tool(tool_id, input_file, form_data):
         output_filename = f"processed_{uuid.uuid4()}{extension}"
         output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
         
-        # Save with appropriate settings
-        save_kwargs = {}
-        if output_format == 'JPEG':
-            quality = safe_int(form_data.get('quality'), 85, 10, 100)
-            save_kwargs['quality'] = quality
-            save_kwargs['optimize'] = True
-            # Ensure RGB mode for JPEG
-            if processed_img.mode == 'RGBA':
-                background = Image.new('RGB', processed_img.size, (255, 255, 255))
-                background.paste(processed_img, mask=processed_img.split()[-1])
-                processed_img = background
-            elif processed_img.mode != 'RGB':
-                processed_img = processed_img.convert('RGB')
-        elif output_format == 'PNG':
-            save_kwargs['optimize'] = True
-        elif output_format == 'WEBP':
-            quality = safe_int(form_data.get('quality'), 90, 10, 100)
-            save_kwargs['quality'] = quality
-            save_kwargs['optimize'] = True
+        # Save with the shared encoder presets; an optional latency budget
+        # lets the encoder trade output size for speed on large images
+        from utils.image_encoder import encode, ENCODER_PRESETS
+        
+        quality = None
+        if output_format in ('JPEG', 'WEBP'):
+            quality = safe_int(form_data.get('quality'), 85 if output_format == 'JPEG' else 90, 10, 100)
+        preset = form_data.get('encoderPreset')
+        if preset not in ENCODER_PRESETS:
+            preset = None
+        latency_budget_ms = safe_int(form_data.get('latencyBudgetMs'), 0, 0, 600000)
         
         # Save the processed image
-        processed_img.save(output_path, format=output_format, **save_kwargs)
+        encode(processed_img, output_format, output_path, preset=preset, quality=quality,
+               latency_budget_ms=latency_budget_ms)
         
         return {
             'success': True, 
@@ -589,25 +866,83 @@ def process_image_tool(tool_id, input_file, form_data):
         logging.error(f"Image processing error: {str(e)}")
         return {'success': False, 'error': f'Image processing failed: {str(e)}'}
 
-def process_audio_video_tool(tool_id, input_file, form_data):
+def process_audio_video_tool(tool_id, input_file, form_data, extra_files=(), progress=None):
     """Process Audio/Video tools"""
     try:
-        # For audio/video processing, we'll create placeholder results
-        # In production, you'd use libraries like pydub, moviepy, ffmpeg
+        if tool_id == 'video-frames':
+            return extract_video_frames(input_file, form_data, progress)
         
-        output_filename = f"processed_{uuid.uuid4()}.mp3"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+        from utils.media_engine import MediaEngine, SUPPORTED_TOOLS
         
-        # Create a simple processed file (copy for demo)
-        import shutil
-        shutil.copy2(input_file, output_path)
+        if tool_id not in SUPPORTED_TOOLS:
+            return {'success': False, 'error': 'This tool is not available yet'}
         
-        return {'success': True, 'output_file': output_filename, 'filename': f'{tool_id}_processed.mp3'}
+        engine = MediaEngine(progress)
+        output_path = engine.process(tool_id, [input_file, *extra_files], media_options(form_data),
+                                     app.config['UPLOAD_FOLDER'])
+        extension = os.path.splitext(output_path)[1]
         
+        return {'success': True, 'output_file': os.path.basename(output_path), 'filename': f'{tool_id}_processed{extension}'}
+        
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    except ImportError:
+        raise
     except Exception as e:
         logging.error(f"Audio/Video processing error: {str(e)}")
         return {'success': False, 'error': f'Audio/Video processing failed: {str(e)}'}
 
+def media_options(form_data):
+    """Map the tool page's form fields to MediaEngine options"""
+    fields = {
+        'outputFormat': 'output_format', 'bitrate': 'bitrate', 'startTime': 'start_time', 'endTime': 'end_time',
+        'gainDb': 'gain_db', 'targetLufs': 'target_lufs', 'pitch': 'pitch', 'resolution': 'resolution',
+        'brightness': 'brightness', 'contrast': 'contrast', 'saturation': 'saturation',
+    }
+    options = {key: form_data[field] for field, key in fields.items() if form_data.get(field, '') != ''}
+    options['exact'] = form_data.get('trimMode') == 'exact'
+    return options
+
+def extract_video_frames(input_file, form_data, progress=None):
+    """Seek-based frame extraction into a ZIP of JPEG/WebP images"""
+    from utils.frame_extractor import extract_frames, parse_timestamps, MAX_FRAMES, SCENE_THRESHOLD
+    
+    mode = form_data.get('frameMode', 'interval')
+    image_format = 'WEBP' if form_data.get('frameFormat') == 'webp' else 'JPEG'
+    
+    options = {}
+    try:
+        if mode == 'timestamps':
+            options['timestamps'] = parse_timestamps(form_data.get('frameTimestamps', ''), max_frames=None)
+            if not options['timestamps']:
+                return {'success': False, 'error': 'Enter at least one timestamp'}
+        elif mode == 'scene':
+            options['scene_threshold'] = min(max(float(form_data.get('sceneThreshold', SCENE_THRESHOLD)), 0.05), 0.95)
+        else:
+            options['interval'] = max(float(form_data.get('frameInterval', 1)), 0.1)
+    except ValueError:
+        return {'success': False, 'error': 'Invalid frame selection'}
+    
+    output_filename = f"frames_{uuid.uuid4()}.zip"
+    output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+    
+    try:
+        with open(output_path, 'wb') as archive:
+            _, count, selected = extract_frames(input_file, image_format=image_format, output=archive,
+                                                progress=progress, **options)
+    except BaseException:
+        # Failed or cancelled part way: no partial archive is left in staging
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    
+    logging.info(f"Extracted {count} of {selected} selected frames")
+    result = {'success': True, 'output_file': output_filename, 'filename': 'video_frames.zip'}
+    if selected > MAX_FRAMES:
+        result['warning'] = (f'Only the first {MAX_FRAMES} of {selected} selected frames were extracted; '
+                             f'choose a longer interval or fewer timestamps to cover the whole video')
+    return result
+
 def process_govt_tool(tool_id, input_file, form_data):
     """Process Government document tools"""
     try:
@@ -619,19 +954,13 @@ def process_govt_tool(tool_id, input_file, form_data):
             pan_pattern = re.compile(r'^[A-Z]{5}[0-9]{4}[A-Z]{1}$')
             is_valid = bool(pan_pattern.match(pan_number))
             
-            # Create validation result file
+            # Validation result as a small text output
             result_content = f"PAN Validation Result\n" \
                            f"PAN Number: {pan_number}\n" \
                            f"Status: {'VALID' if is_valid else 'INVALID'}\n" \
                            f"Format Check: {'PASSED' if is_valid else 'FAILED'}\n"
             
-            output_filename = f"pan_validation_{uuid.uuid4()}.txt"
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            with open(output_path, 'w') as f:
-                f.write(result_content)
-            
-            return {'success': True, 'output_file': output_filename, 'filename': 'pan_validation_result.txt'}
+            return {'success': True, 'output_data': result_content.encode(), 'filename': 'pan_validation_result.txt'}
             
         elif tool_id == 'aadhaar-mask':
             # For Aadhaar masking, create a masked version
@@ -1,10 +1,40 @@
 #!/usr/bin/env python3
 """
-Simple script to run the Flask application
+Run the Flask application
+
+Production runs under gunicorn with gunicorn.conf.py: the app is loaded
+once and forked into a single uvicorn worker serving asgi.py, with job
+processes sized from the CPU count and memory.
+--dev runs Flask's own server instead, with the debugger and reloader
+when FLASK_DEBUG=true.
+
+Usage:
+    python run.py [--dev] [extra gunicorn options]
 """
-import subprocess
+import os
 import sys
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_dev():
+    from main import app
+    port = int(os.environ.get('PORT', 8080))
+    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    app.run(host='0.0.0.0', port=port, debug=debug_mode, threaded=True)
+
+
+def run_production(options):
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ['gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'), *options]
+    run()
+
+
 if __name__ == "__main__":
-    # Run the main Flask application
-    subprocess.run([sys.executable, "main.py"])
\ No newline at end of file
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    options = sys.argv[1:]
+    if '--dev' in options:
+        run_dev()
+    else:
+        run_production(options)
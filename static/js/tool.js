@@ -1,4 +1,9 @@
 // Tool functionality JavaScript
+
+// Files larger than this are sent through the resumable chunked upload API
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+// Attempts per chunk before the upload gives up
+const RESUMABLE_UPLOAD_RETRIES = 5;
 class ToolProcessor {
     constructor() {
         this.currentFile = null;
@@ -84,8 +89,68 @@ class ToolProcessor {
 
     handleFile(file) {
         this.currentFile = file;
+        this.mediaInfo = null;
         this.displayFileInfo(file);
         this.showNextStep();
+
+        if (file.type.startsWith('audio/') || file.type.startsWith('video/')) {
+            this.probeMedia(file);
+        }
+    }
+
+    async probeMedia(file) {
+        // Nothing is uploaded to probe: the browser reads the duration itself,
+        // and the server adds codecs only for a file it already holds
+        this.readLocalMetadata(file);
+
+        try {
+            const digest = await this.findStoredBlob(file);
+            if (!digest || file !== this.currentFile) return;
+            const response = await fetch(`/api/probe?blob=${digest}`);
+            if (!response.ok) return;
+            const result = await response.json();
+            if (file !== this.currentFile || !result.media) return;
+
+            this.mediaInfo = result.media;
+            this.applyMediaInfo(result.media);
+        } catch (error) {
+            console.warn('Media probe failed:', error);
+        }
+    }
+
+    readLocalMetadata(file) {
+        const element = document.createElement(file.type.startsWith('video/') ? 'video' : 'audio');
+        const url = URL.createObjectURL(file);
+        element.preload = 'metadata';
+        element.onloadedmetadata = () => {
+            URL.revokeObjectURL(url);
+            // The server's probe, when there is one, is more complete
+            if (file !== this.currentFile || this.mediaInfo || !isFinite(element.duration)) return;
+            this.mediaInfo = { duration: element.duration };
+            this.applyMediaInfo(this.mediaInfo);
+        };
+        element.onerror = () => URL.revokeObjectURL(url);
+        element.src = url;
+    }
+
+    applyMediaInfo(media) {
+        const fileSize = document.getElementById('fileSize');
+        if (fileSize && media.duration) {
+            const codecs = [media.video_codec, media.audio_codec].filter(Boolean).join(' / ');
+            fileSize.textContent = `${this.formatFileSize(this.currentFile.size)} • ${media.duration.toFixed(1)}s` +
+                (codecs ? ` • ${codecs}` : '');
+        }
+
+        // Keep trim inputs inside the real duration
+        const startTime = document.getElementById('startTime');
+        const endTime = document.getElementById('endTime');
+        if (media.duration && startTime && endTime) {
+            startTime.max = media.duration;
+            endTime.max = media.duration;
+            if (!endTime.value) {
+                endTime.placeholder = media.duration.toFixed(1);
+            }
+        }
     }
 
     displayFileInfo(file) {
@@ -210,6 +275,16 @@ class ToolProcessor {
                     </div>
                 </div>
             `,
+            'bg-remove': `
+                <div class="config-group">
+                    <label for="removalQuality">Removal Quality</label>
+                    <select class="form-select" id="removalQuality">
+                        <option value="fast">Fast (Preview)</option>
+                        <option value="balanced" selected>Balanced</option>
+                        <option value="high">High (Sharper edges)</option>
+                    </select>
+                </div>
+            `,
             // Audio Tools
             'audio-trim': `
                 <div class="config-group">
@@ -221,6 +296,31 @@ class ToolProcessor {
                     <input type="number" class="form-control" id="endTime" placeholder="30" min="1">
                 </div>
             `,
+            'video-frames': `
+                <div class="config-group">
+                    <label for="frameMode">Frames to Extract</label>
+                    <select class="form-select" id="frameMode">
+                        <option value="interval" selected>Every N seconds</option>
+                        <option value="timestamps">At specific times</option>
+                        <option value="scene">At scene changes</option>
+                    </select>
+                </div>
+                <div class="config-group">
+                    <label for="frameInterval">Interval (seconds)</label>
+                    <input type="number" class="form-control" id="frameInterval" value="1" min="0.1" step="0.1">
+                </div>
+                <div class="config-group">
+                    <label for="frameTimestamps">Timestamps (e.g. 5, 1:30, 90.5)</label>
+                    <input type="text" class="form-control" id="frameTimestamps" placeholder="0, 10, 1:30">
+                </div>
+                <div class="config-group">
+                    <label for="frameFormat">Image Format</label>
+                    <select class="form-select" id="frameFormat">
+                        <option value="jpg" selected>JPEG</option>
+                        <option value="webp">WebP</option>
+                    </select>
+                </div>
+            `,
             'audio-convert': `
                 <div class="config-group">
                     <label for="outputFormat">Output Format</label>
@@ -241,6 +341,106 @@ class ToolProcessor {
                     </select>
                 </div>
             `,
+            'audio-boost': `
+                <div class="config-group">
+                    <label for="gainDb">Volume Boost (dB)</label>
+                    <input type="range" class="form-range" id="gainDb" min="1" max="20" value="6">
+                    <small class="form-text text-muted">Peaks are limited instead of clipping</small>
+                </div>
+            `,
+            'audio-normalize': `
+                <div class="config-group">
+                    <label for="targetLufs">Target Loudness</label>
+                    <select class="form-select" id="targetLufs">
+                        <option value="-14">-14 LUFS (Streaming)</option>
+                        <option value="-16" selected>-16 LUFS (Podcast)</option>
+                        <option value="-23">-23 LUFS (Broadcast)</option>
+                    </select>
+                </div>
+            `,
+            'audio-join': `
+                <div class="config-group">
+                    <label for="extraFiles">Files to Append (in order)</label>
+                    <input type="file" class="form-control" id="extraFiles" accept="audio/*" multiple>
+                </div>
+            `,
+            'voice-change': `
+                <div class="config-group">
+                    <label for="pitch">Voice Pitch</label>
+                    <select class="form-select" id="pitch">
+                        <option value="0.75">Deeper</option>
+                        <option value="1.25" selected>Higher</option>
+                        <option value="1.6">Chipmunk</option>
+                    </select>
+                </div>
+            `,
+            // Video Tools
+            'video-trim': `
+                <div class="config-group">
+                    <label for="startTime">Start Time (seconds)</label>
+                    <input type="number" class="form-control" id="startTime" placeholder="0" min="0">
+                </div>
+                <div class="config-group">
+                    <label for="endTime">End Time (seconds)</label>
+                    <input type="number" class="form-control" id="endTime" placeholder="30" min="1">
+                </div>
+                <div class="config-group">
+                    <label for="trimMode">Cut Mode</label>
+                    <select class="form-select" id="trimMode">
+                        <option value="fast" selected>Fast (nearest keyframe)</option>
+                        <option value="exact">Exact (frame accurate)</option>
+                    </select>
+                </div>
+            `,
+            'video-convert': `
+                <div class="config-group">
+                    <label for="outputFormat">Output Format</label>
+                    <select class="form-select" id="outputFormat">
+                        <option value="mp4" selected>MP4</option>
+                        <option value="mkv">MKV</option>
+                        <option value="mov">MOV</option>
+                        <option value="webm">WebM</option>
+                        <option value="avi">AVI</option>
+                    </select>
+                </div>
+            `,
+            'video-resize': `
+                <div class="config-group">
+                    <label for="resolution">Resolution</label>
+                    <select class="form-select" id="resolution">
+                        <option value="1080p">1080p</option>
+                        <option value="720p" selected>720p</option>
+                        <option value="480p">480p</option>
+                        <option value="360p">360p</option>
+                    </select>
+                </div>
+            `,
+            'video-join': `
+                <div class="config-group">
+                    <label for="extraFiles">Videos to Append (in order)</label>
+                    <input type="file" class="form-control" id="extraFiles" accept="video/*" multiple>
+                </div>
+            `,
+            'video-add-audio': `
+                <div class="config-group">
+                    <label for="extraFiles">Audio Track</label>
+                    <input type="file" class="form-control" id="extraFiles" accept="audio/*">
+                </div>
+            `,
+            'video-color': `
+                <div class="config-group">
+                    <label for="brightness">Brightness</label>
+                    <input type="range" class="form-range" id="brightness" min="-0.5" max="0.5" step="0.05" value="0">
+                </div>
+                <div class="config-group">
+                    <label for="contrast">Contrast</label>
+                    <input type="range" class="form-range" id="contrast" min="0.5" max="2" step="0.05" value="1">
+                </div>
+                <div class="config-group">
+                    <label for="saturation">Saturation</label>
+                    <input type="range" class="form-range" id="saturation" min="0" max="3" step="0.1" value="1">
+                </div>
+            `,
             // Government Tools
             'pan-validator': `
                 <div class="config-group">
@@ -308,24 +508,53 @@ class ToolProcessor {
         processBtn.disabled = true;
         processBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Processing...';
 
+        // The job id names the job for progress events and the cancel API
+        const jobId = this.createJobId();
+        this.jobId = jobId;
+        this.cancelled = false;
+        this.requestController = new AbortController();
+
         try {
-            // Create FormData with file and configuration
-            const formData = new FormData();
-            formData.append('file', this.currentFile);
-            
-            // Add configuration options
-            this.addConfigToFormData(formData);
+            // Skip the upload when the server already holds this exact file,
+            // and send large files in resumable chunks
+            progressBar.style.width = '0%';
+            progressText.textContent = 'Checking file...';
+            let source = null;
+            const digest = await this.findStoredBlob(this.currentFile);
+            if (digest) {
+                source = { blob: digest };
+            } else if (this.currentFile.size > RESUMABLE_UPLOAD_THRESHOLD) {
+                const uploadId = await this.uploadInChunks(this.currentFile, progressBar, progressText);
+                if (uploadId) source = { upload_id: uploadId };
+            }
 
-            // Start progress animation
-            this.simulateProgress(progressBar, progressText);
+            // Follow server-side progress while the request runs
+            if (this.cancelled) throw new Error('Job cancelled');
+            progressText.textContent = source ? 'Processing...' : 'Uploading file...';
+            this.watchProgress(jobId, progressBar, progressText);
 
             // Send request to backend
-            const response = await fetch(`/process/${this.toolId}`, {
-                method: 'POST',
-                body: formData
-            });
-
-            const result = await response.json();
+            let result;
+            try {
+                let response = await fetch(`/process/${this.toolId}`, {
+                    method: 'POST',
+                    body: this.buildFormData(jobId, source),
+                    signal: this.requestController.signal
+                });
+                result = await response.json();
+                if (result.blob_missing) {
+                    // The blob expired between the check and the request
+                    progressText.textContent = 'Uploading file...';
+                    response = await fetch(`/process/${this.toolId}`, {
+                        method: 'POST',
+                        body: this.buildFormData(jobId, null),
+                        signal: this.requestController.signal
+                    });
+                    result = await response.json();
+                }
+            } finally {
+                this.stopWatchingProgress();
+            }
 
             if (result.success) {
                 // Stop progress and show result
@@ -336,7 +565,10 @@ class ToolProcessor {
                     
                     // Setup download button
                     const downloadBtn = document.getElementById('downloadBtn');
-                    downloadBtn.onclick = () => this.downloadResult(result.download_url, result.filename);
+                    downloadBtn.onclick = () => this.downloadResult(result.download_url, result.filename, result.inline);
+                    if (result.warning) {
+                        this.showNotification(result.warning, 'warning');
+                    }
                     
                     // Scroll to result
                     resultSection.scrollIntoView({ behavior: 'smooth', block: 'center' });
@@ -349,32 +581,185 @@ class ToolProcessor {
             processBtn.disabled = false;
             processBtn.innerHTML = '<i class="fas fa-cogs me-2"></i>Process ' + this.getToolName();
             
-            this.showNotification('Error: ' + error.message, 'danger');
+            if (this.cancelled) {
+                this.showNotification('Processing cancelled', 'warning');
+            } else {
+                this.showNotification('Error: ' + error.message, 'danger');
+            }
+        } finally {
+            this.jobId = null;
         }
     }
 
-    async simulateProgress(progressBar, progressText) {
-        const steps = [
-            'Uploading file...',
-            'Analyzing content...',
-            'Processing with AI...',
-            'Optimizing output...',
-            'Finalizing...'
-        ];
-
-        for (let i = 0; i < steps.length; i++) {
-            progressText.textContent = steps[i];
-            const progress = ((i + 1) / steps.length) * 100;
-            progressBar.style.width = progress + '%';
-            await new Promise(resolve => setTimeout(resolve, 800));
+    cancelJob() {
+        // Stop the server-side job first so its worker is freed, then drop the request
+        if (!this.jobId || this.cancelled) return;
+        this.cancelled = true;
+        document.getElementById('progressText').textContent = 'Cancelling...';
+        fetch(`/jobs/${this.jobId}/cancel`, { method: 'POST' }).catch(() => {});
+        this.stopWatchingProgress();
+        this.requestController.abort();
+    }
+
+    buildFormData(jobId, source) {
+        // Create FormData with the file, or a reference to it, and configuration
+        const formData = new FormData();
+        if (source && source.blob) {
+            formData.append('blob', source.blob);
+            formData.append('filename', this.currentFile.name);
+        } else if (source && source.upload_id) {
+            formData.append('upload_id', source.upload_id);
+        } else {
+            formData.append('file', this.currentFile);
         }
+        formData.append('job_id', jobId);
+        this.addConfigToFormData(formData);
+        return formData;
+    }
+
+    async sha256Hex(data) {
+        const hash = await crypto.subtle.digest('SHA-256', data);
+        return Array.from(new Uint8Array(hash)).map(byte => byte.toString(16).padStart(2, '0')).join('');
+    }
+
+    async uploadInChunks(file, progressBar, progressText) {
+        // Resumable upload: only the ranges the server is missing are sent,
+        // so a dropped connection or a page reload costs one chunk at most.
+        // Returns the upload id, or null to fall back to a plain upload.
+        if (!window.crypto || !crypto.subtle) return null;
+        const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+        let status = null;
+        const savedId = localStorage.getItem(resumeKey);
+        if (savedId) {
+            const response = await fetch(`/api/uploads/${savedId}`);
+            if (response.ok) status = await response.json();
+        }
+        if (!status) {
+            const response = await fetch('/api/uploads', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            if (!response.ok) return null;
+            status = await response.json();
+            localStorage.setItem(resumeKey, status.upload_id);
+        }
+
+        const chunkSize = status.chunk_size || 8 * 1024 * 1024;
+        for (const [rangeStart, rangeEnd] of status.missing) {
+            for (let start = rangeStart; start < rangeEnd; start += chunkSize) {
+                if (this.cancelled) throw new Error('Job cancelled');
+                const chunk = file.slice(start, Math.min(start + chunkSize, rangeEnd));
+                const checksum = await this.sha256Hex(await chunk.arrayBuffer());
+                for (let attempt = 1; ; attempt++) {
+                    try {
+                        const response = await fetch(`/api/uploads/${status.upload_id}?offset=${start}`, {
+                            method: 'PUT',
+                            headers: { 'X-Chunk-SHA256': checksum },
+                            body: chunk,
+                            signal: this.requestController.signal
+                        });
+                        if (response.status === 404) {
+                            localStorage.removeItem(resumeKey);
+                            return null;
+                        }
+                        if (!response.ok) throw new Error('Chunk upload failed');
+                        const progress = await response.json();
+                        progressBar.style.width = Math.round(progress.received / progress.size * 100) + '%';
+                        progressText.textContent = `Uploading file... ${Math.round(progress.received / progress.size * 100)}%`;
+                        break;
+                    } catch (error) {
+                        if (this.cancelled || attempt >= RESUMABLE_UPLOAD_RETRIES) throw error;
+                        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                    }
+                }
+            }
+        }
+
+        localStorage.removeItem(resumeKey);
+        return status.upload_id;
+    }
+
+    fileDigest(file) {
+        // Hashed once per selected file; the probe and the upload both need it
+        if (this.digestFile !== file) {
+            this.digestFile = file;
+            this.digestPromise = file.arrayBuffer().then(data => this.sha256Hex(data));
+        }
+        return this.digestPromise;
+    }
+
+    async findStoredBlob(file) {
+        // SHA-256 of the file if the server already holds it, otherwise null
+        if (!window.crypto || !crypto.subtle) return null;
+        try {
+            const digest = await this.fileDigest(file);
+            const response = await fetch(`/api/blobs/${digest}`, { method: 'HEAD' });
+            return response.ok ? digest : null;
+        } catch (error) {
+            return null;
+        }
+    }
+
+    createJobId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2, 12);
+    }
+
+    watchProgress(jobId, progressBar, progressText) {
+        this.stopWatchingProgress();
+        if (!window.EventSource) return;
+
+        // Events carry the real stage, fraction done and an ETA from the server
+        this.progressEvents = new EventSource(`/jobs/${jobId}/events`);
+        this.progressEvents.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (event.state === 'started') {
+                progressText.textContent = 'Processing...';
+            } else if (event.state === 'processing') {
+                progressBar.style.width = Math.round(event.progress * 100) + '%';
+                progressText.textContent = this.describeProgress(event);
+            } else if (event.state === 'done') {
+                progressBar.style.width = '100%';
+                progressText.textContent = 'Finalizing...';
+                this.stopWatchingProgress();
+            } else if (['error', 'cancelled', 'unknown'].includes(event.state)) {
+                // 'unknown': the job never started here; the request itself still answers
+                this.stopWatchingProgress();
+            }
+        };
+    }
+
+    stopWatchingProgress() {
+        if (this.progressEvents) {
+            this.progressEvents.close();
+            this.progressEvents = null;
+        }
+    }
+
+    describeProgress(event) {
+        let text = `Processing... ${Math.round(event.progress * 100)}%`;
+        if (event.pages) {
+            text += ` • ${event.pages} pages`;
+        } else if (event.frames) {
+            text += ` • ${event.frames} frames`;
+        }
+        if (event.eta !== null && event.eta !== undefined && event.progress < 1) {
+            text += ` • about ${Math.max(1, Math.round(event.eta))}s left`;
+        }
+        return text;
     }
 
     addConfigToFormData(formData) {
         // Add all form inputs to FormData
         const configInputs = document.querySelectorAll('#configOptions input, #configOptions select');
         configInputs.forEach(input => {
-            if (input.type === 'checkbox') {
+            if (input.type === 'file') {
+                Array.from(input.files).forEach(file => formData.append(input.name || input.id, file));
+            } else if (input.type === 'checkbox') {
                 if (input.checked) {
                     formData.append(input.name || input.id, 'on');
                 }
@@ -384,8 +769,19 @@ class ToolProcessor {
         });
     }
 
-    downloadResult(downloadUrl, filename) {
-        if (downloadUrl) {
+    downloadResult(downloadUrl, filename, inline) {
+        if (inline) {
+            // Small outputs come inline in the response; save them without a request
+            const bytes = Uint8Array.from(atob(inline.data), c => c.charCodeAt(0));
+            const url = URL.createObjectURL(new Blob([bytes], { type: inline.mimetype }));
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = filename || inline.filename;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+            URL.revokeObjectURL(url);
+        } else if (downloadUrl) {
             // Use the actual download URL from backend
             const a = document.createElement('a');
             a.href = downloadUrl;
@@ -458,6 +854,12 @@ function processFile() {
     }
 }
 
+function cancelProcessing() {
+    if (window.toolProcessor) {
+        window.toolProcessor.cancelJob();
+    }
+}
+
 function resetTool() {
     if (window.toolProcessor) {
         window.toolProcessor.resetTool();
@@ -4,7 +4,7 @@ File handling utilities for Suntyn AI platform
 
 import os
 import shutil
-import tempfile
+import time
 from werkzeug.utils import secure_filename
 from flask import current_app
 import logging
@@ -76,20 +76,22 @@ def format_file_size(bytes_size):
     
     return f"{bytes_size:.1f} {size_names[size_index]}"
 
-def cleanup_temp_files():
-    """Clean up temporary files older than 1 hour"""
+def cleanup_temp_files(max_age=3600):
+    """Remove this app's uploads older than max_age seconds (default 1 hour)
+
+    Only the app's own uploads directory is scanned; the system temp
+    directory is shared with other programs and must not be swept.
+    """
     try:
-        temp_dir = tempfile.gettempdir()
-        current_time = time.time()
+        upload_dir = ensure_upload_directory()
+        cutoff = time.time() - max_age
         
-        for filename in os.listdir(temp_dir):
-            file_path = os.path.join(temp_dir, filename)
-            if os.path.isfile(file_path):
-                file_age = current_time - os.path.getctime(file_path)
-                if file_age > 3600:  # 1 hour
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
+        with os.scandir(upload_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
     except Exception as e:
         logger.error(f"Error cleaning temp files: {str(e)}")
\ No newline at end of file
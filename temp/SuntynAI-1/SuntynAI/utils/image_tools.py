@@ -4,6 +4,9 @@ Image processing utilities for the Image Toolkit
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
 import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Optional dependencies with graceful fallbacks
 try:
@@ -26,6 +29,18 @@ try:
 except ImportError:
     PIEXIF_AVAILABLE = False
 
+# Watermark stamps are rendered once per (text, size, opacity) and reused
+WATERMARK_FONT = 'arial.ttf'
+WATERMARK_FONT_SIZE = 36
+WATERMARK_MARGIN = 20
+
+# Face detection settings
+FACE_CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+FACE_DETECT_MAX_SIDE = 1024  # Longest side of the copy the detector runs on
+
+# Cascades are loaded once per worker thread and reused across calls
+_face_detectors = threading.local()
+
 def resize_image(file, width, height, maintain_aspect=False):
     """Resize image to specified dimensions"""
     img = Image.open(file)
@@ -115,41 +130,55 @@ def rotate_image(file, angle):
     output.seek(0)
     return output, format.lower()
 
+@lru_cache(maxsize=32)
+def load_font(font_name, size):
+    """Load a font once per process, falling back to the default font"""
+    try:
+        return ImageFont.truetype(font_name, size)
+    except OSError:
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=256)
+def get_watermark_stamp(watermark_text, opacity=128, size=WATERMARK_FONT_SIZE):
+    """Pre-render watermark text into a tight RGBA stamp
+
+    Returns the stamp and the offset of its glyph box from the text anchor.
+    """
+    font = load_font(WATERMARK_FONT, size)
+    probe = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    left, top, right, bottom = probe.textbbox((0, 0), watermark_text, font=font)
+
+    stamp = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (255, 255, 255, 0))
+    ImageDraw.Draw(stamp).text((-left, -top), watermark_text, fill=(255, 255, 255, opacity), font=font)
+    return stamp, (left, top)
+
 def add_watermark(file, watermark_text, position='bottom-right', opacity=128):
     """Add text watermark to image"""
     img = Image.open(file)
     
-    # Create a transparent overlay
-    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(overlay)
-    
-    # Try to load a font
-    try:
-        font = ImageFont.truetype('arial.ttf', 36)
-    except:
-        font = ImageFont.load_default()
-    
-    # Calculate text position
-    text_bbox = draw.textbbox((0, 0), watermark_text, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
+    # Reuse the pre-rendered stamp for this text
+    stamp, (offset_x, offset_y) = get_watermark_stamp(watermark_text, opacity)
+    text_width, text_height = stamp.size
     
     if position == 'bottom-right':
-        x = img.width - text_width - 20
-        y = img.height - text_height - 20
+        x = img.width - text_width - WATERMARK_MARGIN
+        y = img.height - text_height - WATERMARK_MARGIN
     elif position == 'top-left':
-        x, y = 20, 20
+        x, y = WATERMARK_MARGIN, WATERMARK_MARGIN
     elif position == 'center':
         x = (img.width - text_width) // 2
         y = (img.height - text_height) // 2
     else:
-        x, y = 20, 20
+        x, y = WATERMARK_MARGIN, WATERMARK_MARGIN
+    x, y = x + offset_x, y + offset_y
     
-    # Draw watermark
-    draw.text((x, y), watermark_text, fill=(255, 255, 255, opacity), font=font)
-    
-    # Composite the overlay
-    watermarked = Image.alpha_composite(img.convert('RGBA'), overlay)
+    # Composite the stamp, clipped to the image bounds
+    watermarked = img.convert('RGBA')
+    left, top = max(0, -x), max(0, -y)
+    right = min(text_width, watermarked.width - x)
+    bottom = min(text_height, watermarked.height - y)
+    if right > left and bottom > top:
+        watermarked.alpha_composite(stamp, dest=(x + left, y + top), source=(left, top, right, bottom))
     
     output = io.BytesIO()
     watermarked.convert('RGB').save(output, format='PNG')
@@ -303,6 +332,61 @@ def images_to_pdf(files):
     output.seek(0)
     return output, 'pdf'
 
+def get_face_detector():
+    """Return the face cascade for the current worker, loading it on first use"""
+    detector = getattr(_face_detectors, 'cascade', None)
+    if detector is None:
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + FACE_CASCADE_FILE)
+        if detector.empty():
+            raise RuntimeError(f"Could not load face cascade {FACE_CASCADE_FILE}")
+        _face_detectors.cascade = detector
+    return detector
+
+def detect_faces(img, max_side=FACE_DETECT_MAX_SIDE):
+    """Detect faces in a BGR image on a downscaled copy
+
+    Returns a list of (x, y, w, h) boxes in full-resolution coordinates.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape[:2]
+
+    # Run the cascade on a smaller copy, then map the boxes back
+    scale = min(1.0, max_side / float(max(height, width)))
+    if scale < 1.0:
+        small_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        gray = cv2.resize(gray, small_size, interpolation=cv2.INTER_AREA)
+
+    faces = get_face_detector().detectMultiScale(gray, 1.1, 4)
+
+    boxes = []
+    for (x, y, w, h) in faces:
+        x0 = max(0, int(x / scale))
+        y0 = max(0, int(y / scale))
+        x1 = min(width, int((x + w) / scale))
+        y1 = min(height, int((y + h) / scale))
+        if x1 > x0 and y1 > y0:
+            boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
+
+def detect_faces_batch(files, max_workers=None, max_side=FACE_DETECT_MAX_SIDE):
+    """Detect faces across many images in parallel threads
+
+    OpenCV releases the GIL while decoding and detecting, so a thread pool
+    scales across cores. Returns one list of boxes per input, in order.
+    """
+    if not CV2_AVAILABLE:
+        raise ImportError("OpenCV is required for face detection")
+
+    def _detect(file):
+        nparr = np.frombuffer(file.read(), np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if img is None:
+            return []
+        return detect_faces(img, max_side)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_detect, files))
+
 def pixelate_faces(file):
     """Detect and pixelate faces in image"""
     if not CV2_AVAILABLE:
@@ -319,12 +403,8 @@ def pixelate_faces(file):
     nparr = np.frombuffer(file_bytes, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     
-    # Load face cascade
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
     # Detect faces
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+    faces = detect_faces(img)
     
     # Pixelate each face
     for (x, y, w, h) in faces:
@@ -352,12 +432,8 @@ def create_meme(file, top_text='', bottom_text=''):
     img = Image.open(file)
     draw = ImageDraw.Draw(img)
     
-    # Try to load Impact font or use default
-    try:
-        font_size = max(20, img.width // 20)
-        font = ImageFont.truetype('arial.ttf', font_size)
-    except:
-        font = ImageFont.load_default()
+    # Load font (cached per size) or use default
+    font = load_font('arial.ttf', max(20, img.width // 20))
     
     # Add top text
     if top_text:
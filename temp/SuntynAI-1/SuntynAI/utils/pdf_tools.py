@@ -11,6 +11,7 @@ from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 import fitz  # PyMuPDF
 from PIL import Image
+from utils.security import save_upload
 try:
     from PyPDF2 import PdfReader, PdfWriter
 except ImportError:
@@ -52,7 +53,11 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_uploaded_file(file):
-    """Save uploaded file and return path"""
+    """Save uploaded file and return path, or None if it is rejected
+
+    The file is hashed, sniffed and scanned as it is written (see
+    utils.security.save_upload), so a non-PDF is never kept.
+    """
     if file and file.filename and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_")
@@ -61,8 +66,8 @@ def save_uploaded_file(file):
         
         # Reset file pointer to beginning
         file.seek(0)
-        file.save(filepath)
-        return filepath
+        if save_upload(file, filepath, ['pdf'], max_size=MAX_FILE_SIZE)['safe']:
+            return filepath
     return None
 
 def create_temp_file(suffix='.pdf'):
@@ -626,13 +631,12 @@ def cleanup_temp_files():
         import time
         current_time = time.time()
 
+        # Only this module's own folders; scandir returns the stat data with the listing
         for folder in [UPLOAD_FOLDER, TEMP_FOLDER]:
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path):
-                    file_time = os.path.getmtime(file_path)
-                    if current_time - file_time > 3600:  # 1 hour
-                        os.remove(file_path)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and current_time - entry.stat().st_mtime > 3600:  # 1 hour
+                        os.remove(entry.path)
     except Exception as e:
         print(f"Cleanup error: {e}")
 
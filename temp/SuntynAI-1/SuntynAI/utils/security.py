@@ -3,6 +3,7 @@ Security utilities for file validation and malware scanning
 """
 
 import os
+import re
 import mimetypes
 import hashlib
 import logging
@@ -55,6 +56,56 @@ MALICIOUS_PATTERNS = [
     b'require(',
 ]
 
+# One alternation over every pattern, so a buffer is scanned once instead of once per pattern
+MALICIOUS_REGEX = re.compile(b'|'.join(re.escape(pattern) for pattern in MALICIOUS_PATTERNS))
+
+# Only the start of a file is scanned for patterns, as before; the hash covers everything
+SCAN_LIMIT = 1024 * 1024
+
+# Read size for hashing, scanning and copying uploads
+CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes that identify a format: (offset, signature, category)
+MAGIC_SIGNATURES = [
+    (0, b'%PDF-', 'pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image'),
+    (0, b'\xff\xd8\xff', 'image'),
+    (0, b'GIF87a', 'image'),
+    (0, b'GIF89a', 'image'),
+    (0, b'II*\x00', 'image'),
+    (0, b'MM\x00*', 'image'),
+    (8, b'WEBP', 'image'),
+    (8, b'AVI ', 'video'),
+    (8, b'WAVE', 'audio'),
+    (4, b'ftyp', 'video'),
+    (0, b'\x1a\x45\xdf\xa3', 'video'),
+    (0, b'FLV', 'video'),
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'video'),
+    (0, b'ID3', 'audio'),
+    (0, b'\xff\xfb', 'audio'),
+    (0, b'\xff\xf3', 'audio'),
+    (0, b'\xff\xf1', 'audio'),
+    (0, b'OggS', 'audio'),
+    (0, b'fLaC', 'audio'),
+    (0, b'PK\x03\x04', 'archive'),
+    (0, b'Rar!', 'archive'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'archive'),
+    (0, b'\x1f\x8b', 'archive'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'document'),
+]
+SNIFF_BYTES = 18
+
+# 'BM' alone also starts plenty of text; a bitmap follows it with one of
+# these DIB header sizes (little-endian) at offset 14
+BMP_HEADER_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+# Office and OpenDocument files are ZIP containers; MP4-family audio uses ftyp
+COMPATIBLE_CATEGORIES = {
+    'archive': {'document', 'spreadsheet', 'presentation'},
+    'video': {'audio'},
+    'document': {'spreadsheet', 'presentation'},
+}
+
 def validate_file_type(filename, allowed_categories):
     """
     Validate file type against allowed categories
@@ -114,13 +165,13 @@ def scan_for_malware(file_path):
     try:
         with open(file_path, 'rb') as f:
             # Read first 1MB for scanning
-            content = f.read(1024 * 1024)
+            content = f.read(SCAN_LIMIT)
             
             # Check for malicious patterns
-            for pattern in MALICIOUS_PATTERNS:
-                if pattern in content:
-                    logger.warning(f"Malicious pattern found in {file_path}: {pattern}")
-                    return False
+            match = MALICIOUS_REGEX.search(content)
+            if match:
+                logger.warning(f"Malicious pattern found in {file_path}: {match.group()}")
+                return False
         
         return True
         
@@ -143,7 +194,7 @@ def calculate_file_hash(file_path, algorithm='sha256'):
         hash_func = hashlib.new(algorithm)
         
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
                 hash_func.update(chunk)
         
         return hash_func.hexdigest()
@@ -194,6 +245,131 @@ def validate_mime_type(file_path, allowed_types):
         logger.error(f"Error checking MIME type for {file_path}: {str(e)}")
         return False
 
+def sniff_category(header):
+    """
+    Identify a file's category from its leading bytes
+    
+    Args:
+        header: First bytes of the file
+        
+    Returns:
+        str: Category, or None for formats without a signature (text, CSV, SVG)
+    """
+    for offset, signature, category in MAGIC_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return category
+    if header[:2] == b'BM' and int.from_bytes(header[14:18], 'little') in BMP_HEADER_SIZES:
+        return 'image'
+    return None
+
+class UploadValidator:
+    """
+    Hash, sniff and scan an upload in one pass over its chunks
+    
+    Feed chunks in order with update(). The pattern scan keeps the last
+    few bytes of each chunk so a pattern split across a chunk boundary is
+    still found, and stops at SCAN_LIMIT; hashing covers the whole file.
+    Only content without a binary signature (text, markup, SVG) is
+    scanned: in compressed data a short pattern such as b'<%' turns up by
+    chance every few kilobytes.
+    """
+    
+    def __init__(self, algorithm='sha256', scan_limit=SCAN_LIMIT):
+        self.hash = hashlib.new(algorithm)
+        self.scan_limit = scan_limit
+        self.size = 0
+        self.header = b''
+        self.threat = None
+        self._overlap = max(len(pattern) for pattern in MALICIOUS_PATTERNS) - 1
+        self._tail = b''
+    
+    def update(self, chunk):
+        self.hash.update(chunk)
+        if len(self.header) < SNIFF_BYTES:
+            self.header += chunk[:SNIFF_BYTES - len(self.header)]
+        
+        if self.threat is None and self.size < self.scan_limit and self.category is None:
+            window = self._tail + chunk[:self.scan_limit - self.size]
+            match = MALICIOUS_REGEX.search(window)
+            if match:
+                self.threat = match.group()
+            self._tail = window[-self._overlap:]
+        
+        self.size += len(chunk)
+    
+    @property
+    def category(self):
+        return sniff_category(self.header)
+    
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def content_matches_extension(filename, sniffed_category):
+    """
+    Check that sniffed content agrees with the file extension
+    
+    Formats without a signature (text, CSV, SVG...) cannot be sniffed and
+    are accepted on their extension alone.
+    """
+    if sniffed_category is None:
+        return True
+    declared = get_file_category(filename)
+    return declared == sniffed_category or declared in COMPATIBLE_CATEGORIES.get(sniffed_category, ())
+
+def save_upload(file, destination, allowed_categories, chunk_size=CHUNK_SIZE, max_size=None):
+    """
+    Write an upload to disk while hashing, sniffing and scanning it
+    
+    The data is read once in chunk_size blocks. Writing stops as soon as
+    the size limit is passed or a malicious pattern is found, and the
+    partial file is removed whenever the upload is rejected.
+    
+    Args:
+        file: Uploaded file object (werkzeug FileStorage)
+        destination: Path to write the file to
+        allowed_categories: List of allowed file categories
+        max_size: Size limit in bytes, instead of the category's MAX_FILE_SIZES entry
+        
+    Returns:
+        dict: Safety check results, with size, sha256 and sniffed category when safe
+    """
+    result = is_safe_upload(file, allowed_categories)
+    if not result['safe']:
+        return result
+    result['safe'] = False
+    
+    if max_size is None:
+        max_size = MAX_FILE_SIZES.get(get_file_category(file.filename), MAX_FILE_SIZES['default'])
+    validator = UploadValidator()
+    stream = getattr(file, 'stream', file)
+    
+    try:
+        with open(destination, 'wb') as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                validator.update(chunk)
+                if validator.size > max_size:
+                    result['errors'].append('File size too large')
+                    break
+                if validator.threat is not None:
+                    logger.warning(f"Malicious pattern found in {file.filename}: {validator.threat}")
+                    result['errors'].append('File failed security scan')
+                    break
+                out.write(chunk)
+        
+        if not result['errors'] and not content_matches_extension(file.filename, validator.category):
+            result['errors'].append('File content does not match its extension')
+    except OSError as e:
+        logger.error(f"Error saving upload {file.filename}: {str(e)}")
+        result['errors'].append('Could not save file')
+    
+    if result['errors']:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return result
+    
+    result.update(safe=True, size=validator.size, sha256=validator.hexdigest(), category=validator.category)
+    return result
+
 def is_safe_upload(file, allowed_categories):
     """
     Comprehensive file safety check
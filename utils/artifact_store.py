@@ -0,0 +1,555 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_ROOT = os.environ.get('ARTIFACT_ROOT') or os.path.join(tempfile.gettempdir(), 'suntyn-artifacts')
+
+# Seconds an output stays downloadable
+ARTIFACT_TTL = int(os.environ.get('ARTIFACT_TTL') or 3600)
+
+# Disk space one client may hold; its oldest artifacts are evicted past this
+CLIENT_QUOTA_BYTES = int(os.environ.get('ARTIFACT_CLIENT_QUOTA_MB') or 500) * 1024 * 1024
+
+# Uploaded blobs stay this long after their last use so repeat uploads of
+# the same file (blank forms, templates) can skip the transfer
+BLOB_RETENTION = int(os.environ.get('ARTIFACT_BLOB_RETENTION') or 24 * 3600)
+
+# A blob is offered for deduplication to other clients only once this many
+# distinct clients have uploaded it, so hash probing cannot confirm that a
+# private document was uploaded by someone else
+DEDUP_MIN_CLIENTS = 2
+
+# A referenced blob is only reaped once it has been idle this long; a
+# reference that old belongs to a job that died without releasing it
+STALE_REFERENCE_SECONDS = BLOB_RETENTION + 6 * 3600
+
+# Suggested size of one chunk of a resumable upload
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Seconds between reaper passes, and rows deleted per transaction
+REAP_INTERVAL = 60
+REAP_BATCH = 500
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,199}$')
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    client TEXT,
+    size INTEGER,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_expires ON artifacts (expires);
+CREATE INDEX IF NOT EXISTS artifacts_client ON artifacts (client, created);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+CREATE TABLE IF NOT EXISTS blob_clients (
+    digest TEXT NOT NULL,
+    client TEXT NOT NULL,
+    PRIMARY KEY (digest, client)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    client TEXT,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_updated ON uploads (updated);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, start)
+);
+"""
+
+
+class QuotaExceeded(Exception):
+    """Raised when a single artifact is larger than the per-client quota"""
+
+
+class BlobNotFound(KeyError):
+    """Raised when a job refers to a blob the store does not hold"""
+
+
+class UploadNotFound(KeyError):
+    """Raised for an unknown or expired resumable upload"""
+
+
+class UploadError(ValueError):
+    """Raised for a chunk that does not fit its upload or fails its checksum"""
+
+
+def valid_digest(digest):
+    return bool(digest and _DIGEST.match(digest))
+
+
+class ArtifactStore:
+    """Output files under a private root with an indexed expiry time
+
+    Files live in two levels of hash-sharded directories so no directory
+    grows past a few hundred entries. A SQLite table indexed on the expiry
+    time lets the reaper find exactly the expired rows instead of listing
+    and stat-ing a whole directory, and the store never touches files it
+    did not create. Uploads and in-flight outputs go to staging_dir;
+    finished outputs are moved in with adopt(), or written in place at a
+    path from allocate().
+
+    Uploads are kept as content-addressed blobs keyed by SHA-256, so a
+    file the store already holds never has to be sent again. Jobs take a
+    reference while they use a blob, and the reaper frees a blob once it
+    has been unreferenced for BLOB_RETENTION seconds.
+
+    Large files can arrive as a resumable upload: chunks are written at
+    their offsets straight into one preallocated staging file, and once
+    every byte is there finish_upload() renames it into the blob store.
+    """
+
+    def __init__(self, root=ARTIFACT_ROOT, ttl=ARTIFACT_TTL, client_quota=CLIENT_QUOTA_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.client_quota = client_quota
+        self.staging_dir = os.path.join(root, 'staging')
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._db.executescript(_SCHEMA)
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), timeout=30,
+                             isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def _after_fork(self):
+        """Give a forked child (a preloaded server's worker) its own connection and reaper
+
+        The parent's connection is kept but never used or closed: closing
+        it here could checkpoint and delete the WAL the parent still uses.
+        """
+        _inherited.append(self._db)
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        if self._reaper is not None:
+            self._reaper = None
+            self._stop = threading.Event()
+            self.start_reaper()
+
+    def _shard_path(self, name):
+        digest = hashlib.blake2b(name.encode(), digest_size=2).hexdigest()
+        directory = os.path.join(self.root, digest[:2], digest[2:])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def _blob_path(self, digest):
+        directory = os.path.join(self.root, 'blobs', digest[:2], digest[2:4])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, digest)
+
+    @staticmethod
+    def _check_name(name):
+        if not name or not _NAME.match(name) or '..' in name:
+            raise ValueError(f"Invalid artifact name: {name!r}")
+
+    def allocate(self, name, client=None, ttl=None):
+        """Register name and return the path to write it to
+
+        The size is read from disk the next time the client's usage is
+        checked, so callers can write to the path as they normally would.
+        """
+        self._check_name(name)
+        path = self._shard_path(name)
+        now = time.time()
+        with self._lock:
+            self._enforce_quota(client, 0)
+            self._db.execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, NULL, ?, ?)',
+                             (name, path, client, now, now + (ttl or self.ttl)))
+        return path
+
+    def adopt(self, source_path, client=None, ttl=None, name=None):
+        """Move a finished file into the store and return its artifact name"""
+        name = name or os.path.basename(source_path)
+        self._check_name(name)
+        size = os.path.getsize(source_path)
+        if client is not None and size > self.client_quota:
+            os.remove(source_path)
+            raise QuotaExceeded(f"Output is larger than the {self.client_quota // (1024 * 1024)} MB storage quota")
+
+        path = self._shard_path(name)
+        shutil.move(source_path, path)
+        now = time.time()
+        with self._lock:
+            self._enforce_quota(client, size)
+            self._db.execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)',
+                             (name, path, client, size, now, now + (ttl or self.ttl)))
+        return name
+
+    def resolve(self, name):
+        """Path of a live artifact, or None if it is unknown, expired or gone"""
+        if not name or not _NAME.match(name):
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT path, expires FROM artifacts WHERE name = ?', (name,)).fetchone()
+        if row is None or row[1] <= time.time() or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def delete(self, name):
+        with self._lock:
+            row = self._db.execute('SELECT path FROM artifacts WHERE name = ?', (name,)).fetchone()
+            self._db.execute('DELETE FROM artifacts WHERE name = ?', (name,))
+        if row:
+            _unlink(row[0])
+
+    def usage(self, client):
+        """Bytes held by a client"""
+        with self._lock:
+            return self._usage(client)
+
+    def _usage(self, client):
+        # Allocated artifacts get their size once they have been written
+        pending = self._db.execute('SELECT name, path FROM artifacts WHERE client = ? AND size IS NULL',
+                                   (client,)).fetchall()
+        for name, path in pending:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self._db.execute('UPDATE artifacts SET size = ? WHERE name = ?', (size, name))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE client = ?',
+                                 (client,)).fetchone()[0]
+        return total
+
+    def _enforce_quota(self, client, incoming):
+        """Evict the client's oldest artifacts until incoming bytes fit"""
+        if client is None:
+            return
+        excess = self._usage(client) + incoming - self.client_quota
+        if excess <= 0:
+            return
+        rows = self._db.execute('SELECT name, path, COALESCE(size, 0) FROM artifacts '
+                                'WHERE client = ? ORDER BY created', (client,)).fetchall()
+        for name, path, size in rows:
+            if excess <= 0:
+                break
+            self._db.execute('DELETE FROM artifacts WHERE name = ?', (name,))
+            _unlink(path)
+            excess -= size
+            logger.info(f"Evicted {name} for client quota")
+
+    def has_blob(self, digest, client=None):
+        """Whether the client may skip uploading the file with this SHA-256"""
+        if not valid_digest(digest):
+            return False
+        with self._lock:
+            row = self._db.execute('SELECT path FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is None or not os.path.exists(row[0]):
+                return False
+            clients = self._db.execute('SELECT COUNT(*), COALESCE(SUM(client = ?), 0) FROM blob_clients '
+                                       'WHERE digest = ?', (client, digest)).fetchone()
+        return clients[1] > 0 or clients[0] >= DEDUP_MIN_CLIENTS
+
+    def put_blob(self, source_path, digest, client=None):
+        """Move an uploaded file into the blob store under its SHA-256
+
+        If the blob is already held, the new copy is discarded and the
+        blob's idle clock restarts, so the reaper cannot take it before the
+        job that stored it checks it out.
+        """
+        if not valid_digest(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        path = self._blob_path(digest)
+        size = os.path.getsize(source_path)
+        with self._lock:
+            row = self._db.execute('SELECT path FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is not None and os.path.exists(row[0]):
+                os.remove(source_path)
+                self._db.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (time.time(), digest))
+            else:
+                os.replace(source_path, path)
+                self._db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, 0, ?)',
+                                 (digest, path, size, time.time()))
+            if client is not None:
+                self._db.execute('INSERT OR IGNORE INTO blob_clients VALUES (?, ?)', (digest, client))
+        return digest
+
+    def checkout_blob(self, digest, name):
+        """Take a reference on a blob and link it into staging as name
+
+        Processors see an ordinary file with the upload's original name and
+        extension; release_blob() drops the link and the reference.
+        """
+        self._check_name(name)
+        with self._lock:
+            row = self._db.execute('SELECT path FROM blobs WHERE digest = ?', (digest,)).fetchone() \
+                if valid_digest(digest) else None
+            if row is None or not os.path.exists(row[0]):
+                raise BlobNotFound(digest)
+            self._db.execute('UPDATE blobs SET refs = refs + 1, last_used = ? WHERE digest = ?',
+                             (time.time(), digest))
+
+        link = os.path.join(self.staging_dir, name)
+        try:
+            os.link(row[0], link)
+            # The link shares the blob's mtime; the staging sweep goes by mtime
+            os.utime(link)
+        except OSError:
+            shutil.copyfile(row[0], link)
+        return link
+
+    def release_blob(self, digest, link=None):
+        if link:
+            _unlink(link)
+        with self._lock:
+            self._db.execute('UPDATE blobs SET refs = MAX(refs - 1, 0), last_used = ? WHERE digest = ?',
+                             (time.time(), digest))
+
+    def begin_upload(self, filename, size, client=None):
+        """Start a resumable upload of size bytes and return its id"""
+        if size <= 0:
+            raise UploadError("Upload size must be positive")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.staging_dir, f"{upload_id}.upload")
+        # Sparse until the chunks arrive
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        with self._lock:
+            self._db.execute('INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?)',
+                             (upload_id, path, client, filename, size, time.time()))
+        return upload_id
+
+    def _upload(self, upload_id, client):
+        with self._lock:
+            row = self._db.execute('SELECT path, size, filename FROM uploads WHERE id = ? AND client IS ?',
+                                   (upload_id, client)).fetchone()
+        if row is None or not os.path.exists(row[0]):
+            raise UploadNotFound(upload_id)
+        return row
+
+    def write_chunk(self, upload_id, start, length, stream, checksum, client=None):
+        """Write length bytes from stream at offset start of an upload
+
+        The chunk only counts as received once its SHA-256 matches
+        checksum; a failed chunk is simply sent again. Returns the
+        upload's status.
+        """
+        path, size, _ = self._upload(upload_id, client)
+        if start < 0 or length <= 0 or start + length > size:
+            raise UploadError(f"Chunk {start}+{length} does not fit an upload of {size} bytes")
+
+        # Anything this chunk overwrites has to be received again
+        with self._lock:
+            self._db.execute('DELETE FROM upload_chunks WHERE upload_id = ? AND start < ? AND start + length > ?',
+                             (upload_id, start + length, start))
+
+        sha256 = hashlib.sha256()
+        written = 0
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            while written < length:
+                data = stream.read(min(1024 * 1024, length - written))
+                if not data:
+                    break
+                sha256.update(data)
+                view = memoryview(data)
+                offset = start + written
+                while view:
+                    count = os.pwrite(fd, view, offset)
+                    view = view[count:]
+                    offset += count
+                written += len(data)
+        finally:
+            os.close(fd)
+
+        if written != length or sha256.hexdigest() != (checksum or '').lower():
+            raise UploadError("Chunk checksum mismatch")
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO upload_chunks VALUES (?, ?, ?)', (upload_id, start, length))
+            self._db.execute('UPDATE uploads SET updated = ? WHERE id = ?', (time.time(), upload_id))
+        return self.upload_status(upload_id, client)
+
+    def upload_status(self, upload_id, client=None):
+        """Bytes received so far and the ranges still missing"""
+        _, size, filename = self._upload(upload_id, client)
+        with self._lock:
+            chunks = self._db.execute('SELECT start, length FROM upload_chunks WHERE upload_id = ? ORDER BY start',
+                                      (upload_id,)).fetchall()
+        missing = []
+        position = 0
+        for start, length in chunks:
+            if start > position:
+                missing.append([position, start])
+            position = max(position, start + length)
+        if position < size:
+            missing.append([position, size])
+        received = size - sum(end - start for start, end in missing)
+        return {'upload_id': upload_id, 'filename': filename, 'size': size, 'received': received,
+                'missing': missing, 'complete': not missing}
+
+    def finish_upload(self, upload_id, client=None):
+        """Move a complete upload into the blob store; returns (digest, filename)"""
+        status = self.upload_status(upload_id, client)
+        if not status['complete']:
+            raise UploadError(f"Upload is incomplete: {status['received']} of {status['size']} bytes received")
+        path, _, filename = self._upload(upload_id, client)
+
+        # Chunks were checked one by one; the whole-file hash names the blob
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        with self._lock:
+            self._db.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+            self._db.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+        return self.put_blob(path, sha256.hexdigest(), client), filename
+
+    def reap(self, now=None):
+        """Delete expired artifacts; the cost follows the number expired"""
+        now = now or time.time()
+        removed = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute('SELECT name, path FROM artifacts WHERE expires <= ? '
+                                        'ORDER BY expires LIMIT ?', (now, REAP_BATCH)).fetchall()
+                if not rows:
+                    break
+                self._db.executemany('DELETE FROM artifacts WHERE name = ?', [(name,) for name, _ in rows])
+            for _, path in rows:
+                _unlink(path)
+            removed += len(rows)
+
+        # Blobs idle past the retention, unless a live job still holds them
+        while True:
+            with self._lock:
+                rows = self._db.execute('SELECT digest, path FROM blobs WHERE (refs = 0 AND last_used <= ?) '
+                                        'OR last_used <= ? ORDER BY last_used LIMIT ?',
+                                        (now - BLOB_RETENTION, now - STALE_REFERENCE_SECONDS,
+                                         REAP_BATCH)).fetchall()
+                if not rows:
+                    break
+                digests = [(digest,) for digest, _ in rows]
+                self._db.executemany('DELETE FROM blobs WHERE digest = ?', digests)
+                self._db.executemany('DELETE FROM blob_clients WHERE digest = ?', digests)
+                # Under the lock: put_blob() may store the same content at the same path
+                for _, path in rows:
+                    _unlink(path)
+            removed += len(rows)
+
+        # Resumable uploads nobody has added to for a TTL
+        with self._lock:
+            rows = self._db.execute('SELECT id, path FROM uploads WHERE updated <= ?',
+                                    (now - self.ttl,)).fetchall()
+            ids = [(upload_id,) for upload_id, _ in rows]
+            self._db.executemany('DELETE FROM uploads WHERE id = ?', ids)
+            self._db.executemany('DELETE FROM upload_chunks WHERE upload_id = ?', ids)
+        for _, path in rows:
+            _unlink(path)
+        removed += len(rows)
+
+        # Staging only holds in-flight files; anything older than the TTL was
+        # abandoned, except links to blobs a job still holds
+        with self._lock:
+            held = self._db.execute('SELECT path FROM blobs WHERE refs > 0').fetchall()
+        in_use = set()
+        for (path,) in held:
+            try:
+                stat = os.stat(path)
+                in_use.add((stat.st_dev, stat.st_ino))
+            except OSError:
+                pass
+        with os.scandir(self.staging_dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if stat.st_mtime < now - self.ttl and (stat.st_dev, stat.st_ino) not in in_use:
+                        _unlink(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def start_reaper(self, interval=REAP_INTERVAL):
+        """Run reap() every interval seconds on a daemon thread"""
+        if self._reaper is not None:
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, args=(interval,),
+                                        name='artifact-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self, interval):
+        while not self._stop.is_set():
+            try:
+                removed = self.reap()
+                if removed:
+                    logger.info(f"Reaped {removed} expired artifacts")
+            except Exception as e:
+                logger.error(f"Artifact reaper error: {e}")
+            self._stop.wait(interval)
+
+    def close(self):
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join()
+            self._reaper = None
+        self._db.close()
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove artifact {path}: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+# Connections inherited across fork, kept open so they are never closed in the child
+_inherited = []
+
+
+def get_store():
+    """The process-wide store, with its reaper running"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+            _store.start_reaper()
+        return _store
+
+
+def _reinit_after_fork():
+    global _store_lock
+    _store_lock = threading.Lock()
+    if _store is not None:
+        _store._after_fork()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
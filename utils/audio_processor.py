@@ -7,6 +7,9 @@ try:
 except ImportError:
     PYDUB_AVAILABLE = False
 
+from utils import audio_stream, ffmpeg_engine
+from utils.ffmpeg_engine import FFMPEG_AVAILABLE
+
 logger = logging.getLogger(__name__)
 
 class AudioProcessor:
@@ -15,6 +18,12 @@ class AudioProcessor:
     @staticmethod
     def convert_format(audio_file, input_format, output_format):
         """Convert audio between formats"""
+        if FFMPEG_AVAILABLE:
+            try:
+                return audio_stream.convert(audio_file, output_format)
+            except Exception as e:
+                logger.error(f"Audio format conversion error: {e}")
+                raise
         if not PYDUB_AVAILABLE:
             raise ImportError("PyDub is required for audio processing")
         try:
@@ -51,6 +60,9 @@ class AudioProcessor:
     def adjust_volume(audio_file, volume_change_db, input_format='mp3'):
         """Adjust audio volume"""
         try:
+            if FFMPEG_AVAILABLE:
+                return audio_stream.adjust_volume(audio_file, volume_change_db, 'mp3')
+            
             audio_file.seek(0)
             audio = AudioSegment.from_file(io.BytesIO(audio_file.read()), format=input_format)
             
@@ -69,6 +81,10 @@ class AudioProcessor:
     def trim_audio(audio_file, start_time, end_time, input_format='mp3'):
         """Trim audio to specified time range"""
         try:
+            if FFMPEG_AVAILABLE:
+                # Seek and copy frames instead of decoding the whole file
+                return ffmpeg_engine.trim_audio(audio_file, start_time, end_time, 'mp3')
+            
             audio_file.seek(0)
             audio = AudioSegment.from_file(io.BytesIO(audio_file.read()), format=input_format)
             
@@ -91,6 +107,10 @@ class AudioProcessor:
     def merge_audio(audio_files, input_format='mp3'):
         """Merge multiple audio files"""
         try:
+            if FFMPEG_AVAILABLE:
+                # Lossless concat when the inputs match, else one streaming transcode
+                return ffmpeg_engine.merge(audio_files, 'mp3')
+            
             combined = AudioSegment.empty()
             
             for audio_file in audio_files:
@@ -110,6 +130,10 @@ class AudioProcessor:
     def normalize_audio(audio_file, input_format='mp3'):
         """Normalize audio levels"""
         try:
+            if FFMPEG_AVAILABLE:
+                # Peak scan pass, then a single gain pass into the encoder
+                return audio_stream.normalize(audio_file, output_format='mp3')
+            
             audio_file.seek(0)
             audio = AudioSegment.from_file(io.BytesIO(audio_file.read()), format=input_format)
             
@@ -128,6 +152,9 @@ class AudioProcessor:
     def add_fade(audio_file, fade_in_duration=1000, fade_out_duration=1000, input_format='mp3'):
         """Add fade in/out effects"""
         try:
+            if FFMPEG_AVAILABLE:
+                return audio_stream.fade(audio_file, fade_in_duration, fade_out_duration, 'mp3')
+            
             audio_file.seek(0)
             audio = AudioSegment.from_file(io.BytesIO(audio_file.read()), format=input_format)
             
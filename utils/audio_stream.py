@@ -0,0 +1,250 @@
+import io
+import json
+import logging
+import math
+import subprocess
+import threading
+
+import numpy as np
+
+from utils import ffmpeg_engine
+from utils.ffmpeg_engine import AUDIO_ENCODERS, CONTAINERS, FFmpegError, open_input
+from utils.worker_pool import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Samples per channel handed through the pipeline at a time (~0.75 s at 44.1 kHz)
+BLOCK_FRAMES = 32768
+
+# Headroom left below full scale by peak normalization, matching pydub
+NORMALIZE_HEADROOM_DB = 0.1
+
+INT16_MAX = 32767.0
+
+
+class AudioStream:
+    """Decode a media input to 16-bit PCM blocks without holding the whole signal
+
+    Iterating yields float32 arrays of shape (frames, channels) scaled to
+    [-1, 1]. Memory use is one block regardless of the input length.
+    """
+
+    def __init__(self, media, sample_rate, channels, block_frames=BLOCK_FRAMES):
+        self.media = media
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_frames = block_frames
+
+    def __iter__(self):
+        cmd = [ffmpeg_engine.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin',
+               '-i', self.media.url, '-map', '0:a:0', '-f', 's16le', '-acodec', 'pcm_s16le',
+               '-ar', str(self.sample_rate), '-ac', str(self.channels), 'pipe:1']
+        if self.media.stdin_data is not None:
+            raise FFmpegError("AudioStream needs a seekable input")
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                pass_fds=self.media.pass_fds)
+        block_bytes = self.block_frames * self.channels * 2
+        finished = False
+        try:
+            while True:
+                check_cancelled()
+                chunk = proc.stdout.read(block_bytes)
+                if not chunk:
+                    break
+                # A short read can split a sample frame only at EOF
+                usable = len(chunk) - len(chunk) % (self.channels * 2)
+                samples = np.frombuffer(chunk[:usable], dtype='<i2').reshape(-1, self.channels)
+                yield samples.astype(np.float32) / INT16_MAX
+            finished = True
+        finally:
+            proc.stdout.close()
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            # Stopped early, ffmpeg dies on the closed pipe; only a full read can fail
+            if proc.wait() != 0 and finished:
+                raise FFmpegError(f"ffmpeg decode failed: {stderr.decode(errors='replace').strip()}")
+
+
+class AudioEncoder:
+    """Feed float PCM blocks into an ffmpeg encoder and collect its output"""
+
+    def __init__(self, sample_rate, channels, output_format, output=None):
+        self.output_format = output_format
+        self.output = output
+        target = 'pipe:1' if output is None else str(output)
+        cmd = [ffmpeg_engine.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+               *AUDIO_ENCODERS[output_format], '-f', CONTAINERS.get(output_format, output_format), target]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+        self._buffer = io.BytesIO()
+        self._stderr = b''
+        # Drain stdout/stderr concurrently so the encoder never blocks on a full pipe
+        self._readers = [
+            threading.Thread(target=self._drain_stdout, daemon=True),
+            threading.Thread(target=self._drain_stderr, daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    def _drain_stdout(self):
+        for chunk in iter(lambda: self._proc.stdout.read(65536), b''):
+            self._buffer.write(chunk)
+
+    def _drain_stderr(self):
+        self._stderr = self._proc.stderr.read()
+
+    def write(self, block):
+        pcm = np.clip(block * INT16_MAX, -32768, INT16_MAX).astype('<i2')
+        self._proc.stdin.write(pcm.tobytes())
+
+    def abort(self):
+        self._proc.kill()
+        self._proc.wait()
+
+    def close(self):
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        for reader in self._readers:
+            reader.join()
+        if returncode != 0:
+            raise FFmpegError(f"ffmpeg encode failed: {self._stderr.decode(errors='replace').strip()}")
+        if self.output is not None:
+            return self.output
+        self._buffer.seek(0)
+        return self._buffer
+
+
+def audio_format(media):
+    """Sample rate and channel count of the first audio stream"""
+    for stream in ffmpeg_engine.probe(media).get('streams', []):
+        if stream.get('codec_type') == 'audio':
+            return int(stream.get('sample_rate') or 44100), int(stream.get('channels') or 2)
+    raise FFmpegError("Input has no audio stream")
+
+
+def scan_levels(source):
+    """First pass of normalization: peak and RMS level in dBFS"""
+    with open_input(source) as media:
+        sample_rate, channels = audio_format(media)
+        peak = 0.0
+        square_sum = 0.0
+        count = 0
+        for block in AudioStream(media, sample_rate, channels):
+            peak = max(peak, float(np.abs(block).max(initial=0.0)))
+            square_sum += float(np.square(block, dtype=np.float64).sum())
+            count += block.size
+
+    peak_db = 20 * math.log10(peak) if peak > 0 else -math.inf
+    rms = math.sqrt(square_sum / count) if count else 0.0
+    rms_db = 20 * math.log10(rms) if rms > 0 else -math.inf
+    return peak_db, rms_db
+
+
+def scan_loudness(source):
+    """First pass of loudness normalization: integrated loudness (LUFS) and
+    true peak (dBTP), measured by ffmpeg's loudnorm filter as it streams"""
+    ffmpeg_engine.require_ffmpeg()
+    with open_input(source) as media:
+        cmd = [ffmpeg_engine.FFMPEG_BIN, '-hide_banner', '-i', media.url, '-map', '0:a:0', '-vn',
+               '-af', 'loudnorm=print_format=json', '-f', 'null', '-']
+        if media.stdin_data is None:
+            cmd.insert(2, '-nostdin')
+        result = subprocess.run(cmd, input=media.stdin_data, capture_output=True, pass_fds=media.pass_fds)
+    stderr = result.stderr.decode(errors='replace')
+    if result.returncode != 0:
+        raise FFmpegError(f"ffmpeg loudness scan failed: {stderr.strip()}")
+    # The measurement is the last thing loudnorm logs
+    stats = json.loads(stderr[stderr.rindex('{'):stderr.rindex('}') + 1])
+    return float(stats['input_i']), float(stats['input_tp'])
+
+
+def adjust_volume(source, volume_change_db, output_format='mp3', output=None, limit=None):
+    """Constant gain needs no look-ahead, so ffmpeg's volume filter applies it in-stream
+
+    With limit (linear, below 1) peaks the gain pushes past it are limited
+    instead of clipping.
+    """
+    audio_filter = f'volume={volume_change_db:.4f}dB'
+    if limit is not None:
+        audio_filter += f',alimiter=limit={limit}:level=disabled'
+    return ffmpeg_engine.run(source, ['-map', '0:a:0', '-vn', '-af', audio_filter, *AUDIO_ENCODERS[output_format]],
+                             output_format, output=output)
+
+
+def normalize(source, target_dbfs=None, headroom_db=NORMALIZE_HEADROOM_DB, output_format='mp3', output=None):
+    """Two-pass normalization: scan levels, then apply one gain while encoding
+
+    By default the peak is raised to -headroom_db (what pydub's normalize
+    does). With target_dbfs the RMS loudness is moved to that level instead,
+    limited so the peak still stays below the headroom.
+    """
+    with open_input(source) as media:
+        peak_db, rms_db = scan_levels(media)
+        if math.isinf(peak_db):
+            gain_db = 0.0
+        else:
+            gain_db = -headroom_db - peak_db
+            if target_dbfs is not None:
+                gain_db = min(gain_db, target_dbfs - rms_db)
+        logger.debug(f"Normalize: peak {peak_db:.2f} dBFS, rms {rms_db:.2f} dBFS, gain {gain_db:+.2f} dB")
+        return adjust_volume(media, gain_db, output_format, output)
+
+
+def normalize_loudness(source, target_lufs, true_peak_db, output_format='mp3', output=None):
+    """Two-pass loudness normalization: measure, then apply one gain while encoding
+
+    The gain moves the integrated loudness to target_lufs, limited so the
+    true peak stays at or below true_peak_db. Unlike loudnorm's single-pass
+    dynamic mode, a constant gain leaves the dynamics untouched.
+    """
+    with open_input(source) as media:
+        loudness, true_peak = scan_loudness(media)
+        gain_db = 0.0 if math.isinf(loudness) else min(target_lufs - loudness, true_peak_db - true_peak)
+        logger.debug(f"Loudness: {loudness:.2f} LUFS, true peak {true_peak:.2f} dBTP, gain {gain_db:+.2f} dB")
+        return adjust_volume(media, gain_db, output_format, output)
+
+
+def fade(source, fade_in_ms=1000, fade_out_ms=1000, output_format='mp3', output=None):
+    """Linear fade in and out, holding back only the fade-out length of audio
+
+    The fade-out needs to know where the stream ends, so the last
+    fade_out_ms of audio are kept in a small delay buffer and ramped when
+    the decoder reaches the end.
+    """
+    with open_input(source) as media:
+        sample_rate, channels = audio_format(media)
+        fade_in_frames = int(sample_rate * fade_in_ms / 1000)
+        fade_out_frames = int(sample_rate * fade_out_ms / 1000)
+        encoder = AudioEncoder(sample_rate, channels, output_format, output)
+
+        try:
+            position = 0
+            held = np.zeros((0, channels), dtype=np.float32)
+            for block in AudioStream(media, sample_rate, channels):
+                if position < fade_in_frames:
+                    ramp = np.arange(position, position + len(block), dtype=np.float32) / fade_in_frames
+                    block = block * np.minimum(ramp, 1.0)[:, None]
+                position += len(block)
+
+                held = np.concatenate([held, block])
+                if len(held) > fade_out_frames:
+                    release = len(held) - fade_out_frames
+                    encoder.write(held[:release])
+                    held = held[release:]
+
+            if len(held) and fade_out_frames:
+                ramp = np.linspace(1.0, 0.0, len(held), dtype=np.float32)
+                held = held * ramp[:, None]
+            if len(held):
+                encoder.write(held)
+        except Exception:
+            encoder.abort()
+            raise
+        return encoder.close()
+
+
+def convert(source, output_format, output=None):
+    """Format conversion goes straight through ffmpeg; no PCM reaches Python"""
+    return ffmpeg_engine.extract_audio(source, output_format, output)
@@ -0,0 +1,129 @@
+import io
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, request, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+from utils.artifact_store import ARTIFACT_ROOT
+from utils.media_probe import content_hash
+
+logger = logging.getLogger(__name__)
+
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel-redirect' (nginx)
+# hands the file body to the front proxy; unset serves it from Python
+DOWNLOAD_OFFLOAD = (os.environ.get('DOWNLOAD_OFFLOAD') or '').lower()
+
+# nginx internal location that maps onto ACCEL_ROOT, e.g.
+#   location /_artifacts/ { internal; alias /tmp/suntyn-artifacts/; }
+ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX') or '/_artifacts/'
+ACCEL_ROOT = os.environ.get('DOWNLOAD_ACCEL_ROOT') or ARTIFACT_ROOT
+
+# Outputs never change under a name, so clients may reuse them until expiry
+DOWNLOAD_MAX_AGE = 3600
+
+# Content hashes kept per (path, size, mtime)
+ETAG_CACHE_SIZE = 4096
+
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+def file_etag(path):
+    """Strong ETag from the file's content hash, computed once per file version"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+        if etag is not None:
+            _etag_cache.move_to_end(key)
+            return etag
+
+    etag = content_hash(path)
+    with _etag_lock:
+        _etag_cache[key] = etag
+        while len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def prime_etag(path):
+    """Hash a new output in the background so its first download does not wait"""
+    threading.Thread(target=_prime, args=(path,), name='etag-prime', daemon=True).start()
+
+
+def _prime(path):
+    try:
+        file_etag(path)
+    except OSError as e:
+        logger.warning(f"Could not hash {path}: {e}")
+
+
+def send_download(path, download_name=None):
+    """Serve a file as an attachment with ETag, Range and conditional support
+
+    If-None-Match answers 304 without reading the file. Range and If-Range
+    requests get 206 partial content so interrupted downloads resume
+    instead of starting over. With DOWNLOAD_OFFLOAD set, only headers are
+    produced here and the proxy streams the body with sendfile.
+    """
+    etag = file_etag(path)
+    download_name = download_name or os.path.basename(path)
+
+    header = offload_header(path)
+    if header:
+        return _offload(header, etag, download_name)
+    return _send(path, etag, download_name)
+
+
+def offload_header(path):
+    """(header, value) that makes the front proxy send path, or None to serve it here"""
+    if DOWNLOAD_OFFLOAD == 'x-sendfile':
+        return 'X-Sendfile', path
+    if DOWNLOAD_OFFLOAD == 'x-accel-redirect':
+        relative = os.path.relpath(path, ACCEL_ROOT)
+        if not relative.startswith(os.pardir):
+            return 'X-Accel-Redirect', ACCEL_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')
+        logger.warning(f"{path} is outside DOWNLOAD_ACCEL_ROOT; serving directly")
+    return None
+
+
+def send_cached(entry):
+    """Serve an in-memory output (see utils.output_cache) like a file download"""
+    return _send(io.BytesIO(entry.data), entry.etag, entry.filename, entry.mimetype)
+
+
+def _send(source, etag, download_name, mimetype=None):
+    try:
+        response = send_file(source, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             conditional=True, etag=etag, max_age=DOWNLOAD_MAX_AGE)
+    except RequestedRangeNotSatisfiable as e:
+        # Answer 416 here; the download routes turn stray exceptions into 500s
+        return e.get_response()
+    response.headers['Cache-Control'] = f'private, max-age={DOWNLOAD_MAX_AGE}'
+    return response
+
+
+def _offload(header, etag, download_name):
+    """Headers-only response that makes the proxy send the file itself
+
+    The proxy answers Range requests from the file; the ETag is checked
+    here so revalidation never reaches the disk.
+    """
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'private, max-age={DOWNLOAD_MAX_AGE}',
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    headers.update({
+        header[0]: header[1],
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+        'Accept-Ranges': 'bytes',
+    })
+    return Response(status=200, headers=headers, mimetype=mimetype)
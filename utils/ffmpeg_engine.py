@@ -0,0 +1,680 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+FFMPEG_BIN = os.environ.get('FFMPEG_BINARY') or shutil.which('ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BINARY') or shutil.which('ffprobe')
+FFMPEG_AVAILABLE = bool(FFMPEG_BIN and FFPROBE_BIN)
+
+# Target video bitrates for the user-facing quality levels
+VIDEO_BITRATES = {'high': '2000k', 'medium': '1000k', 'low': '500k'}
+VIDEO_BITRATE_VALUES = {'high': 2_000_000, 'medium': 1_000_000, 'low': 500_000}
+
+# Output container (ffmpeg muxer name) per extension
+CONTAINERS = {
+    'mp4': 'mp4', 'mov': 'mov', 'mkv': 'matroska', 'avi': 'avi', 'webm': 'webm', 'gif': 'gif',
+    'mp3': 'mp3', 'm4a': 'ipod', 'aac': 'adts', 'wav': 'wav', 'ogg': 'ogg', 'flac': 'flac',
+}
+
+# Codecs each container can carry without re-encoding
+COPYABLE_VIDEO = {
+    'mp4': {'h264', 'hevc', 'mpeg4', 'av1'},
+    'mov': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+    'mkv': {'h264', 'hevc', 'mpeg4', 'vp8', 'vp9', 'av1'},
+    'avi': {'mpeg4', 'mjpeg', 'h264'},
+    'webm': {'vp8', 'vp9', 'av1'},
+}
+COPYABLE_AUDIO = {
+    'mp4': {'aac', 'mp3', 'alac'},
+    'mov': {'aac', 'mp3', 'alac', 'pcm_s16le'},
+    'mkv': {'aac', 'mp3', 'opus', 'vorbis', 'flac', 'ac3'},
+    'avi': {'mp3', 'ac3', 'pcm_s16le'},
+    'webm': {'opus', 'vorbis'},
+    'mp3': {'mp3'},
+    'm4a': {'aac', 'alac'},
+    'aac': {'aac'},
+    'wav': {'pcm_s16le'},
+    'ogg': {'vorbis', 'opus'},
+    'flac': {'flac'},
+}
+
+# Encoders used when a stream has to be re-encoded
+X264 = ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p']
+VIDEO_ENCODERS = {
+    'mp4': X264,
+    'mov': X264,
+    'mkv': X264,
+    'avi': X264,
+    'webm': ['-c:v', 'libvpx-vp9', '-row-mt', '1', '-deadline', 'realtime', '-cpu-used', '8'],
+}
+AUDIO_ENCODERS = {
+    'mp4': ['-c:a', 'aac', '-b:a', '128k'],
+    'mov': ['-c:a', 'aac', '-b:a', '128k'],
+    'mkv': ['-c:a', 'aac', '-b:a', '128k'],
+    'avi': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+    'webm': ['-c:a', 'libopus', '-b:a', '96k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    'm4a': ['-c:a', 'aac', '-b:a', '160k'],
+    'aac': ['-c:a', 'aac', '-b:a', '160k'],
+    'wav': ['-c:a', 'pcm_s16le'],
+    'ogg': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'flac': ['-c:a', 'flac'],
+}
+
+# Parallel segmented transcoding: one segment per worker, used only when
+# every worker gets at least MIN_SEGMENT_SECONDS of video
+SEGMENT_WORKERS = int(os.environ.get('FFMPEG_SEGMENT_WORKERS') or os.cpu_count() or 1)
+MIN_SEGMENT_SECONDS = 10
+MIN_SEGMENTED_DURATION = 30
+SEGMENTABLE_OUTPUTS = {'mp4', 'mov', 'mkv', 'avi'}
+
+# MP4/MOV written to a pipe must be fragmented since the muxer cannot seek
+# back to write the index
+PIPE_MUXER_OPTIONS = {
+    'mp4': ['-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+    'mov': ['-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+}
+
+# Muxers that need to seek back to finish the header or index; these are
+# written to a temp file even when the caller wants a buffer
+SEEKABLE_OUTPUTS = {'avi', 'mkv', 'webm', 'webp'}
+
+# Below any frame interval and above ffprobe's rounding of timestamps to
+# the microsecond: seeks land on the intended frame, not the one beside it
+FRAME_EPSILON = 0.0005
+
+
+class FFmpegError(RuntimeError):
+    """Raised when ffmpeg or ffprobe exits with an error"""
+
+
+def require_ffmpeg():
+    if not FFMPEG_AVAILABLE:
+        raise ImportError("ffmpeg and ffprobe are required for the ffmpeg engine")
+
+
+class MediaInput:
+    """Resolve an upload into something ffmpeg can read without copying it
+
+    Paths are used directly. Streams backed by a real file (large Flask
+    uploads land in a TemporaryFile) are passed through /dev/fd so ffmpeg
+    can seek them. In-memory streams are piped on stdin, or spooled to a
+    temp file when the demuxer needs to seek (MP4/MOV keep their index at
+    the end of the file). Open it once and pass it to probe() and run()
+    so a spooled input is written only once per job.
+    """
+
+    def __init__(self, source, seekable=True):
+        self.source = source
+        self.seekable = seekable
+        self.url = None
+        self.pass_fds = ()
+        self.stdin_data = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        source = self.source
+        if isinstance(source, (str, os.PathLike)):
+            self.url = os.fspath(source)
+            return self
+
+        fd = _real_file_descriptor(source)
+        if fd is not None:
+            self.url = f'/dev/fd/{fd}'
+            self.pass_fds = (fd,)
+            return self
+
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        data = source.read()
+        if self.seekable:
+            name = getattr(source, 'filename', None) or getattr(source, 'name', None) or ''
+            suffix = os.path.splitext(str(name))[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                tmp.write(data)
+                self._tmp_path = tmp.name
+            self.url = self._tmp_path
+        else:
+            self.url = 'pipe:0'
+            self.stdin_data = data
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._tmp_path:
+            try:
+                os.unlink(self._tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def _real_file_descriptor(source):
+    """Return the fd of a stream backed by a regular file, or None"""
+    try:
+        fd = source.fileno()
+        mode = os.fstat(fd).st_mode
+    except (AttributeError, OSError, io.UnsupportedOperation, ValueError):
+        return None
+    if not stat.S_ISREG(mode):
+        return None
+    # Make sure buffered writes are visible to the child process
+    if hasattr(source, 'flush'):
+        try:
+            source.flush()
+        except (OSError, ValueError):
+            pass
+    return fd
+
+
+def open_input(source, seekable=True):
+    """Context manager for a source that may already be an open MediaInput"""
+    if isinstance(source, MediaInput):
+        return contextlib.nullcontext(source)
+    return MediaInput(source, seekable=seekable)
+
+
+def probe(source):
+    """Return ffprobe's format and stream description of a media input"""
+    require_ffmpeg()
+    with open_input(source) as media:
+        cmd = [FFPROBE_BIN, '-v', 'error', '-print_format', 'json',
+               '-show_format', '-show_streams', media.url]
+        result = subprocess.run(cmd, input=media.stdin_data, capture_output=True,
+                                pass_fds=media.pass_fds)
+    if result.returncode != 0:
+        raise FFmpegError(f"ffprobe failed: {result.stderr.decode(errors='replace').strip()}")
+    return json.loads(result.stdout or b'{}')
+
+
+def video_stream(info):
+    """First video stream description from probe(), or None"""
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            return stream
+    return None
+
+
+def stream_codec(info, codec_type):
+    """Codec name of the first stream of a type ('video' or 'audio'), or None"""
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == codec_type:
+            return stream.get('codec_name')
+    return None
+
+
+def media_duration(info):
+    """Duration in seconds from probe(), from the container or else the longest stream"""
+    duration = float(info.get('format', {}).get('duration') or 0)
+    if not duration:
+        duration = max((float(stream.get('duration') or 0) for stream in info.get('streams', [])), default=0)
+    return duration
+
+
+def audio_args(codec, output_format):
+    """Copy the audio stream when the container accepts it, else re-encode"""
+    if codec is None:
+        return ['-an']
+    if codec in COPYABLE_AUDIO.get(output_format, ()):
+        return ['-c:a', 'copy']
+    return list(AUDIO_ENCODERS[output_format])
+
+
+def run(source, output_args, output_format, input_args=(), output=None, seekable=True):
+    """Run one ffmpeg job from source to an output buffer or path
+
+    With output=None the result is read from stdout into a BytesIO;
+    otherwise ffmpeg writes straight to the given path.
+    """
+    require_ffmpeg()
+    with open_input(source, seekable) as media:
+        return _execute([[*input_args, '-i', media.url]], output_args, output_format, output,
+                        media.stdin_data, media.pass_fds)
+
+
+@contextlib.contextmanager
+def command_runner(runner):
+    """Run this thread's ffmpeg commands that write to a file through runner
+
+    runner(cmd, pass_fds) replaces subprocess.run and raises on failure;
+    callers use it to follow progress and to kill ffmpeg on cancel.
+    """
+    previous = getattr(_local, 'runner', None)
+    _local.runner = runner
+    try:
+        yield
+    finally:
+        _local.runner = previous
+
+
+def _execute(inputs, output_args, output_format, output=None, stdin_data=None, pass_fds=()):
+    """Assemble and run an ffmpeg command from per-input argument lists"""
+    if output is None and output_format in SEEKABLE_OUTPUTS:
+        with tempfile.NamedTemporaryFile(suffix=f'.{output_format}') as tmp:
+            _execute(inputs, output_args, output_format, tmp.name, stdin_data, pass_fds)
+            return io.BytesIO(tmp.read())
+
+    cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-y']
+    if stdin_data is None:
+        cmd.append('-nostdin')
+    for input_spec in inputs:
+        cmd += input_spec
+    cmd += output_args
+
+    muxer = CONTAINERS.get(output_format, output_format)
+    if output is None:
+        cmd += [*PIPE_MUXER_OPTIONS.get(output_format, []), '-f', muxer, 'pipe:1']
+    else:
+        cmd += ['-f', muxer, os.fspath(output)]
+
+    logger.debug("ffmpeg: %s", ' '.join(cmd))
+    runner = getattr(_local, 'runner', None)
+    if runner is not None and output is not None and stdin_data is None:
+        runner(cmd, pass_fds)
+        return output
+
+    result = subprocess.run(cmd, input=stdin_data, capture_output=True, pass_fds=pass_fds)
+    if result.returncode != 0:
+        raise FFmpegError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+    if output is not None:
+        return output
+    return io.BytesIO(result.stdout)
+
+
+def extract_audio(source, output_format='mp3', output=None):
+    """Extract the audio track, copying it when the target container can hold it"""
+    with open_input(source) as media:
+        codec = stream_codec(probe(media), 'audio')
+        if codec is None:
+            raise FFmpegError("Input has no audio stream")
+        return run(media, ['-vn', '-sn', '-dn', '-map', '0:a:0', *audio_args(codec, output_format)],
+                   output_format, output=output)
+
+
+def convert_format(source, output_format, quality='medium', output=None, workers=None):
+    """Convert a video container, remuxing when re-encoding would not help
+
+    The video stream is copied when the target container accepts its codec
+    and its bitrate is already at or below the requested quality level.
+    Long re-encodes are split across workers (see transcode_video).
+    """
+    with open_input(source) as media:
+        info = probe(media)
+        video = video_stream(info) or {}
+        source_bitrate = int(video.get('bit_rate') or info.get('format', {}).get('bit_rate') or 0)
+        target_bitrate = VIDEO_BITRATE_VALUES.get(quality, VIDEO_BITRATE_VALUES['medium'])
+        audio = audio_args(stream_codec(info, 'audio'), output_format)
+
+        if (video.get('codec_name') in COPYABLE_VIDEO.get(output_format, ())
+                and 0 < source_bitrate <= target_bitrate):
+            return run(media, ['-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'copy', *audio],
+                       output_format, output=output)
+
+        video_args = [*VIDEO_ENCODERS[output_format],
+                      '-b:v', VIDEO_BITRATES.get(quality, VIDEO_BITRATES['medium'])]
+        return transcode_video(media, info, video_args, audio, output_format, output, workers)
+
+
+def compress_video(source, compression_ratio=0.5, bitrate='800k', output_format='mp4', output=None,
+                   workers=None):
+    """Downscale and re-encode the video at a lower bitrate, copying audio through"""
+    # Both dimensions must stay even for yuv420p
+    scale = f"scale=trunc(iw*{compression_ratio}/2)*2:trunc(ih*{compression_ratio}/2)*2"
+    with open_input(source) as media:
+        info = probe(media)
+        video_args = ['-vf', scale, *VIDEO_ENCODERS[output_format], '-b:v', bitrate]
+        return transcode_video(media, info, video_args, audio_args(stream_codec(info, 'audio'), output_format),
+                               output_format, output, workers)
+
+
+def transcode_video(media, info, video_args, audio, output_format, output=None, workers=None):
+    """Re-encode video, in parallel segments when the input is long enough
+
+    The video stream is split at keyframes with a packet copy into one
+    segment per worker. Each segment is encoded by its own ffmpeg process
+    and the results are joined with the concat demuxer while the audio is
+    taken once from the original. Short inputs, single-core hosts and
+    formats without a splittable encoder use one process.
+    """
+    workers = workers or SEGMENT_WORKERS
+    duration = float(info.get('format', {}).get('duration') or 0)
+    segmented = (workers > 1 and duration >= MIN_SEGMENTED_DURATION
+                 and output_format in SEGMENTABLE_OUTPUTS and video_stream(info))
+    if not segmented:
+        return run(media, ['-map', '0:v:0', '-map', '0:a:0?', *video_args, *audio],
+                   output_format, output=output)
+
+    segment_time = max(MIN_SEGMENT_SECONDS, duration / workers)
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 1. Split on keyframes without decoding
+        _execute([['-i', media.url]],
+                 ['-map', '0:v:0', '-c', 'copy', '-segment_time', f'{segment_time:.3f}',
+                  '-segment_format', 'matroska', '-reset_timestamps', '1'],
+                 'segment', os.path.join(tmp_dir, 'part%04d.mkv'), pass_fds=media.pass_fds)
+        parts = sorted(name for name in os.listdir(tmp_dir) if name.startswith('part'))
+
+        # 2. Encode the segments concurrently, one ffmpeg process each
+        def encode_part(name):
+            encoded = os.path.join(tmp_dir, f'enc_{name}')
+            _execute([['-i', os.path.join(tmp_dir, name)]], [*video_args, '-threads', threads, '-an'],
+                     'mkv', encoded)
+            return encoded
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            encoded_parts = list(executor.map(encode_part, parts))
+
+        # 3. Stitch the encoded video losslessly and add the original audio
+        list_path = os.path.join(tmp_dir, 'parts.txt')
+        with open(list_path, 'w') as f:
+            for path in encoded_parts:
+                f.write(f"file '{path}'\n")
+
+        return _execute([['-f', 'concat', '-safe', '0', '-i', list_path], ['-i', media.url]],
+                        ['-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', *audio],
+                        output_format, output, pass_fds=media.pass_fds)
+
+
+def video_frames(source, start_time, end_time):
+    """Video frame timestamps from start_time on, as sorted (pts_time, keyframe) pairs
+
+    Read from the packet index without decoding. Listing runs a second
+    past end_time: with B-frames, a frame inside the range can be stored
+    after one beyond it.
+    """
+    require_ffmpeg()
+    with open_input(source) as media:
+        cmd = [FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0',
+               '-read_intervals', f'{float(start_time):.6f}%{float(end_time) + 1:.6f}', media.url]
+        result = subprocess.run(cmd, input=media.stdin_data, capture_output=True,
+                                pass_fds=media.pass_fds)
+    if result.returncode != 0:
+        raise FFmpegError(f"ffprobe failed: {result.stderr.decode(errors='replace').strip()}")
+
+    frames = set()
+    for line in result.stdout.decode().split():
+        pts_time, _, flags = line.partition(',')
+        try:
+            value = float(pts_time)
+        except ValueError:
+            continue
+        if value >= start_time - FRAME_EPSILON:
+            frames.add((value, 'K' in flags))
+    return sorted(frames)
+
+
+def trim_video(source, start_time, end_time, output_format='mp4', output=None, exact=False):
+    """Cut a time range by copying compressed packets
+
+    Fast mode seeks to the keyframe at or before start_time and copies from
+    there. Exact mode keeps exactly the frames in [start_time, end_time),
+    the first one at time zero: it re-encodes only the partial GOPs at
+    either end and copies the whole ones between, so the work done is
+    bounded by the clip length rather than the file length.
+    """
+    start_time, end_time = float(start_time), float(end_time)
+    duration = max(0.0, end_time - start_time)
+
+    with open_input(source) as media:
+        if not exact:
+            return run(media, ['-t', f'{duration:.3f}', '-map', '0', '-c', 'copy',
+                               '-avoid_negative_ts', 'make_zero'],
+                       output_format, input_args=['-ss', f'{start_time:.3f}'], output=output)
+
+        info = probe(media)
+        offset = float(info.get('format', {}).get('start_time') or 0)
+        frames = [(t - offset, key) for t, key in video_frames(media, start_time + offset, end_time + offset)]
+        inside = [(t, key) for t, key in frames if t < end_time - FRAME_EPSILON]
+        after = frames[len(inside):]
+        # The last GOP can be copied whole if the range ends where the next one starts
+        parts = _splice_parts(inside, not after or after[0][1])
+
+        if (not any(copy for copy, _, _ in parts) or stream_codec(info, 'video') != 'h264'
+                or output_format not in ('mp4', 'mov', 'mkv')):
+            # No copyable GOP: re-encode just the requested range
+            audio = AUDIO_ENCODERS[output_format] if stream_codec(info, 'audio') else ['-an']
+            return run(media, ['-t', f'{duration:.3f}', '-map', '0:v:0', '-map', '0:a:0?',
+                               *VIDEO_ENCODERS[output_format], '-crf', '18', *audio],
+                       output_format, input_args=['-ss', f'{start_time:.3f}'], output=output)
+
+        return _splice_trim(media, info, inside, parts, end_time, output_format, output)
+
+
+def _splice_parts(frames, whole_last_gop):
+    """Split sorted (pts_time, keyframe) pairs into (copy, first, stop) index ranges
+
+    Frames before the first keyframe, and from the last keyframe on unless
+    that GOP is complete, are re-encoded; everything between is copied.
+    """
+    keys = [i for i, (_, key) in enumerate(frames) if key]
+    if not keys:
+        return [(False, 0, len(frames))] if frames else []
+    copy_stop = len(frames) if whole_last_gop else keys[-1]
+    parts = []
+    if keys[0] > 0:
+        parts.append((False, 0, keys[0]))
+    if copy_stop > keys[0]:
+        parts.append((True, keys[0], copy_stop))
+    if copy_stop < len(frames):
+        parts.append((False, copy_stop, len(frames)))
+    return parts
+
+
+def _splice_trim(media, info, frames, parts, end_time, output_format, output):
+    """Write each part's video as its own file, then concat them with the audio
+
+    Parts are cut by frame count, which stays exact with B-frames, and
+    given their duration from the source timestamps, so the concat leaves
+    no gap at a splice. The parts are written as Matroska; the concat
+    demuxer passes the copied H.264's own codec parameters along when it
+    switches files, so it decodes correctly after a re-encoded part. Audio
+    is encoded once over the whole range and so has no splices.
+    """
+    video = video_stream(info) or {}
+    first_time = frames[0][0]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        list_path = os.path.join(tmp_dir, 'parts.txt')
+        with open(list_path, 'w') as listing:
+            for index, (copy, first, stop) in enumerate(parts):
+                part_path = os.path.join(tmp_dir, f'part{index}.mkv')
+                if copy:
+                    # Seek just past the keyframe, so the seek cannot land on the one before
+                    codec_args, seek = ['-c:v', 'copy'], frames[first][0] + FRAME_EPSILON
+                else:
+                    codec_args = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18',
+                                  '-pix_fmt', video.get('pix_fmt', 'yuv420p')]
+                    seek = frames[first][0] - FRAME_EPSILON
+                run(media, ['-frames:v', str(stop - first), '-map', '0:v:0', *codec_args, '-an'],
+                    'mkv', input_args=['-ss', f'{seek:.6f}'], output=part_path)
+
+                listing.write(f"file '{part_path}'\n")
+                if stop < len(frames):
+                    listing.write(f"duration {frames[stop][0] - frames[first][0]:.6f}\n")
+
+        inputs = [['-f', 'concat', '-safe', '0', '-i', list_path]]
+        audio = ['-an']
+        if stream_codec(info, 'audio'):
+            inputs.append(['-ss', f'{first_time:.6f}', '-t', f'{end_time - first_time:.6f}', '-i', media.url])
+            audio = ['-map', '1:a:0', '-c:a', 'aac', '-b:a', '192k']
+        return _execute(inputs, ['-map', '0:v:0', *audio, '-c:v', 'copy'], output_format, output,
+                        media.stdin_data, media.pass_fds)
+
+
+def trim_audio(source, start_time, end_time, output_format='mp3', output=None):
+    """Cut an audio range by copying frames when the format allows it
+
+    Compressed audio frames are all independently decodable, so a copy cut
+    is accurate to one frame (about 26 ms for MP3).
+    """
+    start_time, end_time = float(start_time), float(end_time)
+    with open_input(source) as media:
+        codec = stream_codec(probe(media), 'audio')
+        if codec is None:
+            raise FFmpegError("Input has no audio stream")
+        return run(media, ['-t', f'{max(0.0, end_time - start_time):.3f}', '-map', '0:a:0', '-vn',
+                           *audio_args(codec, output_format)],
+                   output_format, input_args=['-ss', f'{start_time:.3f}'], output=output)
+
+
+def mute_video(source, output_format='mp4', output=None):
+    """Drop the audio tracks and copy the video stream untouched"""
+    return run(source, ['-map', '0:v', '-c:v', 'copy', '-an'], output_format, output=output)
+
+
+def stream_signature(info):
+    """Codec parameters that must match for packets to be concatenated as-is"""
+    signature = []
+    for stream in info.get('streams', []):
+        codec_type = stream.get('codec_type')
+        if codec_type == 'video':
+            signature.append((codec_type, stream.get('codec_name'), stream.get('profile'),
+                              stream.get('width'), stream.get('height'), stream.get('pix_fmt'),
+                              stream.get('r_frame_rate')))
+        elif codec_type == 'audio':
+            signature.append((codec_type, stream.get('codec_name'), stream.get('sample_rate'),
+                              stream.get('channels'), stream.get('sample_fmt')))
+    return tuple(signature)
+
+
+def merge(sources, output_format, output=None):
+    """Join media files end to end
+
+    When every input has the same stream layout and codec parameters, and
+    the target container can hold those codecs, packets are copied through
+    the concat demuxer. Otherwise a single concat-filter pass decodes and
+    re-encodes everything. Both run as one streaming ffmpeg process, so
+    memory use does not depend on the output length.
+    """
+    require_ffmpeg()
+    if not sources:
+        raise ValueError("Nothing to merge")
+
+    with contextlib.ExitStack() as stack:
+        medias = [stack.enter_context(MediaInput(source)) for source in sources]
+        infos = [probe(media) for media in medias]
+        pass_fds = tuple(fd for media in medias for fd in media.pass_fds)
+
+        signatures = {stream_signature(info) for info in infos}
+        if len(signatures) == 1 and _copyable(infos[0], output_format):
+            return _concat_copy(medias, output_format, output, pass_fds)
+        return _concat_transcode(medias, infos, output_format, output, pass_fds)
+
+
+def _copyable(info, output_format):
+    for stream in info.get('streams', []):
+        codec_type = stream.get('codec_type')
+        if codec_type == 'video' and stream.get('codec_name') not in COPYABLE_VIDEO.get(output_format, ()):
+            return False
+        if codec_type == 'audio' and stream.get('codec_name') not in COPYABLE_AUDIO.get(output_format, ()):
+            return False
+    return True
+
+
+def _concat_copy(medias, output_format, output, pass_fds):
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as listing:
+        for media in medias:
+            listing.write("file '{}'\n".format(media.url.replace("'", "'\\''")))
+        list_path = listing.name
+    try:
+        return _execute([['-f', 'concat', '-safe', '0', '-i', list_path]],
+                        ['-map', '0:v?', '-map', '0:a?', '-c', 'copy'],
+                        output_format, output, pass_fds=pass_fds)
+    finally:
+        os.unlink(list_path)
+
+
+def _concat_transcode(medias, infos, output_format, output, pass_fds):
+    """One pass through the concat filter, conforming every input to the first"""
+    has_video = all(video_stream(info) for info in infos) and output_format in VIDEO_ENCODERS
+    # Inputs without audio get silence, so one silent clip does not mute the rest
+    audio_streams = [stream for info in infos for stream in info.get('streams', [])
+                     if stream.get('codec_type') == 'audio']
+    has_audio = bool(audio_streams)
+    if not has_video and not has_audio:
+        raise FFmpegError("Inputs share no common stream type to merge")
+
+    first_video = video_stream(infos[0]) or {}
+    width = int(first_video.get('width') or 1280) // 2 * 2
+    height = int(first_video.get('height') or 720) // 2 * 2
+    frame_rate = first_video.get('r_frame_rate') or '30/1'
+    if has_audio:
+        sample_rate = audio_streams[0].get('sample_rate') or 48000
+        channel_layout = audio_streams[0].get('channel_layout') or 'stereo'
+
+    filters = []
+    labels = []
+    for index in range(len(medias)):
+        if has_video:
+            filters.append(f"[{index}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                           f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={frame_rate},"
+                           f"format=yuv420p[v{index}]")
+            labels.append(f"[v{index}]")
+        if has_audio:
+            if stream_codec(infos[index], 'audio'):
+                source = f"[{index}:a:0]"
+            else:
+                duration = media_duration(infos[index])
+                if not duration:
+                    raise FFmpegError(f"Input {index + 1} has no audio and no known duration")
+                source = f"anullsrc=r={sample_rate}:cl={channel_layout},atrim=duration={duration:.6f},"
+            filters.append(f"{source}aresample={sample_rate},"
+                           f"aformat=sample_fmts=fltp:channel_layouts=stereo[a{index}]")
+            labels.append(f"[a{index}]")
+
+    outputs = ('[v]' if has_video else '') + ('[a]' if has_audio else '')
+    filters.append(f"{''.join(labels)}concat=n={len(medias)}:v={int(has_video)}:a={int(has_audio)}{outputs}")
+
+    output_args = ['-filter_complex', ';'.join(filters)]
+    if has_video:
+        output_args += ['-map', '[v]', *VIDEO_ENCODERS[output_format]]
+    if has_audio:
+        output_args += ['-map', '[a]', *AUDIO_ENCODERS[output_format]]
+
+    return _execute([['-i', media.url] for media in medias], output_args, output_format,
+                    output, pass_fds=pass_fds)
+
+
+def create_animation(source, fps=10, duration=None, scale=0.5, max_width=None, output_format='gif',
+                     output=None):
+    """Animated GIF or WebP from a video
+
+    Frames are decimated to fps and downscaled before any quantization. GIF
+    uses two passes: palettegen builds one optimized 256-colour palette,
+    then paletteuse maps the frames onto it, which is both faster and
+    smaller than per-frame quantization.
+    """
+    width = f"trunc(iw*{scale}/2)*2"
+    if max_width:
+        width = f"min({int(max_width)}\\,{width})"
+    frames = f"fps={fps},scale={width}:-2:flags=lanczos"
+    input_args = ['-t', f'{float(duration):.3f}'] if duration else []
+
+    with open_input(source) as media:
+        if output_format == 'webp':
+            return run(media, ['-map', '0:v:0', '-vf', frames, '-c:v', 'libwebp', '-lossless', '0',
+                               '-q:v', '70', '-compression_level', '4', '-loop', '0', '-an'],
+                       'webp', input_args=input_args, output=output)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            palette = os.path.join(tmp_dir, 'palette.png')
+            run(media, ['-map', '0:v:0', '-vf', f"{frames},palettegen=stats_mode=diff", '-frames:v', '1'],
+                'image2', input_args=input_args, output=palette)
+            return _execute([[*input_args, '-i', media.url], ['-i', palette]],
+                            ['-lavfi', f"[0:v:0]{frames}[x];[x][1:v]paletteuse=dither=bayer:bayer_scale=5"
+                                       ":diff_mode=rectangle", '-loop', '0'],
+                            'gif', output, pass_fds=media.pass_fds)
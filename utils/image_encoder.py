@@ -0,0 +1,190 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Save settings per preset, ordered from fastest encode to smallest output
+ENCODER_PRESETS = {
+    'fast': {
+        'JPEG': {'optimize': False, 'progressive': False},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'method': 0},
+    },
+    'balanced': {
+        'JPEG': {'optimize': True, 'progressive': True},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'method': 4},
+    },
+    'small': {
+        'JPEG': {'optimize': True, 'progressive': True, 'subsampling': 2},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'method': 6},
+    },
+}
+PRESET_ORDER = ('small', 'balanced', 'fast')
+DEFAULT_PRESET = 'balanced'
+
+# Default lossy quality when the caller does not pass one
+DEFAULT_QUALITY = {'JPEG': 85, 'WEBP': 90}
+
+# Conservative single-core encode throughput in megapixels per second,
+# used to pick a preset that fits a latency budget
+ENCODER_THROUGHPUT = {
+    'JPEG': {'fast': 100.0, 'balanced': 30.0, 'small': 30.0},
+    'PNG': {'fast': 4.0, 'balanced': 3.5, 'small': 2.0},
+    'WEBP': {'fast': 20.0, 'balanced': 6.0, 'small': 2.0},
+}
+
+FORMAT_ALIASES = {'JPG': 'JPEG', 'JPEG': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def normalize_format(target_format):
+    """Map user-facing format names (jpg, jpeg, png, webp) to Pillow names"""
+    name = (target_format or 'PNG').upper()
+    if name not in FORMAT_ALIASES:
+        raise ValueError(f"Unsupported image format: {target_format}")
+    return FORMAT_ALIASES[name]
+
+
+def prepare_image(image, target_format):
+    """Convert the image mode to one the target format can store"""
+    target_format = normalize_format(target_format)
+    if target_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            # JPEG has no alpha: flatten onto white
+            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+            rgb_image.paste(image, mask=image.split()[-1])
+            return rgb_image
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            return image.convert('RGB')
+    elif target_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'A' in image.mode or image.mode == 'P' else 'RGB')
+    return image
+
+
+def choose_preset(target_format, size, latency_budget_ms):
+    """Pick the smallest-output preset whose estimated encode time fits the budget"""
+    target_format = normalize_format(target_format)
+    if not latency_budget_ms:
+        return DEFAULT_PRESET
+
+    megapixels = (size[0] * size[1]) / 1_000_000.0
+    for preset in PRESET_ORDER:
+        estimated_ms = megapixels / ENCODER_THROUGHPUT[target_format][preset] * 1000.0
+        if estimated_ms <= latency_budget_ms:
+            return preset
+    return 'fast'
+
+
+def save_options(target_format, preset=DEFAULT_PRESET, quality=None):
+    """Keyword arguments for Image.save for a format and preset"""
+    target_format = normalize_format(target_format)
+    options = dict(ENCODER_PRESETS.get(preset, ENCODER_PRESETS[DEFAULT_PRESET])[target_format])
+    if target_format in DEFAULT_QUALITY:
+        options['quality'] = quality if quality is not None else DEFAULT_QUALITY[target_format]
+    return options
+
+
+def encode(image, target_format, output=None, preset=None, quality=None, latency_budget_ms=None):
+    """Encode an image into a path or file object using the central presets
+
+    When no preset is given one is chosen from latency_budget_ms (or the
+    default). Returns the output, rewound to the start if it is a buffer.
+    """
+    target_format = normalize_format(target_format)
+    if preset is None:
+        preset = choose_preset(target_format, image.size, latency_budget_ms)
+
+    image = prepare_image(image, target_format)
+    if output is None:
+        output = io.BytesIO()
+
+    try:
+        image.save(output, format=target_format, **save_options(target_format, preset, quality))
+    except Exception as e:
+        logger.error(f"Image encode error ({target_format}/{preset}): {e}")
+        raise
+
+    if hasattr(output, 'seek'):
+        output.seek(0)
+    return output
+
+
+def encode_many(images, target_format, preset=None, quality=None, latency_budget_ms=None, max_workers=None):
+    """Encode several images in parallel threads
+
+    Pillow releases the GIL inside its JPEG, PNG and WebP encoders, so a
+    thread pool spreads a batch of encodes across cores. Returns buffers in
+    input order.
+    """
+    def _encode(image):
+        return encode(image, target_format, preset=preset, quality=quality,
+                      latency_budget_ms=latency_budget_ms)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_encode, images))
+
+
+def target_size_bytes(size_kb):
+    """Byte budget from a target size in KB as submitted by a form
+
+    None when the field is empty; ValueError unless it is a positive,
+    finite number of at least one byte.
+    """
+    if size_kb in (None, ''):
+        return None
+    try:
+        size = int(float(size_kb) * 1024)
+    except (ValueError, OverflowError):
+        size = 0
+    if size < 1:
+        raise ValueError("Target size must be a positive number of KB")
+    return size
+
+
+def encode_to_target_size(image, target_format, max_bytes, preset='small', min_quality=10, max_quality=95):
+    """Binary-search the quality setting so the output fits within max_bytes
+
+    Trial encodes go into two reusable buffers that are swapped rather than
+    copied. Returns (buffer, quality, fits); when even min_quality is too
+    large the smallest encode is returned with fits set to False.
+    """
+    target_format = normalize_format(target_format)
+    if target_format not in DEFAULT_QUALITY:
+        raise ValueError(f"Target size mode needs a lossy format, not {target_format}")
+
+    image = prepare_image(image, target_format)
+    trial, best = io.BytesIO(), io.BytesIO()
+    best_quality = None
+
+    low, high = min_quality, max_quality
+    while low <= high:
+        quality = (low + high) // 2
+        trial.seek(0)
+        trial.truncate()
+        image.save(trial, format=target_format, **save_options(target_format, preset, quality))
+
+        if trial.tell() <= max_bytes:
+            trial, best = best, trial
+            best_quality = quality
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if best_quality is None:
+        # Nothing fit: hand back the lowest-quality attempt
+        best.seek(0)
+        best.truncate()
+        image.save(best, format=target_format, **save_options(target_format, preset, min_quality))
+        best.seek(0)
+        return best, min_quality, False
+
+    best.truncate(best.tell())
+    best.seek(0)
+    return best, best_quality, True
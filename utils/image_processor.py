@@ -1,8 +1,11 @@
 import io
 import cv2
 import numpy as np
-from PIL import Image, ImageFilter, ImageEnhance, ImageDraw, ImageFont
+from PIL import Image, ImageFilter, ImageEnhance
 import logging
+from utils.background_remover import BackgroundRemover
+from utils.overlay_cache import apply_image_watermark
+from utils.image_encoder import encode, encode_to_target_size, normalize_format
 
 logger = logging.getLogger(__name__)
 
@@ -23,81 +26,38 @@ class ImageProcessor:
             raise
     
     @staticmethod
-    def compress_image(image, quality=85, format='JPEG'):
-        """Compress image with specified quality"""
+    def compress_image(image, quality=85, format='JPEG', preset='small', target_size=None):
+        """Compress image and return the encoded buffer
+
+        With target_size (bytes) the quality is searched so the output fits.
+        """
         try:
-            output = io.BytesIO()
-            if format.upper() == 'PNG':
-                image.save(output, format='PNG', optimize=True)
-            else:
-                # Convert to RGB if necessary for JPEG
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-                    rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                    image = rgb_image
-                image.save(output, format='JPEG', quality=quality, optimize=True)
-            
-            output.seek(0)
-            return Image.open(output)
+            if target_size and normalize_format(format) != 'PNG':
+                output, _, _ = encode_to_target_size(image, format, target_size, preset)
+                return output
+            return encode(image, format, preset=preset, quality=quality)
         except Exception as e:
             logger.error(f"Image compression error: {e}")
             raise
     
     @staticmethod
-    def convert_format(image, target_format):
+    def convert_format(image, target_format, preset='balanced', latency_budget_ms=None):
         """Convert image to different format"""
         try:
-            output = io.BytesIO()
-            
-            if target_format.upper() == 'PNG':
-                image.save(output, format='PNG', optimize=True)
-            elif target_format.upper() in ['JPG', 'JPEG']:
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-                    rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                    image = rgb_image
-                image.save(output, format='JPEG', quality=95)
-            elif target_format.upper() == 'WEBP':
-                image.save(output, format='WEBP', quality=90)
-            
-            output.seek(0)
-            return output
+            if latency_budget_ms:
+                preset = None
+            quality = 95 if normalize_format(target_format) == 'JPEG' else None
+            return encode(image, target_format, preset=preset, quality=quality,
+                          latency_budget_ms=latency_budget_ms)
         except Exception as e:
             logger.error(f"Format conversion error: {e}")
             raise
     
     @staticmethod
-    def remove_background(image):
-        """Remove background using edge detection"""
+    def remove_background(image, quality='balanced'):
+        """Remove background with the GrabCut-based engine"""
         try:
-            # Convert PIL to OpenCV format
-            img_array = np.array(image)
-            if len(img_array.shape) == 3:
-                img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-            
-            # Create mask using edge detection
-            gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            
-            # Find contours
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Create mask
-            mask = np.zeros(gray.shape, np.uint8)
-            if contours:
-                largest_contour = max(contours, key=cv2.contourArea)
-                cv2.fillPoly(mask, [largest_contour], 255)
-            
-            # Apply mask
-            result = cv2.bitwise_and(img_array, img_array, mask=mask)
-            
-            # Convert back to PIL
-            result_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
-            
-            # Add alpha channel for transparency
-            result_rgba = np.dstack((result_rgb, mask))
-            
-            return Image.fromarray(result_rgba, 'RGBA')
+            return BackgroundRemover.remove_background(image, quality)
         except Exception as e:
             logger.error(f"Background removal error: {e}")
             raise
@@ -175,44 +135,11 @@ class ImageProcessor:
     def add_watermark(image, text, position="bottom-right", opacity=0.5):
         """Add text watermark to image"""
         try:
-            # Create a transparent overlay
-            overlay = Image.new('RGBA', image.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(overlay)
-            
-            # Try to load a font, fallback to default
-            try:
-                font = ImageFont.truetype("arial.ttf", 36)
-            except:
-                font = ImageFont.load_default()
-            
-            # Calculate position
-            text_bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_height = text_bbox[3] - text_bbox[1]
-            
-            if position == "bottom-right":
-                x = image.width - text_width - 20
-                y = image.height - text_height - 20
-            elif position == "bottom-left":
-                x = 20
-                y = image.height - text_height - 20
-            elif position == "top-right":
-                x = image.width - text_width - 20
-                y = 20
-            elif position == "top-left":
-                x = 20
-                y = 20
-            else:  # center
-                x = (image.width - text_width) // 2
-                y = (image.height - text_height) // 2
-            
-            # Add text with opacity
+            # The rendered text stamp is cached, so repeated brand text is
+            # only drawn once per process
             alpha = int(255 * opacity)
-            draw.text((x, y), text, font=font, fill=(255, 255, 255, alpha))
-            
-            # Composite with original image
-            watermarked = Image.alpha_composite(image.convert('RGBA'), overlay)
+            watermarked = apply_image_watermark(image, text, position, alpha)
             return watermarked.convert('RGB')
         except Exception as e:
             logger.error(f"Watermark error: {e}")
-            raise
\ No newline at end of file
+            raise
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import re
+import threading
+import time
+
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT_SECONDS = 15
+
+# Jobs are forgotten this long after their last event, unless they are
+# still running or being watched
+JOB_TTL_SECONDS = 600
+
+# An event stream ends after this long; a client still waiting reconnects
+STREAM_MAX_SECONDS = 3600
+
+# A stream for a job that has not started by then is told it is unknown;
+# clients open the stream before their upload, so this covers a slow upload
+START_GRACE_SECONDS = 300
+
+# Progress updates closer together than this are coalesced
+MIN_PUBLISH_INTERVAL = 0.25
+
+TERMINAL_STATES = ('done', 'error', 'cancelled')
+
+_JOB_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class JobNotFound(KeyError):
+    """No job with this id has started in this process, or it has expired"""
+
+
+class _Job:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.event = None
+        self.started = time.monotonic()
+        self.updated = self.started
+        self.last_progress = 0.0
+        # Whether the job itself has begun; a subscriber alone creates the entry too
+        self.running = False
+        # Set by request_cancel(); jobs check it between pages, frames and batches
+        self.cancel = threading.Event()
+        # (loop, asyncio.Event) of each watch() subscriber
+        self.waiters = set()
+        # Threads in subscribe()
+        self.subscribers = 0
+
+    def finished(self):
+        return self.event is not None and self.event['state'] in TERMINAL_STATES
+
+    def idle(self, now):
+        """Whether the job can be forgotten: expired, not running, not watched"""
+        return (now - self.updated > JOB_TTL_SECONDS and (not self.running or self.finished())
+                and not self.subscribers and not self.waiters)
+
+
+def valid_job_id(job_id):
+    """Job ids come from the client, so only short url-safe tokens are accepted"""
+    return bool(job_id and _JOB_ID.match(job_id))
+
+
+def _get_job(job_id, create=True):
+    now = time.monotonic()
+    with _jobs_lock:
+        expired = [key for key, job in _jobs.items() if job.idle(now)]
+        for key in expired:
+            del _jobs[key]
+        job = _jobs.get(job_id)
+        if job is None and create:
+            job = _jobs[job_id] = _Job()
+        return job
+
+
+def publish(job_id, state, **fields):
+    """Record the latest event for a job and wake its subscribers
+
+    Only the newest event is kept: a slow subscriber skips intermediate
+    progress but always sees the terminal 'done' or 'error' event.
+    """
+    if not valid_job_id(job_id):
+        return
+    job = _get_job(job_id)
+    with job.condition:
+        job.updated = time.monotonic()
+        if state == 'started':
+            # The subscriber may have opened the stream during the upload
+            job.started = job.updated
+            job.running = True
+        job.sequence += 1
+        job.event = {'state': state, 'elapsed': round(job.updated - job.started, 2), **fields}
+        job.condition.notify_all()
+        waiters = list(job.waiters)
+    for loop, wake in waiters:
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            # The subscriber's event loop has closed
+            pass
+
+
+def progress(job_id, fraction, stage='processing', **fields):
+    """Publish a progress fraction (0-1) with an ETA from the rate so far"""
+    if not valid_job_id(job_id):
+        return
+    job = _get_job(job_id)
+    now = time.monotonic()
+    if fraction < 1.0 and now - job.last_progress < MIN_PUBLISH_INTERVAL:
+        return
+    job.last_progress = now
+
+    elapsed = now - job.started
+    eta = elapsed * (1.0 - fraction) / fraction if fraction > 0 else None
+    publish(job_id, stage, progress=round(fraction, 4),
+            eta=round(eta, 1) if eta is not None else None, **fields)
+
+
+def reporter(job_id, stage='processing'):
+    """Callback for processors that report a fraction, or None without a job"""
+    if not valid_job_id(job_id):
+        return None
+    return lambda fraction, **fields: progress(job_id, fraction, stage, **fields)
+
+
+def cancel_event(job_id):
+    """Event set once the client cancels the job, or None without a job id"""
+    if not valid_job_id(job_id):
+        return None
+    return _get_job(job_id).cancel
+
+
+def request_cancel(job_id):
+    """Cancel a queued or running job; False if it already finished
+
+    Raises JobNotFound unless the job has started.
+    """
+    job = _get_job(job_id, create=False) if valid_job_id(job_id) else None
+    if job is None or not job.running:
+        raise JobNotFound(job_id)
+    with job.condition:
+        if job.finished():
+            return False
+    job.cancel.set()
+    publish(job_id, 'cancelling')
+    return True
+
+
+def _stream_over(job, opened, now):
+    """Whether a stream opened at opened should end now, and the event to end it with
+
+    A stream ends at STREAM_MAX_SECONDS, or with an 'unknown' event when
+    its job has not started within START_GRACE_SECONDS, so no stream
+    holds its connection forever.
+    """
+    if now - opened > STREAM_MAX_SECONDS:
+        return True, None
+    if not job.running and now - opened > START_GRACE_SECONDS:
+        return True, {'state': 'unknown'}
+    return False, None
+
+
+def subscribe(job_id, heartbeat=HEARTBEAT_SECONDS):
+    """Yield a job's events as they happen, None on each idle heartbeat
+
+    The current event is sent first, so a subscriber that connects after
+    the job started still sees where it is. The generator ends after a
+    terminal event, or as _stream_over() decides.
+    """
+    job = _get_job(job_id)
+    opened = time.monotonic()
+    seen = 0
+    with job.condition:
+        job.subscribers += 1
+    try:
+        while True:
+            with job.condition:
+                job.condition.wait_for(lambda: job.sequence != seen, timeout=heartbeat)
+                if job.sequence == seen:
+                    event = None
+                else:
+                    seen = job.sequence
+                    event = job.event
+            if event is None:
+                over, event = _stream_over(job, opened, time.monotonic())
+                if over:
+                    if event is not None:
+                        yield event
+                    return
+            yield event
+            if event is not None and event['state'] in TERMINAL_STATES:
+                return
+    finally:
+        with job.condition:
+            job.subscribers -= 1
+
+
+async def watch(job_id, heartbeat=HEARTBEAT_SECONDS):
+    """subscribe() for event-loop servers, where a waiting client holds no thread"""
+    job = _get_job(job_id)
+    opened = time.monotonic()
+    wake = asyncio.Event()
+    waiter = (asyncio.get_running_loop(), wake)
+    with job.condition:
+        job.waiters.add(waiter)
+    seen = 0
+    try:
+        while True:
+            # Cleared before the check, so a publish in between still wakes us
+            wake.clear()
+            with job.condition:
+                changed = job.sequence != seen
+                if changed:
+                    seen = job.sequence
+                    event = job.event
+            if not changed:
+                try:
+                    await asyncio.wait_for(wake.wait(), heartbeat)
+                    continue
+                except asyncio.TimeoutError:
+                    event = None
+                over, event = _stream_over(job, opened, time.monotonic())
+                if over:
+                    if event is not None:
+                        yield event
+                    return
+            yield event
+            if event is not None and event['state'] in TERMINAL_STATES:
+                return
+    finally:
+        with job.condition:
+            job.waiters.discard(waiter)
+
+
+def format_sse(event):
+    """Serialize an event (or a heartbeat for None) in text/event-stream framing"""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def clear():
+    with _jobs_lock:
+        _jobs.clear()
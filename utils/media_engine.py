@@ -0,0 +1,407 @@
+import contextlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import uuid
+
+from utils import audio_stream, ffmpeg_engine
+from utils.audio_processor import AudioProcessor
+from utils.ffmpeg_engine import (AUDIO_ENCODERS, CONTAINERS, COPYABLE_VIDEO, FFMPEG_AVAILABLE, VIDEO_ENCODERS,
+                                 FFmpegError, audio_args, stream_codec, video_stream)
+from utils.media_probe import validate_range
+from utils.video_processor import VideoProcessor
+from utils.worker_pool import JobCancelled, cancel_requested
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FORMATS = {'mp3', 'wav', 'ogg', 'aac', 'm4a', 'flac'}
+VIDEO_FORMATS = {'mp4', 'mov', 'mkv', 'webm', 'avi'}
+
+# Output height for the resizer presets; width follows the aspect ratio
+RESOLUTIONS = {'2160p': 2160, '1440p': 1440, '1080p': 1080, '720p': 720, '480p': 480, '360p': 360, '240p': 240}
+
+# Loudness target (LUFS) and true-peak ceiling (dBTP) for normalization
+NORMALIZE_LUFS = -16.0
+NORMALIZE_TRUE_PEAK = -1.5
+
+# Boosted audio is limited just below full scale instead of clipping
+BOOST_LIMIT = 0.98
+
+# Tools the engine handles
+SUPPORTED_TOOLS = frozenset({
+    'audio-convert', 'audio-trim', 'audio-join', 'audio-boost', 'audio-normalize', 'audio-extract',
+    'video-to-audio', 'voice-change', 'noise-removal', 'vocal-remove',
+    'video-convert', 'video-trim', 'video-join', 'video-mute', 'video-add-audio', 'video-resize', 'video-color',
+})
+
+# Tools that take more than one input file
+MULTI_INPUT_TOOLS = {'audio-join': 2, 'video-join': 2, 'video-add-audio': 2}
+
+
+class MediaEngine:
+    """Run the audio and video tools as single-pass ffmpeg filter graphs
+
+    Every tool is planned into one ffmpeg command that reads the inputs,
+    filters and encodes in a stream and writes the output file directly
+    (normalization first measures the loudness in a streaming pass), so
+    nothing is decoded into Python and memory does not grow with the
+    input length. Streams the target container can carry are copied
+    rather than re-encoded.
+
+    progress is called with a fraction between 0 and 1 as ffmpeg reports
+    its position (-progress pipe:1). cancel() may be called from another
+    thread; it kills the running ffmpeg process and process() raises
+    utils.worker_pool.JobCancelled. Without ffmpeg the tools fall back to
+    AudioProcessor and VideoProcessor.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self._reported = 0.0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._proc = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+    def process(self, tool_id, inputs, options=None, output_dir=None):
+        """Run tool_id on a list of input paths and return the output path
+
+        options uses the keys output_format, bitrate, start_time, end_time,
+        exact, gain_db, target_lufs, pitch, resolution, brightness,
+        contrast and saturation; each tool reads only the ones it needs.
+        """
+        if tool_id not in SUPPORTED_TOOLS:
+            raise ValueError(f"Unsupported media tool: {tool_id}")
+        if len(inputs) < MULTI_INPUT_TOOLS.get(tool_id, 1):
+            raise ValueError(f"{tool_id} needs at least {MULTI_INPUT_TOOLS[tool_id]} files")
+        options = options or {}
+        output_dir = output_dir or tempfile.gettempdir()
+
+        self._report(0.0)
+        if FFMPEG_AVAILABLE:
+            output = self._run_ffmpeg(tool_id, inputs, options, output_dir)
+        else:
+            output = self._run_fallback(tool_id, inputs, options, output_dir)
+        self._report(1.0)
+        return output
+
+    def _report(self, fraction):
+        # Never backwards: trim and join run several commands, each from zero
+        self._reported = max(self._reported, min(fraction, 1.0))
+        if self.progress is not None:
+            self.progress(self._reported)
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    @staticmethod
+    def _output_path(output_dir, tool_id, output_format):
+        return os.path.join(output_dir, f"{tool_id}_{uuid.uuid4().hex}.{output_format}")
+
+    def _run_ffmpeg(self, tool_id, inputs, options, output_dir):
+        infos = [ffmpeg_engine.probe(path) for path in inputs]
+        self._check_cancelled()
+
+        # Pure stream-copy jobs are handled by the engine's splice and concat paths;
+        # each command they start still runs through _run for progress and cancel()
+        if tool_id == 'video-trim':
+            output_format = _requested(options, VIDEO_FORMATS) or _container(inputs[0], VIDEO_FORMATS, 'mp4')
+            start_time, end_time = _trim_range(options, infos[0])
+            output = self._output_path(output_dir, tool_id, output_format)
+            with ffmpeg_engine.command_runner(self._engine_runner(end_time - start_time)):
+                return ffmpeg_engine.trim_video(inputs[0], start_time, end_time, output_format, output,
+                                                exact=bool(options.get('exact')))
+        if tool_id == 'video-join':
+            output_format = _requested(options, VIDEO_FORMATS) or 'mp4'
+            output = self._output_path(output_dir, tool_id, output_format)
+            with ffmpeg_engine.command_runner(self._engine_runner(sum(_duration(info) for info in infos))):
+                return ffmpeg_engine.merge(inputs, output_format, output)
+        # Gain tools share audio_stream's scan-then-gain engine with AudioProcessor
+        if tool_id in ('audio-boost', 'audio-normalize'):
+            _audio_codec(infos[0])
+            output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+            output = self._output_path(output_dir, tool_id, output_format)
+            with ffmpeg_engine.command_runner(self._engine_runner(_duration(infos[0]))):
+                if tool_id == 'audio-boost':
+                    return audio_stream.adjust_volume(inputs[0], float(options.get('gain_db', 6.0)),
+                                                      output_format, output, limit=BOOST_LIMIT)
+                return audio_stream.normalize_loudness(inputs[0], float(options.get('target_lufs', NORMALIZE_LUFS)),
+                                                       NORMALIZE_TRUE_PEAK, output_format, output)
+
+        planner = getattr(self, '_plan_' + tool_id.replace('-', '_'))
+        input_specs, output_args, output_format, duration = planner(inputs, infos, options)
+        output = self._output_path(output_dir, tool_id, output_format)
+        self._execute(input_specs, output_args, output_format, output, duration)
+        return output
+
+    def _execute(self, input_specs, output_args, output_format, output, duration):
+        """Run one planned ffmpeg command"""
+        cmd = [ffmpeg_engine.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+        for spec in input_specs:
+            cmd += spec
+        cmd += [*output_args, '-f', CONTAINERS.get(output_format, output_format), output]
+        self._run(cmd, output, duration)
+
+    def _engine_runner(self, duration):
+        """ffmpeg_engine.command_runner() hook; the engine puts the output path last"""
+        def runner(cmd, pass_fds):
+            self._run(cmd, cmd[-1], duration, pass_fds)
+        return runner
+
+    def _run(self, cmd, output, duration, pass_fds=()):
+        """Run ffmpeg, forwarding progress and honouring cancel()"""
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+        logger.debug("ffmpeg: %s", ' '.join(cmd))
+
+        with tempfile.TemporaryFile() as stderr:
+            with self._lock:
+                self._check_cancelled()
+                self._proc = proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr,
+                                                     pass_fds=pass_fds)
+            try:
+                for line in proc.stdout:
+                    # The job itself was cancelled through the supervisor or the cancel API
+                    if cancel_requested():
+                        self.cancel()
+                    key, _, value = line.decode(errors='replace').strip().partition('=')
+                    if key == 'out_time_us' and duration and value.lstrip('-').isdigit():
+                        self._report(int(value) / 1e6 / duration)
+                returncode = proc.wait()
+            finally:
+                proc.stdout.close()
+                with self._lock:
+                    self._proc = None
+
+            if self._cancelled.is_set():
+                with contextlib.suppress(OSError):
+                    os.unlink(output)
+                raise JobCancelled()
+            if returncode != 0:
+                stderr.seek(0)
+                raise FFmpegError(f"ffmpeg failed: {stderr.read().decode(errors='replace').strip()}")
+
+    # Audio tools
+
+    def _plan_audio_convert(self, inputs, infos, options):
+        output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+        codec = _audio_codec(infos[0])
+        bitrate = options.get('bitrate')
+        if bitrate and output_format in ('mp3', 'aac', 'm4a', 'ogg'):
+            audio = _audio_encoder(output_format, bitrate)
+        else:
+            audio = audio_args(codec, output_format)
+        return ([['-i', inputs[0]]], ['-map', '0:a:0', '-vn', *audio],
+                output_format, _duration(infos[0]))
+
+    def _plan_audio_trim(self, inputs, infos, options):
+        output_format = _requested(options, AUDIO_FORMATS) or _container(inputs[0], AUDIO_FORMATS, 'mp3')
+        start_time, end_time = _trim_range(options, infos[0])
+        # Compressed audio frames decode independently, so the cut can copy them
+        return ([['-ss', f'{start_time:.3f}', '-i', inputs[0]]],
+                ['-t', f'{end_time - start_time:.3f}', '-map', '0:a:0', '-vn',
+                 *audio_args(_audio_codec(infos[0]), output_format)],
+                output_format, end_time - start_time)
+
+    def _plan_audio_join(self, inputs, infos, options):
+        output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+        for info in infos:
+            _audio_codec(info)
+        sample_rate = _sample_rate(infos[0])
+        filters = [f"[{index}:a:0]aresample={sample_rate},"
+                   f"aformat=sample_fmts=fltp:channel_layouts=stereo[a{index}]" for index in range(len(inputs))]
+        labels = ''.join(f'[a{index}]' for index in range(len(inputs)))
+        filters.append(f"{labels}concat=n={len(inputs)}:v=0:a=1[a]")
+        return ([['-i', path] for path in inputs],
+                ['-filter_complex', ';'.join(filters), '-map', '[a]', *AUDIO_ENCODERS[output_format]],
+                output_format, sum(_duration(info) for info in infos))
+
+    def _plan_audio_extract(self, inputs, infos, options):
+        output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+        return ([['-i', inputs[0]]],
+                ['-map', '0:a:0', '-vn', '-sn', '-dn', *audio_args(_audio_codec(infos[0]), output_format)],
+                output_format, _duration(infos[0]))
+
+    _plan_video_to_audio = _plan_audio_extract
+
+    def _plan_voice_change(self, inputs, infos, options):
+        # Resampling shifts pitch and speed together; atempo restores the speed
+        pitch = min(max(float(options.get('pitch', 1.25)), 0.5), 2.0)
+        sample_rate = _sample_rate(infos[0])
+        return self._audio_filter(inputs, infos, options,
+                                  f"asetrate={round(sample_rate * pitch)},aresample={sample_rate},"
+                                  f"atempo={1 / pitch:.6f}")
+
+    def _plan_noise_removal(self, inputs, infos, options):
+        return self._audio_filter(inputs, infos, options, "highpass=f=80,afftdn=nf=-25")
+
+    def _plan_vocal_remove(self, inputs, infos, options):
+        channels = next((s.get('channels') for s in infos[0].get('streams', [])
+                         if s.get('codec_type') == 'audio'), None)
+        if channels != 2:
+            raise ValueError("Vocal removal needs a stereo recording")
+        # Lead vocals are usually mixed to the centre; subtracting the channels cancels them
+        return self._audio_filter(inputs, infos, options, "pan=stereo|c0=c0-c1|c1=c1-c0")
+
+    def _audio_filter(self, inputs, infos, options, audio_filter):
+        output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+        _audio_codec(infos[0])
+        return ([['-i', inputs[0]]],
+                ['-map', '0:a:0', '-vn', '-af', audio_filter, *AUDIO_ENCODERS[output_format]],
+                output_format, _duration(infos[0]))
+
+    # Video tools
+
+    def _plan_video_convert(self, inputs, infos, options):
+        output_format = _requested(options, VIDEO_FORMATS) or 'mp4'
+        info = _require_video(infos[0])
+        if video_stream(info).get('codec_name') in COPYABLE_VIDEO.get(output_format, ()):
+            video = ['-c:v', 'copy']
+        else:
+            video = list(VIDEO_ENCODERS[output_format])
+        return ([['-i', inputs[0]]],
+                ['-map', '0:v:0', '-map', '0:a:0?', *video, *audio_args(stream_codec(info, 'audio'), output_format)],
+                output_format, _duration(info))
+
+    def _plan_video_mute(self, inputs, infos, options):
+        _require_video(infos[0])
+        output_format = _container(inputs[0], VIDEO_FORMATS, 'mp4')
+        return ([['-i', inputs[0]]], ['-map', '0:v:0', '-c:v', 'copy', '-an'],
+                output_format, _duration(infos[0]))
+
+    def _plan_video_add_audio(self, inputs, infos, options):
+        _require_video(infos[0])
+        output_format = _container(inputs[0], VIDEO_FORMATS, 'mp4')
+        video_codec = video_stream(infos[0]).get('codec_name')
+        video = ['-c:v', 'copy'] if video_codec in COPYABLE_VIDEO.get(output_format, ()) \
+            else list(VIDEO_ENCODERS[output_format])
+        return ([['-i', inputs[0]], ['-i', inputs[1]]],
+                ['-map', '0:v:0', '-map', '1:a:0', *video, *audio_args(_audio_codec(infos[1]), output_format),
+                 '-shortest'],
+                output_format, _duration(infos[0]))
+
+    def _plan_video_resize(self, inputs, infos, options):
+        height = RESOLUTIONS.get(options.get('resolution'), 720)
+        # -2 keeps the width even, which yuv420p needs
+        return self._video_filter(inputs, infos, options, f"scale=-2:{height}")
+
+    def _plan_video_color(self, inputs, infos, options):
+        brightness = min(max(float(options.get('brightness', 0.0)), -1.0), 1.0)
+        contrast = min(max(float(options.get('contrast', 1.0)), 0.0), 3.0)
+        saturation = min(max(float(options.get('saturation', 1.0)), 0.0), 3.0)
+        return self._video_filter(inputs, infos, options,
+                                  f"eq=brightness={brightness:.3f}:contrast={contrast:.3f}:saturation={saturation:.3f}")
+
+    def _video_filter(self, inputs, infos, options, video_filter):
+        info = _require_video(infos[0])
+        output_format = _requested(options, VIDEO_FORMATS) or _container(inputs[0], VIDEO_FORMATS, 'mp4')
+        return ([['-i', inputs[0]]],
+                ['-map', '0:v:0', '-map', '0:a:0?', '-vf', video_filter, *VIDEO_ENCODERS[output_format],
+                 *audio_args(stream_codec(info, 'audio'), output_format)],
+                output_format, _duration(info))
+
+    # Fallback without ffmpeg
+
+    def _run_fallback(self, tool_id, inputs, options, output_dir):
+        input_format = os.path.splitext(inputs[0])[1].lstrip('.').lower() or 'mp3'
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(path, 'rb')) for path in inputs]
+            if tool_id == 'audio-convert':
+                output_format = _requested(options, AUDIO_FORMATS) or 'mp3'
+                result = AudioProcessor.convert_format(files[0], input_format, output_format)
+            elif tool_id == 'audio-trim':
+                output_format = 'mp3'
+                result = AudioProcessor.trim_audio(files[0], float(options.get('start_time', 0)),
+                                                   float(options.get('end_time', 30)), input_format)
+            elif tool_id == 'audio-join':
+                output_format = 'mp3'
+                result = AudioProcessor.merge_audio(files, input_format)
+            elif tool_id == 'audio-boost':
+                output_format = 'mp3'
+                result = AudioProcessor.adjust_volume(files[0], float(options.get('gain_db', 6.0)), input_format)
+            elif tool_id == 'audio-normalize':
+                output_format = 'mp3'
+                result = AudioProcessor.normalize_audio(files[0], input_format)
+            elif tool_id in ('audio-extract', 'video-to-audio'):
+                output_format = 'mp3'
+                result = VideoProcessor.extract_audio(files[0])
+            elif tool_id == 'video-convert':
+                output_format = _requested(options, VIDEO_FORMATS) or 'mp4'
+                result = VideoProcessor.convert_format(files[0], output_format)
+            elif tool_id == 'video-trim':
+                output_format = 'mp4'
+                result = VideoProcessor.trim_video(files[0], float(options.get('start_time', 0)),
+                                                   float(options.get('end_time', 30)))
+            elif tool_id == 'video-join':
+                output_format = 'mp4'
+                result = VideoProcessor.merge_videos(files)
+            else:
+                raise ImportError(f"ffmpeg is required for {tool_id}")
+
+        output = self._output_path(output_dir, tool_id, output_format)
+        with open(output, 'wb') as f:
+            f.write(result.getbuffer())
+        return output
+
+
+def _requested(options, formats):
+    output_format = (options.get('output_format') or '').lower()
+    return output_format if output_format in formats else None
+
+
+def _container(path, formats, default):
+    """Keep the input's container when it is one of formats"""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in formats else default
+
+
+def _duration(info):
+    return float(info.get('format', {}).get('duration') or 0)
+
+
+def _audio_codec(info):
+    codec = stream_codec(info, 'audio')
+    if codec is None:
+        raise ValueError("Input has no audio stream")
+    return codec
+
+
+def _sample_rate(info):
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == 'audio':
+            return int(stream.get('sample_rate') or 44100)
+    return 44100
+
+
+def _require_video(info):
+    if video_stream(info) is None:
+        raise ValueError("Input has no video stream")
+    return info
+
+
+def _audio_encoder(output_format, bitrate):
+    """The format's encoder arguments with the bitrate replaced"""
+    encoder = list(AUDIO_ENCODERS[output_format])
+    for flag in ('-b:a', '-q:a'):
+        if flag in encoder:
+            index = encoder.index(flag)
+            del encoder[index:index + 2]
+    return [*encoder, '-b:a', f"{int(bitrate)}k"]
+
+
+def _trim_range(options, info):
+    start_time = float(options.get('start_time') or 0)
+    end_time = float(options.get('end_time') or _duration(info) or 30)
+    return validate_range({'duration': _duration(info) or None}, start_time, end_time)
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+from utils import ffmpeg_engine
+from utils.ffmpeg_engine import FFMPEG_AVAILABLE
+
+logger = logging.getLogger(__name__)
+
+# Probe results kept in memory, keyed by content hash
+PROBE_CACHE_SIZE = 1024
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ffprobe reports comma-separated demuxer names; map them to one extension
+FORMAT_NAMES = {
+    'mov,mp4,m4a,3gp,3g2,mj2': 'mp4',
+    'matroska,webm': 'mkv',
+    'mp3': 'mp3',
+    'wav': 'wav',
+    'ogg': 'ogg',
+    'flac': 'flac',
+    'aac': 'aac',
+    'avi': 'avi',
+    'gif': 'gif',
+}
+
+_probe_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def content_hash(source):
+    """blake2b of a path or file object, read in 1 MB chunks
+
+    File objects are rewound to where they were so the caller can still
+    read them afterwards.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    position = source.tell()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    source.seek(position)
+    return digest.hexdigest()
+
+
+def _frame_rate(value):
+    try:
+        rate = Fraction(value or '0')
+    except (ValueError, ZeroDivisionError):
+        return None
+    return round(float(rate), 3) if rate else None
+
+
+def summarize(info):
+    """Reduce raw ffprobe output to the fields the tools and UI use"""
+    fmt = info.get('format', {})
+    streams = []
+    for stream in info.get('streams', []):
+        codec_type = stream.get('codec_type')
+        if codec_type not in ('video', 'audio'):
+            continue
+        entry = {
+            'type': codec_type,
+            'codec': stream.get('codec_name'),
+            'bit_rate': int(stream['bit_rate']) if stream.get('bit_rate') else None,
+        }
+        if codec_type == 'video':
+            entry.update(width=stream.get('width'), height=stream.get('height'),
+                         fps=_frame_rate(stream.get('avg_frame_rate') or stream.get('r_frame_rate')))
+        else:
+            entry.update(sample_rate=int(stream.get('sample_rate') or 0) or None,
+                         channels=stream.get('channels'))
+        streams.append(entry)
+
+    format_name = fmt.get('format_name', '')
+    video = next((s for s in streams if s['type'] == 'video'), None)
+    audio = next((s for s in streams if s['type'] == 'audio'), None)
+    return {
+        'format': FORMAT_NAMES.get(format_name, format_name.split(',')[0] or None),
+        'duration': float(fmt['duration']) if fmt.get('duration') else None,
+        'bit_rate': int(fmt['bit_rate']) if fmt.get('bit_rate') else None,
+        'size': int(fmt['size']) if fmt.get('size') else None,
+        'video_codec': video['codec'] if video else None,
+        'audio_codec': audio['codec'] if audio else None,
+        # Single-frame images also show up as a "video" stream
+        'has_video': bool(video) and format_name not in ('image2', 'png_pipe', 'jpeg_pipe'),
+        'has_audio': bool(audio),
+        'streams': streams,
+    }
+
+
+def get_cached(key):
+    with _cache_lock:
+        result = _probe_cache.get(key)
+        if result is not None:
+            _probe_cache.move_to_end(key)
+        return result
+
+
+def _store(key, result):
+    with _cache_lock:
+        _probe_cache[key] = result
+        _probe_cache.move_to_end(key)
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+
+
+def probe_media(source):
+    """Container-level metadata for a media file, cached by content hash
+
+    Only headers are read (ffprobe -show_format -show_streams, no decode),
+    and repeat uploads of the same bytes skip ffprobe entirely. The result
+    carries its 'hash' so callers can pass it along.
+    """
+    key = content_hash(source)
+    result = get_cached(key)
+    if result is not None:
+        return result
+
+    ffmpeg_engine.require_ffmpeg()
+    result = summarize(ffmpeg_engine.probe(source))
+    result['hash'] = key
+    _store(key, result)
+    return result
+
+
+def detect_format(file, default='mp3'):
+    """Container format of an upload, falling back to its filename extension"""
+    extension = (getattr(file, 'filename', None) or '').rsplit('.', 1)
+    fallback = extension[1].lower() if len(extension) == 2 else default
+    if not FFMPEG_AVAILABLE:
+        return fallback
+    try:
+        return probe_media(file)['format'] or fallback
+    except Exception as e:
+        logger.warning(f"Probe failed, using extension: {e}")
+        return fallback
+
+
+def validate_range(info, start_time, end_time):
+    """Check a trim range against the probed duration
+
+    Returns (start, end) with end clamped to the duration, or raises
+    ValueError with a message suitable for the client.
+    """
+    duration = info.get('duration')
+    if start_time < 0:
+        raise ValueError("Start time cannot be negative")
+    if end_time <= start_time:
+        raise ValueError("End time must be after start time")
+    if duration is not None:
+        if start_time >= duration:
+            raise ValueError(f"Start time is past the end of the media ({duration:.1f}s)")
+        end_time = min(end_time, duration)
+    return start_time, end_time
+
+
+def clear_cache():
+    with _cache_lock:
+        _probe_cache.clear()
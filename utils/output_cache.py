@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Outputs up to this size stay in memory and are inlined in the JSON
+# response; larger ones are written to the artifact store
+SMALL_OUTPUT_LIMIT = int(os.environ.get('SMALL_OUTPUT_LIMIT_KB') or 256) * 1024
+
+# Total bytes held in memory per process; least recently used go first
+OUTPUT_CACHE_BYTES = int(os.environ.get('OUTPUT_CACHE_MB') or 64) * 1024 * 1024
+
+# Seconds a cached output can be downloaded, as for stored artifacts
+OUTPUT_CACHE_TTL = int(os.environ.get('ARTIFACT_TTL') or 3600)
+
+
+class CachedOutput:
+    __slots__ = ('data', 'filename', 'mimetype', 'etag', 'expires')
+
+    def __init__(self, data, filename, mimetype, expires):
+        self.data = data
+        self.filename = filename
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.expires = expires
+
+    def inline(self):
+        """The output as a JSON-ready dict with base64 content"""
+        return {'filename': self.filename, 'mimetype': self.mimetype, 'size': len(self.data),
+                'data': base64.b64encode(self.data).decode('ascii')}
+
+
+class OutputCache:
+    """Small outputs kept in memory instead of on disk
+
+    Entries live in an LRU bounded by total bytes. The cache is per
+    process, so responses inline small outputs and clients never need a
+    second request for them; /download only finds an entry in the
+    process that produced it and falls back to the artifact store.
+    """
+
+    def __init__(self, max_bytes=OUTPUT_CACHE_BYTES, ttl=OUTPUT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, data, filename, mimetype=None):
+        """Keep data under a new output name; returns (name, entry)
+
+        The entry is returned so the caller need not get() it back, which
+        could find it already evicted by concurrent puts.
+        """
+        extension = os.path.splitext(filename)[1]
+        name = f"{uuid.uuid4()}{extension}"
+        mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        entry = CachedOutput(bytes(data), filename, mimetype, time.time() + self.ttl)
+        with self._lock:
+            self._entries[name] = entry
+            self._bytes += len(entry.data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+        return name, entry
+
+    def get(self, name):
+        """The live entry for name, or None"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if entry.expires <= time.time():
+                del self._entries[name]
+                self._bytes -= len(entry.data)
+                return None
+            self._entries.move_to_end(name)
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+def fits(data):
+    """Whether an output is small enough to keep in memory"""
+    return data is not None and len(data) <= SMALL_OUTPUT_LIMIT
+
+
+_cache = OutputCache()
+
+
+def get_cache():
+    return _cache
@@ -0,0 +1,151 @@
+import io
+import logging
+import math
+from functools import lru_cache
+
+import PyPDF2
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.pdfgen import canvas
+
+logger = logging.getLogger(__name__)
+
+# Distance in pixels between a watermark and the image edge
+IMAGE_MARGIN = 20
+
+# Distance in points between a PDF watermark and the page edge
+PDF_MARGIN = 50
+
+
+@lru_cache(maxsize=32)
+def get_font(font_name='arial.ttf', size=36):
+    """Load a TrueType font once per process, falling back to the default font"""
+    try:
+        return ImageFont.truetype(font_name, size)
+    except OSError:
+        logger.debug(f"Font {font_name} not available, using default font")
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def get_text_stamp(text, font_name='arial.ttf', size=36, alpha=128, fill=(255, 255, 255)):
+    """Render watermark text once into a tight RGBA stamp
+
+    Returns (stamp, (offset_x, offset_y)) where the offset is the glyph box
+    origin relative to the text anchor, so callers can place the stamp
+    exactly where ImageDraw.text would have drawn it.
+    """
+    font = get_font(font_name, size)
+    probe = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    left, top, right, bottom = probe.textbbox((0, 0), text, font=font)
+
+    stamp = Image.new('RGBA', (max(1, right - left), max(1, bottom - top)), (255, 255, 255, 0))
+    ImageDraw.Draw(stamp).text((-left, -top), text, font=font, fill=fill + (alpha,))
+    stamp.readonly = True
+    return stamp, (left, top)
+
+
+@lru_cache(maxsize=1024)
+def get_image_overlay(text, font_name, size, alpha, position, image_size):
+    """Return the cached stamp and where it lands on an image of image_size"""
+    stamp, (offset_x, offset_y) = get_text_stamp(text, font_name, size, alpha)
+    width, height = image_size
+    text_width, text_height = stamp.size
+
+    if position == 'bottom-right':
+        x = width - text_width - IMAGE_MARGIN
+        y = height - text_height - IMAGE_MARGIN
+    elif position == 'bottom-left':
+        x = IMAGE_MARGIN
+        y = height - text_height - IMAGE_MARGIN
+    elif position == 'top-right':
+        x = width - text_width - IMAGE_MARGIN
+        y = IMAGE_MARGIN
+    elif position == 'top-left':
+        x = IMAGE_MARGIN
+        y = IMAGE_MARGIN
+    else:  # center
+        x = (width - text_width) // 2
+        y = (height - text_height) // 2
+
+    return stamp, (x + offset_x, y + offset_y)
+
+
+def apply_image_watermark(image, text, position='bottom-right', alpha=128,
+                          font_name='arial.ttf', size=36):
+    """Composite a cached text stamp onto a copy of the image (returns RGBA)"""
+    stamp, (x, y) = get_image_overlay(text, font_name, size, alpha, position, image.size)
+    watermarked = image.convert('RGBA')
+
+    # Clip the stamp when it does not fully fit inside the image
+    left, top = max(0, -x), max(0, -y)
+    right = min(stamp.width, watermarked.width - x)
+    bottom = min(stamp.height, watermarked.height - y)
+    if right > left and bottom > top:
+        watermarked.alpha_composite(stamp, dest=(x + left, y + top), source=(left, top, right, bottom))
+    return watermarked
+
+
+def watermark_opacity(value, default=0.5):
+    """Watermark opacity from a form value, clamped to 0-1
+
+    The default when the field is empty; ValueError unless it is a
+    finite number.
+    """
+    if value in (None, ''):
+        return default
+    try:
+        opacity = float(value)
+    except ValueError:
+        opacity = math.nan
+    if not math.isfinite(opacity):
+        raise ValueError("Opacity must be a number between 0 and 1")
+    return min(max(opacity, 0.0), 1.0)
+
+
+@lru_cache(maxsize=128)
+def get_pdf_stamp(text, position='center', page_size=(612, 792), font_name='Helvetica', size=40):
+    """Build a single-page watermark PDF once per text, position and page size"""
+    width, height = page_size
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=page_size)
+    c.setFillColorRGB(0.5, 0.5, 0.5)
+    c.setFont(font_name, size)
+
+    if position == 'center':
+        c.drawCentredString(width / 2, height / 2, text)
+    elif position == 'bottom-right':
+        c.drawRightString(width - PDF_MARGIN, PDF_MARGIN, text)
+    else:  # top-left
+        c.drawString(PDF_MARGIN, height - PDF_MARGIN, text)
+
+    c.save()
+    return buffer.getvalue()
+
+
+class PDFStampSet:
+    """Parsed watermark pages for one document, shared by all same-sized pages"""
+
+    def __init__(self, text, position='center', font_name='Helvetica', size=40):
+        self.text = text
+        self.position = position
+        self.font_name = font_name
+        self.size = size
+        self._pages = {}
+
+    def for_page(self, page):
+        """Return the watermark page matching the size of a PyPDF2 page"""
+        page_size = (round(float(page.mediabox.width)), round(float(page.mediabox.height)))
+        stamp_page = self._pages.get(page_size)
+        if stamp_page is None:
+            stamp_pdf = get_pdf_stamp(self.text, self.position, page_size, self.font_name, self.size)
+            stamp_page = PyPDF2.PdfReader(io.BytesIO(stamp_pdf)).pages[0]
+            self._pages[page_size] = stamp_page
+        return stamp_page
+
+
+def clear_caches():
+    """Drop all cached fonts, stamps and overlays"""
+    get_font.cache_clear()
+    get_text_stamp.cache_clear()
+    get_image_overlay.cache_clear()
+    get_pdf_stamp.cache_clear()
@@ -8,6 +8,7 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.utils import ImageReader
 from PIL import Image
 import logging
+from utils.overlay_cache import PDFStampSet
 
 logger = logging.getLogger(__name__)
 
@@ -120,36 +121,24 @@ class PDFProcessor:
             raise
     
     @staticmethod
-    def add_watermark(pdf_file, watermark_text, position="center"):
-        """Add watermark to PDF"""
+    def add_watermark(pdf_file, watermark_text, position="center", stamps=None):
+        """Add watermark to PDF
+
+        Pass a shared PDFStampSet as stamps to reuse parsed watermark pages
+        across a batch of documents.
+        """
         try:
             pdf_file.seek(0)
             reader = PyPDF2.PdfReader(pdf_file)
             writer = PyPDF2.PdfWriter()
             
-            # Create watermark
-            watermark_buffer = io.BytesIO()
-            c = canvas.Canvas(watermark_buffer, pagesize=letter)
-            
-            if position == "center":
-                x, y = 300, 400
-            elif position == "bottom-right":
-                x, y = 450, 50
-            else:  # top-left
-                x, y = 50, 750
-            
-            c.setFillColorRGB(0.5, 0.5, 0.5)
-            c.setFont("Helvetica", 40)
-            c.drawString(x, y, watermark_text)
-            c.save()
-            
-            watermark_buffer.seek(0)
-            watermark_reader = PyPDF2.PdfReader(watermark_buffer)
-            watermark_page = watermark_reader.pages[0]
+            # Watermark pages are pre-rendered once per page size
+            if stamps is None:
+                stamps = PDFStampSet(watermark_text, position)
             
             # Apply watermark to all pages
             for page in reader.pages:
-                page.merge_page(watermark_page)
+                page.merge_page(stamps.for_page(page))
                 writer.add_page(page)
             
             output = io.BytesIO()
@@ -158,4 +147,4 @@ class PDFProcessor:
             return output
         except Exception as e:
             logger.error(f"Watermark error: {e}")
-            raise
\ No newline at end of file
+            raise
@@ -9,6 +9,9 @@ try:
 except ImportError:
     MOVIEPY_AVAILABLE = False
 
+from utils import ffmpeg_engine
+from utils.ffmpeg_engine import FFMPEG_AVAILABLE
+
 logger = logging.getLogger(__name__)
 
 class VideoProcessor:
@@ -17,8 +20,14 @@ class VideoProcessor:
     @staticmethod
     def extract_audio(video_file):
         """Extract audio from video file"""
+        if FFMPEG_AVAILABLE:
+            try:
+                return ffmpeg_engine.extract_audio(video_file, 'mp3')
+            except Exception as e:
+                logger.error(f"Audio extraction error: {e}")
+                raise
         if not MOVIEPY_AVAILABLE:
-            raise ImportError("MoviePy is required for video processing")
+            raise ImportError("ffmpeg or MoviePy is required for video processing")
         try:
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
                 tmp_video.write(video_file.read())
@@ -53,6 +62,11 @@ class VideoProcessor:
     def convert_format(video_file, output_format, quality='medium'):
         """Convert video to different format"""
         try:
+            if FFMPEG_AVAILABLE and output_format == 'gif':
+                return ffmpeg_engine.create_animation(video_file, fps=10, scale=1.0)
+            if FFMPEG_AVAILABLE and output_format in ffmpeg_engine.VIDEO_ENCODERS:
+                return ffmpeg_engine.convert_format(video_file, output_format, quality)
+            
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
                 tmp_video.write(video_file.read())
                 tmp_video_path = tmp_video.name
@@ -97,6 +111,9 @@ class VideoProcessor:
     def compress_video(video_file, compression_ratio=0.5):
         """Compress video file"""
         try:
+            if FFMPEG_AVAILABLE:
+                return ffmpeg_engine.compress_video(video_file, compression_ratio)
+            
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
                 tmp_video.write(video_file.read())
                 tmp_video_path = tmp_video.name
@@ -135,9 +152,16 @@ class VideoProcessor:
             raise
     
     @staticmethod
-    def trim_video(video_file, start_time, end_time):
-        """Trim video to specified time range"""
+    def trim_video(video_file, start_time, end_time, exact=False):
+        """Trim video to specified time range
+
+        Fast mode cuts on the keyframe before start_time; exact mode
+        re-encodes only the partial GOP at the cut point.
+        """
         try:
+            if FFMPEG_AVAILABLE:
+                return ffmpeg_engine.trim_video(video_file, start_time, end_time, exact=exact)
+            
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
                 tmp_video.write(video_file.read())
                 tmp_video_path = tmp_video.name
@@ -166,9 +190,63 @@ class VideoProcessor:
             raise
     
     @staticmethod
-    def create_gif(video_file, fps=10, duration=None):
-        """Convert video to GIF"""
+    def merge_videos(video_files, output_format='mp4'):
+        """Join videos end to end"""
+        try:
+            if FFMPEG_AVAILABLE:
+                return ffmpeg_engine.merge(video_files, output_format)
+            if not MOVIEPY_AVAILABLE:
+                raise ImportError("ffmpeg or MoviePy is required for video processing")
+            
+            tmp_paths = []
+            for video_file in video_files:
+                with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
+                    tmp_video.write(video_file.read())
+                    tmp_paths.append(tmp_video.name)
+            
+            clips = [VideoFileClip(path) for path in tmp_paths]
+            merged = concatenate_videoclips(clips, method='compose')
+            
+            output_path = tmp_paths[0].replace('.mp4', f'_merged.{output_format}')
+            merged.write_videofile(output_path, verbose=False, logger=None)
+            
+            output = io.BytesIO()
+            with open(output_path, 'rb') as f:
+                output.write(f.read())
+            
+            # Cleanup
+            merged.close()
+            for clip in clips:
+                clip.close()
+            for path in tmp_paths + [output_path]:
+                os.unlink(path)
+            
+            output.seek(0)
+            return output
+        except Exception as e:
+            logger.error(f"Video merge error: {e}")
+            raise
+    
+    @staticmethod
+    def mute_video(video_file):
+        """Remove the audio track without re-encoding the video"""
         try:
+            if not FFMPEG_AVAILABLE:
+                raise ImportError("ffmpeg is required to mute video")
+            return ffmpeg_engine.mute_video(video_file)
+        except Exception as e:
+            logger.error(f"Video mute error: {e}")
+            raise
+    
+    @staticmethod
+    def create_gif(video_file, fps=10, duration=None, output_format='gif'):
+        """Convert video to an animated GIF (or animated WebP)"""
+        try:
+            if FFMPEG_AVAILABLE:
+                return ffmpeg_engine.create_animation(video_file, fps, duration, output_format=output_format)
+            if output_format != 'gif':
+                raise ImportError("ffmpeg is required for animated WebP output")
+            
             with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_video:
                 tmp_video.write(video_file.read())
                 tmp_video_path = tmp_video.name
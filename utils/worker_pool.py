@@ -0,0 +1,402 @@
+import contextlib
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Worker processes that run jobs; 0 runs them in the request thread
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+
+# A worker is replaced after this many jobs, or once its resident memory
+# passes the ceiling; native libraries (fitz, OpenCV, moviepy) leak and
+# fragment the heap, and a fresh process is the only reliable reset
+WORKER_MAX_JOBS = int(os.environ.get('WORKER_MAX_JOBS') or 100)
+WORKER_MAX_RSS = int(os.environ.get('WORKER_MAX_RSS_MB') or 1024) * 1024 * 1024
+
+# Address space one job may add on top of the worker's own, enforced with
+# RLIMIT_AS, and the wall-clock time after which the job is killed
+JOB_MEMORY_LIMIT = int(os.environ.get('JOB_MEMORY_LIMIT_MB') or 2048) * 1024 * 1024
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT') or 900)
+
+# Seconds a cancelled job gets to stop at its next checkpoint before its
+# worker is killed
+CANCEL_GRACE = 5
+
+# Modules imported by a new worker before it takes its first job
+PRELOAD_MODULES = ('main',)
+
+# 'forkserver' forks workers from a clean server process that has imported
+# HEAVY_MODULES once, so workers start fast and share those pages
+# copy-on-write; 'spawn' starts each from a fresh interpreter
+JOB_START_METHOD = os.environ.get('JOB_START_METHOD') or 'forkserver'
+
+# Libraries behind the processors, loaded before a worker is forked; any
+# that are not installed are skipped
+HEAVY_MODULES = ('flask', 'numpy', 'PIL.Image', 'fitz', 'cv2', 'PyPDF2', 'reportlab.pdfgen.canvas')
+
+
+class JobFailed(Exception):
+    """Raised when a job did not return normally"""
+
+
+class JobTimeout(JobFailed):
+    pass
+
+
+class JobMemoryExceeded(JobFailed):
+    pass
+
+
+class JobCancelled(BaseException):
+    """Raised at a cancellation checkpoint once the job has been cancelled
+
+    Like KeyboardInterrupt it is not an Exception, so the processors'
+    catch-all error handling lets it through to the job runner.
+    """
+
+
+class _CpuLimitExceeded(BaseException):
+    pass
+
+
+# Set in worker processes; the supervisor sets it to cancel the running job
+_cancel_event = None
+_local = threading.local()
+
+
+def cancel_requested():
+    """Whether the job running in this worker, or this thread, was cancelled"""
+    event = getattr(_local, 'cancel', None) or _cancel_event
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    """Cancellation checkpoint for long loops (pages, frames, batches)"""
+    if cancel_requested():
+        raise JobCancelled()
+
+
+@contextlib.contextmanager
+def cancellable(event):
+    """Make check_cancelled() in this thread follow event, for in-process jobs"""
+    previous = getattr(_local, 'cancel', None)
+    _local.cancel = event
+    try:
+        yield
+    finally:
+        _local.cancel = previous
+
+
+def _limit_memory(extra):
+    """Cap the address space at the current size plus extra bytes, or lift the cap"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if extra is None:
+        resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+        return
+    limit = psutil.Process().memory_info().vms + extra
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(seconds):
+    """Allow seconds more CPU time, after which SIGXCPU stops the job; None lifts it"""
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def _on_cpu_limit(signum, frame):
+    raise _CpuLimitExceeded()
+
+
+def _resolve(target):
+    module, name = target.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _worker_main(conn, cancel_event, preload, memory_limit):
+    """Job loop of a worker process: run one job per message until told to stop"""
+    global _cancel_event
+    _cancel_event = cancel_event
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning(f"Worker could not preload {module}: {e}")
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message is None:
+            return
+
+        target, args, kwargs, wants_progress, cpu_limit = message
+        if wants_progress:
+            kwargs['progress'] = lambda fraction, **fields: conn.send(('progress', fraction, fields))
+        try:
+            function = _resolve(target)
+            _limit_memory(memory_limit)
+            _limit_cpu(cpu_limit)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                _limit_cpu(None)
+                _limit_memory(None)
+            conn.send(('result', result))
+        except JobCancelled:
+            conn.send(('cancelled', None))
+        except _CpuLimitExceeded:
+            conn.send(('cpu', None))
+        except MemoryError:
+            conn.send(('memory', None))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, preload, memory_limit):
+        self.conn, child_conn = context.Pipe()
+        self.cancel = context.Event()
+        self.process = context.Process(target=_worker_main, args=(child_conn, self.cancel, preload, memory_limit),
+                                       name='job-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.busy = False
+        self.broken = False
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def rss(self):
+        try:
+            return psutil.Process(self.pid).memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def stop(self, timeout=5):
+        """Ask an idle worker to exit, killing it if it does not"""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        """Kill the worker together with anything it started (ffmpeg, LibreOffice)"""
+        try:
+            parent = psutil.Process(self.pid)
+            for child in parent.children(recursive=True):
+                child.kill()
+            parent.kill()
+        except psutil.Error:
+            pass
+        self.process.join(5)
+        self.broken = True
+
+
+class WorkerSupervisor:
+    """A pool of job processes that are recycled before they bloat
+
+    run() hands a job to an idle worker and waits for its result, relaying
+    progress messages to the caller's callback on the way. Each job runs
+    under its own address-space limit, CPU-time limit and wall-clock
+    deadline; a job that breaks one loses its worker, which is killed and
+    replaced. Between jobs a worker that has served max_jobs, or whose RSS
+    is over max_rss, is stopped and replaced, so recycling never
+    interrupts a job. Callers queue when every worker is busy.
+
+    Setting the cancel event passed to run() drops a queued job, or asks
+    a running one to stop at its next check_cancelled() and kills its
+    worker if it has not within CANCEL_GRACE seconds.
+    """
+
+    def __init__(self, size=JOB_WORKERS, max_jobs=WORKER_MAX_JOBS, max_rss=WORKER_MAX_RSS,
+                 job_memory=JOB_MEMORY_LIMIT, job_timeout=JOB_TIMEOUT, preload=PRELOAD_MODULES):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.job_memory = job_memory
+        self.job_timeout = job_timeout
+        self.preload = preload
+
+        # Never forked from the server itself: forking a threaded server can
+        # copy held locks. The fork server is a separate, single-threaded process
+        self._context = multiprocessing.get_context(JOB_START_METHOD)
+        if JOB_START_METHOD == 'forkserver':
+            self._context.set_forkserver_preload(list(HEAVY_MODULES))
+        self._condition = threading.Condition()
+        self._workers = [self._spawn() for _ in range(size)]
+        self._metrics = {'jobs': 0, 'failed': 0, 'cancelled': 0, 'recycled_max_jobs': 0, 'recycled_rss': 0,
+                         'killed_timeout': 0, 'killed_cpu': 0, 'killed_memory': 0, 'crashed': 0}
+
+    def _spawn(self):
+        return _Worker(self._context, self.preload, self.job_memory)
+
+    def _count(self, key):
+        with self._condition:
+            self._metrics[key] += 1
+
+    def run(self, target, *args, progress=None, timeout=None, cpu_limit=None, cancel=None, **kwargs):
+        """Run target ('module:function') in a worker and return its result
+
+        With a progress callback, the function is called with a progress
+        keyword argument whose calls are relayed back here. timeout and
+        cpu_limit are wall-clock and CPU seconds for this job.
+        """
+        worker = self._checkout(cancel)
+        try:
+            worker.cancel.clear()
+            worker.conn.send((target, args, kwargs, progress is not None, cpu_limit))
+            return self._wait(worker, time.monotonic() + (timeout or self.job_timeout), progress, cancel)
+        finally:
+            self._checkin(worker)
+
+    def _wait(self, worker, deadline, progress, cancel):
+        stop_by = None
+        while True:
+            now = time.monotonic()
+            if cancel is not None and cancel.is_set() and stop_by is None:
+                worker.cancel.set()
+                stop_by = now + CANCEL_GRACE
+            if stop_by is not None and now >= stop_by:
+                worker.kill()
+                self._count('cancelled')
+                raise JobCancelled()
+            if now >= deadline:
+                worker.kill()
+                self._count('killed_timeout')
+                raise JobTimeout("Job ran past its time limit")
+            try:
+                if not worker.conn.poll(min(deadline - now, 0.25)):
+                    if not worker.process.is_alive():
+                        raise EOFError
+                    continue
+                kind, *payload = worker.conn.recv()
+            except (EOFError, OSError):
+                # A native allocation past RLIMIT_AS usually aborts the process
+                worker.kill()
+                self._count('crashed')
+                raise JobFailed(f"Worker exited with code {worker.process.exitcode}")
+
+            if kind == 'progress':
+                if progress is not None:
+                    progress(payload[0], **payload[1])
+                continue
+            worker.jobs += 1
+            self._count('jobs')
+            if kind == 'cancelled' or stop_by is not None:
+                # Whatever a cancelled job produced is discarded
+                self._count('cancelled')
+                raise JobCancelled()
+            if kind == 'result':
+                return payload[0]
+            if kind == 'cpu':
+                worker.broken = True
+                self._count('killed_cpu')
+                raise JobTimeout("Job ran past its CPU time limit")
+            if kind == 'memory':
+                # The heap is likely fragmented now; replace the worker
+                worker.broken = True
+                self._count('killed_memory')
+                raise JobMemoryExceeded(f"Job exceeded {self.job_memory // (1024 * 1024)} MB")
+            self._count('failed')
+            raise JobFailed(payload[0])
+
+    def _checkout(self, cancel=None):
+        with self._condition:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    self._metrics['cancelled'] += 1
+                    raise JobCancelled()
+                for worker in self._workers:
+                    if not worker.busy:
+                        worker.busy = True
+                        return worker
+                self._condition.wait(0.5 if cancel is not None else None)
+
+    def _checkin(self, worker):
+        reason = None
+        if worker.broken:
+            reason = 'broken'
+        elif worker.jobs >= self.max_jobs:
+            reason = 'recycled_max_jobs'
+        elif worker.rss() > self.max_rss:
+            reason = 'recycled_rss'
+
+        if reason is not None:
+            if reason != 'broken':
+                logger.info(f"Recycling worker {worker.pid} after {worker.jobs} jobs "
+                            f"({worker.rss() / (1024 * 1024):.0f} MB RSS)")
+                self._count(reason)
+                worker.stop()
+            replacement = self._spawn()
+
+        with self._condition:
+            if reason is not None:
+                self._workers[self._workers.index(worker)] = replacement
+            else:
+                worker.busy = False
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            workers = list(self._workers)
+            metrics = dict(self._metrics)
+        metrics['workers'] = [{'pid': worker.pid, 'jobs': worker.jobs, 'busy': worker.busy,
+                               'rss_mb': round(worker.rss() / (1024 * 1024), 1)} for worker in workers]
+        return metrics
+
+    def shutdown(self):
+        with self._condition:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            if worker.busy:
+                worker.kill()
+            else:
+                worker.stop()
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """The process-wide supervisor, started on first use"""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = WorkerSupervisor()
+        return _supervisor
+
+
+def shutdown_supervisor():
+    """Stop the process-wide supervisor's workers, if it was started"""
+    global _supervisor
+    with _supervisor_lock:
+        supervisor, _supervisor = _supervisor, None
+    if supervisor is not None:
+        supervisor.shutdown()